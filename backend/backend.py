@@ -3,20 +3,22 @@ Usage:
 uvicorn backend:app
 """
 import os
+import asyncio
 import json
 import secrets
 import base64
+import hashlib
 import time
 import datetime
-from collections import deque
-import threading
+import inspect
 from typing import List, Optional, Union
 import traceback
 
-from fastapi import FastAPI, Request, HTTPException, Form, UploadFile, File
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, Response, HTTPException, Form, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from jose import JWTError, jwt
 from pathlib import Path
@@ -24,13 +26,29 @@ from cryptography.fernet import Fernet
 from google_auth_oauthlib.flow import Flow
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request as GoogleRequest
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 
+from send_queue import SendQueue
+from state import open_store
+from scheduler import FairScheduler, INTERACTIVE, BULK
+from quota import QuotaTracker, QuotaExceeded
+from response_cache import ResponseCache, DiskTier
+from events import EventHub
+import projection
+import metrics
+from metrics import stage
+
+GMAIL_API = os.environ.get("GMAIL_API", "google")
+if GMAIL_API == "fake":
+    from fake_gmail import build
+
 CLIENT_SECRETS_FILE = os.environ.get("CLIENT_SECRETS_FILE", "credentials.json")
 SCOPES = [
     "openid",
@@ -39,20 +57,47 @@ SCOPES = [
     "https://www.googleapis.com/auth/userinfo.email",
     "https://www.googleapis.com/auth/userinfo.profile",
 ]
-JWT_SECRET = os.environ.get("JWT_SECRET", secrets.token_urlsafe(32))
+STATE_STORE = open_store()
+OAUTH_STATE_TTL = int(os.environ.get("OAUTH_STATE_TTL", "600"))
+
+# Without explicit keys every worker sharing STATE_STORE agrees on one generated pair.
+JWT_SECRET = os.environ.get("JWT_SECRET") or STATE_STORE.set_if_absent("secret:jwt", secrets.token_urlsafe(32))
 JWT_ALGORITHM = "HS256"
 TOKEN_STORE_DIR = os.environ.get("TOKEN_STORE_DIR", "./tokens")
+SEND_QUEUE_DB = os.environ.get("SEND_QUEUE_DB", "./send_queue.db")
+SEND_WORKERS = int(os.environ.get("SEND_WORKERS", "4"))
+SEND_JOB_RETENTION = int(os.environ.get("SEND_JOB_RETENTION", str(7 * 24 * 3600)))
+# Kept below the threadpool size (40) so admitted requests never wait for a thread.
+GMAIL_CONCURRENCY = int(os.environ.get("GMAIL_CONCURRENCY", "32"))
+USER_CONCURRENCY = int(os.environ.get("USER_CONCURRENCY", "4"))
+# Quota units per rolling minute, kept below Google's 15,000 per user and 1,200,000 per project.
+GMAIL_USER_QUOTA = int(os.environ.get("GMAIL_USER_QUOTA", "12000"))
+GMAIL_PROJECT_QUOTA = int(os.environ.get("GMAIL_PROJECT_QUOTA", "1000000"))
+RESPONSE_CACHE_USER_BYTES = int(os.environ.get("RESPONSE_CACHE_USER_BYTES", str(8 * 1024 * 1024)))
+RESPONSE_CACHE_BYTES = int(os.environ.get("RESPONSE_CACHE_BYTES", str(256 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR")
+RESPONSE_CACHE_DISK_BYTES = int(os.environ.get("RESPONSE_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+EVENTS_POLL_INTERVAL = float(os.environ.get("EVENTS_POLL_INTERVAL", "20"))
+EVENTS_HEARTBEAT = 15
+WS_MAX_IN_FLIGHT = int(os.environ.get("WS_MAX_IN_FLIGHT", "64"))
 
 _fkey = os.environ.get("FERNET_KEY")
 if _fkey:
     FERNET_KEY = _fkey.encode() if isinstance(_fkey, str) else _fkey
 else:
-    FERNET_KEY = Fernet.generate_key()
+    FERNET_KEY = STATE_STORE.set_if_absent("secret:fernet", Fernet.generate_key().decode()).encode()
 fernet = Fernet(FERNET_KEY)
 
 os.makedirs(TOKEN_STORE_DIR, exist_ok=True)
 
-app = FastAPI()
+class TimedJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        with stage("serialize"):
+            return super().render(content)
+
+
+app = FastAPI(default_response_class=TimedJSONResponse)
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
 )
@@ -105,6 +150,74 @@ def load_token(user_id: str) -> dict:
         return decrypt_token(f.read())
 
 
+def get_user_id(request: Request) -> str:
+    # the scheduling middleware verifies the token first; the route reuses its result
+    user_id = getattr(request.state, "user_id", None)
+    if user_id is not None:
+        return user_id
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        raise HTTPException(401, "Missing session token")
+    session_token = auth_header.split(" ", 1)[1]
+    with stage("jwt"):
+        user_id = verify_jwt(session_token)
+    request.state.user_id = user_id
+    return user_id
+
+
+def get_credentials(user_id: str) -> Credentials:
+    with stage("load_token"):
+        token_json = load_token(user_id)
+        creds = Credentials.from_authorized_user_info(token_json, SCOPES)
+    if creds.expired and creds.refresh_token:
+        with stage("refresh"):
+            creds.refresh(GoogleRequest())
+            save_token(user_id, json.loads(creds.to_json()))
+    return creds
+
+
+DISCOVERY_DOCS: dict = {}
+CLIENT_CONFIG: Optional[dict] = None
+SERVICES = (("gmail", "v1"), ("oauth2", "v2"))
+
+
+def discovery_doc(name: str, version: str) -> Optional[dict]:
+    key = (name, version)
+    if key not in DISCOVERY_DOCS:
+        doc = get_static_doc(name, version)
+        DISCOVERY_DOCS[key] = json.loads(doc) if doc else None
+    return DISCOVERY_DOCS[key]
+
+
+def build_service(name: str, version: str, creds: Credentials):
+    with stage("build"):
+        doc = discovery_doc(name, version) if GMAIL_API != "fake" else None
+        if doc is None:
+            return build(name, version, credentials=creds)
+        return build_from_document(doc, credentials=creds)
+
+
+def client_config() -> dict:
+    global CLIENT_CONFIG
+    if CLIENT_CONFIG is None:
+        with open(CLIENT_SECRETS_FILE, "r") as f:
+            CLIENT_CONFIG = json.load(f)
+    return CLIENT_CONFIG
+
+
+def make_flow() -> Flow:
+    return Flow.from_client_config(
+        client_config(), scopes=SCOPES, redirect_uri="http://127.0.0.1:8080/"
+    )
+
+
+quota = QuotaTracker(STATE_STORE, GMAIL_USER_QUOTA, GMAIL_PROJECT_QUOTA)
+
+
+def execute(gmail_request, user_id: str):
+    return quota.execute(gmail_request, user_id)
+
+
 def make_jwt(user_id: str, expires_minutes: int = 60 * 24) -> str:
     exp_ts = int((datetime.datetime.utcnow() + datetime.timedelta(minutes=expires_minutes)).timestamp())
     payload = {"sub": user_id, "exp": exp_ts}
@@ -119,53 +232,91 @@ def verify_jwt(token: str) -> str:
         raise HTTPException(401, "Invalid session token")
 
 
+# --- conditional requests ---
+# A message's content never changes, so its ETag only depends on who asked for
+# which representation. Bump ETAG_VERSION when a response shape changes.
+ETAG_VERSION = "1"
+MESSAGE_CACHE_CONTROL = "private, max-age=86400"
+
+
+def message_etag(user_id: str, message_id: str, variant: str) -> str:
+    digest = hashlib.sha256(f"{ETAG_VERSION}:{user_id}:{message_id}:{variant}".encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def not_modified(if_none_match: Optional[str], etag: str) -> Optional[Response]:
+    if not if_none_match:
+        return None
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    tags = [t.strip() for t in if_none_match.split(",")]
+    tags = [t[2:] if t.startswith("W/") else t for t in tags]
+    hit = etag in tags
+    metrics.record_cache("etag", hit)
+    if not hit:
+        return None
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": MESSAGE_CACHE_CONTROL})
+
+
+# --- response cache: parsed and metadata responses, per user ---
+CACHED_FORMATS = ("metadata", "minimal")
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_USER_BYTES,
+    RESPONSE_CACHE_BYTES,
+    RESPONSE_CACHE_TTL,
+    disk=DiskTier(RESPONSE_CACHE_DIR, RESPONSE_CACHE_DISK_BYTES, fernet.encrypt, fernet.decrypt) if RESPONSE_CACHE_DIR else None,
+)
+
+
+def requested_fields(fields: Optional[str], translate=None):
+    """(selection tree, Gmail request arguments) for a `fields` parameter; (None, None) without one."""
+    if fields is None:
+        return None, None
+    try:
+        tree = projection.parse(fields)
+        return tree, translate(tree) if translate else None
+    except ValueError as e:
+        raise HTTPException(400, f"Invalid fields: {e}")
+
+
+def cached_json(user_id: str, key: str, headers: dict, produce) -> Response:
+    body = response_cache.get(user_id, key)
+    if body is not None:
+        return Response(content=body, media_type="application/json", headers=headers)
+    response = TimedJSONResponse(produce(), headers=headers)
+    response_cache.put(user_id, key, response.body)
+    return response
+
+
 MAX_EMAILS = 10
 WINDOW_SECONDS = 60
 MAX_ATTACHMENTS = 10
 ATTACHMENT_WINDOW_SECONDS = 60
-RATE_LIMIT_STORE: dict = {}
-ATTACHMENT_RATE_LIMIT_STORE: dict = {}
-RATE_LIMIT_LOCK = threading.Lock()
-ATTACHMENT_RATE_LIMIT_LOCK = threading.Lock()
 
 
 def check_rate(user_id: str):
-    now = time.time()
-    with RATE_LIMIT_LOCK:
-        dq = RATE_LIMIT_STORE.get(user_id)
-        if dq is None:
-            dq = deque()
-            RATE_LIMIT_STORE[user_id] = dq
-        while dq and now - dq[0] >= WINDOW_SECONDS:
-            dq.popleft()
-        if len(dq) >= MAX_EMAILS:
-            retry_after = int(WINDOW_SECONDS - (now - dq[0])) + 1
-            headers = {"Retry-After": str(retry_after)}
-            raise HTTPException(
-                status_code=429,
-                detail=f"Rate limit exceeded: max {MAX_EMAILS} emails per {WINDOW_SECONDS} seconds",
-                headers=headers,
-            )
-        dq.append(now)
+    wait = STATE_STORE.hit(f"rate:send:{user_id}", WINDOW_SECONDS, MAX_EMAILS)
+    if wait is not None:
+        metrics.RATE_LIMIT_REJECTIONS.inc("send")
+        retry_after = int(wait) + 1
+        headers = {"Retry-After": str(retry_after)}
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit exceeded: max {MAX_EMAILS} emails per {WINDOW_SECONDS} seconds",
+            headers=headers,
+        )
 
 def check_attachment_rate(user_id: str):
-    now = time.time()
-    with ATTACHMENT_RATE_LIMIT_LOCK:
-        dq = ATTACHMENT_RATE_LIMIT_STORE.get(user_id)
-        if dq is None:
-            dq = deque()
-            ATTACHMENT_RATE_LIMIT_STORE[user_id] = dq
-        while dq and now - dq[0] >= ATTACHMENT_WINDOW_SECONDS:
-            dq.popleft()
-        if len(dq) >= MAX_ATTACHMENTS:
-            retry_after = int(ATTACHMENT_WINDOW_SECONDS - (now - dq[0])) + 1
-            headers = {"Retry-After": str(retry_after)}
-            raise HTTPException(
-                status_code=429,
-                detail=f"Attachment rate limit exceeded: max {MAX_ATTACHMENTS} downloads per minute",
-                headers=headers,
-            )
-        dq.append(now)
+    wait = STATE_STORE.hit(f"rate:attachment:{user_id}", ATTACHMENT_WINDOW_SECONDS, MAX_ATTACHMENTS)
+    if wait is not None:
+        metrics.RATE_LIMIT_REJECTIONS.inc("attachment")
+        retry_after = int(wait) + 1
+        headers = {"Retry-After": str(retry_after)}
+        raise HTTPException(
+            status_code=429,
+            detail=f"Attachment rate limit exceeded: max {MAX_ATTACHMENTS} downloads per minute",
+            headers=headers,
+        )
 
 def make_msg(req: EmailRequest) -> str:
     if req.attachments:
@@ -267,29 +418,22 @@ def parse_email_body(message: dict) -> dict:
     
     return result
 
-OAUTH_STATE = {}
-
 @app.get("/authorize")
 def authorize():
-    flow = Flow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE, scopes=SCOPES, redirect_uri="http://127.0.0.1:8080/"
-    )
+    flow = make_flow()
     auth_url, state = flow.authorization_url(
         prompt="consent", access_type="offline", include_granted_scopes="true"
     )
-    OAUTH_STATE[state] = time.time()
+    STATE_STORE.set(f"oauth_state:{state}", str(time.time()), ttl=OAUTH_STATE_TTL)
     return {"auth_url": auth_url, "state": state}
 
 
 @app.post("/exchange_code")
 def exchange_code(req: ExchangeRequest):
-    if not req.state or req.state not in OAUTH_STATE:
+    if not req.state or STATE_STORE.pop(f"oauth_state:{req.state}") is None:
         raise HTTPException(400, "Invalid or missing state")
-    OAUTH_STATE.pop(req.state, None)
 
-    flow = Flow.from_client_secrets_file(
-        CLIENT_SECRETS_FILE, scopes=SCOPES, redirect_uri="http://127.0.0.1:8080/"
-    )
+    flow = make_flow()
     flow.fetch_token(code=req.code)
     creds = flow.credentials
     token_json = json.loads(creds.to_json())
@@ -298,6 +442,59 @@ def exchange_code(req: ExchangeRequest):
     session_token = make_jwt(user_id)
     return JSONResponse(content={"session_token": session_token})
 
+# --- scheduling: routes that call Gmail, by priority class ---
+ROUTE_PRIORITY = {
+    "send_email": INTERACTIVE,
+    "me": INTERACTIVE,
+    "list_emails": BULK,
+    "get_email": BULK,
+    "get_parsed_email": BULK,
+    "get_thread": BULK,
+    "get_attachment": BULK,
+}
+scheduler = FairScheduler(GMAIL_CONCURRENCY, USER_CONCURRENCY)
+
+
+@app.middleware("http")
+async def schedule(request: Request, call_next):
+    priority = ROUTE_PRIORITY.get(request.url.path.split("/")[1])
+    if priority is None:
+        return await call_next(request)
+    try:
+        user_id = get_user_id(request)
+    except HTTPException:
+        # the route itself answers with 401
+        return await call_next(request)
+    async with scheduler.slot(user_id, priority):
+        response = await call_next(request)
+    # lets clients pace themselves before they run into 429s
+    limit, remaining, reset = await run_in_threadpool(quota.status, user_id)
+    response.headers["X-Quota-Limit"] = str(limit)
+    response.headers["X-Quota-Remaining"] = str(remaining)
+    response.headers["X-Quota-Reset"] = f"{reset:.1f}"
+    return response
+
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        metrics.REQUESTS.inc(path, request.method, str(status))
+        metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, path, request.method)
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     errors = [
@@ -313,6 +510,45 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
         content={"detail": errors}
     )
 
+@app.exception_handler(QuotaExceeded)
+async def quota_exception_handler(request: Request, exc: QuotaExceeded):
+    metrics.RATE_LIMIT_REJECTIONS.inc(f"quota_{exc.scope}")
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(exc.retry_after) + 1)},
+    )
+
+
+def deliver(user_id: str, send_body: dict) -> dict:
+    creds = get_credentials(user_id)
+    service = build_service("gmail", "v1", creds)
+    return execute(service.users().messages().send(userId="me", body=send_body), user_id)
+
+
+send_queue = SendQueue(
+    SEND_QUEUE_DB, deliver, workers=SEND_WORKERS, encrypt=fernet.encrypt, decrypt=fernet.decrypt,
+    retry_on=(QuotaExceeded,), keep_finished=SEND_JOB_RETENTION,
+)
+
+
+@app.on_event("startup")
+def start_send_queue():
+    send_queue.start()
+
+
+@app.on_event("startup")
+def warm_up():
+    # Parse the discovery documents once, so the first requests don't pay for the
+    # JSON parsing. Each request still builds its own Resource around its user's
+    # credentials: Resources hold their http object, which isn't thread-safe.
+    if GMAIL_API != "fake":
+        for name, version in SERVICES:
+            discovery_doc(name, version)
+    if os.path.exists(CLIENT_SECRETS_FILE):
+        client_config()
+
+
 @app.post("/send_email")
 async def send_email(
     request: Request,
@@ -323,26 +559,15 @@ async def send_email(
     body: Optional[str] = Form(None),
     html: Optional[str] = Form(None),
     reply: Optional[str] = Form(None),
+    background: bool = Form(False),
     attachments: List[UploadFile] = File(default=[])
 ):
     # --- auth ---
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(401, "Missing session token")
-    session_token = auth_header.split(" ")[1]
-    user_id = verify_jwt(session_token)
+    user_id = get_user_id(request)
 
     # --- rate limit ---
     check_rate(user_id)
 
-    # --- credentials ---
-    token_json = load_token(user_id)
-    creds = Credentials.from_authorized_user_info(token_json, SCOPES)
-    if creds.expired and creds.refresh_token:
-        creds.refresh(GoogleRequest())
-        save_token(user_id, json.loads(creds.to_json()))
-    service = build("gmail", "v1", credentials=creds)
-
     # --- hi how's your day going ---
     to_list = to
     cc_list = cc
@@ -388,26 +613,31 @@ async def send_email(
     send_body = {"raw": raw}
     if reply:
         send_body["threadId"] = reply
-    
-    result = service.users().messages().send(userId="me", body=send_body).execute()
+
+    # --- background mode: hand off to the send workers ---
+    if background:
+        job_id = send_queue.enqueue(user_id, send_body)
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued"})
+
+    result = await run_in_threadpool(deliver, user_id, send_body)
     return {"message_id": result["id"], "thread_id": result.get("threadId")}
 
+
+@app.get("/send_status/{job_id}")
+def send_status(request: Request, job_id: str):
+    user_id = get_user_id(request)
+    status = send_queue.status(user_id, job_id)
+    if status is None:
+        raise HTTPException(404, "Send job not found")
+    return status
+
 @app.get("/me")
 def me(request: Request):
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(401, "Missing session token")
-    session_token = auth_header.split(" ", 1)[1]
-    user_id = verify_jwt(session_token)
-
-    token_json = load_token(user_id)
-    creds = Credentials.from_authorized_user_info(token_json, SCOPES)
-    if creds.expired and creds.refresh_token:
-        creds.refresh(GoogleRequest())
-        save_token(user_id, json.loads(creds.to_json()))
+    user_id = get_user_id(request)
+    creds = get_credentials(user_id)
 
-    oauth2 = build("oauth2", "v2", credentials=creds)
-    user_info = oauth2.userinfo().get().execute()
+    oauth2 = build_service("oauth2", "v2", creds)
+    user_info = execute(oauth2.userinfo().get(), user_id)
     return {"user": user_info}
 
 @app.get("/list_emails")
@@ -415,23 +645,28 @@ def list_emails(
     request: Request,
     max_results: int = 10,
     query: Optional[str] = None,
-    page_token: Optional[str] = None
+    page_token: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     # --- auth ---
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(401, "Missing session token")
-    session_token = auth_header.split(" ")[1]
-    user_id = verify_jwt(session_token)
+    user_id = get_user_id(request)
+    return fetch_list(user_id, max_results, query, page_token, fields)
+
+
+# The fetch_* functions do the work of the read routes for an authenticated user,
+# so the routes and the WebSocket channel (/ws) share them.
+def fetch_list(
+    user_id: str,
+    max_results: int = 10,
+    query: Optional[str] = None,
+    page_token: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    tree, gmail_fields = requested_fields(fields, projection.list_fields)
 
     # --- credentials ---
-    token_json = load_token(user_id)
-    creds = Credentials.from_authorized_user_info(token_json, SCOPES)
-    if creds.expired and creds.refresh_token:
-        creds.refresh(GoogleRequest())
-        save_token(user_id, json.loads(creds.to_json()))
-    
-    service = build("gmail", "v1", credentials=creds)
+    creds = get_credentials(user_id)
+    service = build_service("gmail", "v1", creds)
     
     # List messages
     params = {"userId": "me", "maxResults": max_results}
@@ -439,103 +674,318 @@ def list_emails(
         params["q"] = query
     if page_token:
         params["pageToken"] = page_token
+    if gmail_fields:
+        params["fields"] = gmail_fields
     
-    results = service.users().messages().list(**params).execute()
+    results = execute(service.users().messages().list(**params), user_id)
     messages = results.get("messages", [])
     
-    return {
+    return projection.project({
         "messages": messages,
         "next_page_token": results.get("nextPageToken"),
         "result_size_estimate": results.get("resultSizeEstimate")
-    }
+    }, tree)
 
 @app.get("/get_email/{message_id}")
-def get_email(request: Request, message_id: str, format: str = "full"):
+def get_email(request: Request, message_id: str, format: str = "full", fields: Optional[str] = None):
     # --- auth ---
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(401, "Missing session token")
-    session_token = auth_header.split(" ")[1]
-    user_id = verify_jwt(session_token)
+    user_id = get_user_id(request)
+    return fetch_email(user_id, message_id, format, fields, request.headers.get("If-None-Match"))
 
-    # --- credentials ---
-    token_json = load_token(user_id)
-    creds = Credentials.from_authorized_user_info(token_json, SCOPES)
-    if creds.expired and creds.refresh_token:
-        creds.refresh(GoogleRequest())
-        save_token(user_id, json.loads(creds.to_json()))
-    
-    service = build("gmail", "v1", credentials=creds)
-    
-    # Get message
-    message = service.users().messages().get(
-        userId="me", 
-        id=message_id,
-        format=format
-    ).execute()
-    
-    return message
+
+def fetch_email(user_id: str, message_id: str, format: str = "full", fields: Optional[str] = None, if_none_match: Optional[str] = None):
+    # the fields are Gmail's own, so they are forwarded as they are
+    tree, _ = requested_fields(fields)
+    variant = f"message:{format}" + (f":{projection.render(tree)}" if tree else "")
+
+    # --- conditional request: the client already has this message ---
+    etag = message_etag(user_id, message_id, variant)
+    cached = not_modified(if_none_match, etag)
+    if cached is not None:
+        return cached
+
+    def fetch():
+        # --- credentials ---
+        creds = get_credentials(user_id)
+        service = build_service("gmail", "v1", creds)
+
+        # Get message
+        params = {"userId": "me", "id": message_id, "format": format}
+        if tree:
+            params["fields"] = projection.render(tree)
+        return projection.project(execute(service.users().messages().get(**params), user_id), tree)
+
+    headers = {"ETag": etag, "Cache-Control": MESSAGE_CACHE_CONTROL}
+    if format in CACHED_FORMATS:
+        return cached_json(user_id, f"{variant}:{message_id}", headers, fetch)
+    return TimedJSONResponse(fetch(), headers=headers)
 
 
 @app.get("/get_parsed_email/{message_id}")
-def get_parsed_email(request: Request, message_id: str):
+def get_parsed_email(request: Request, message_id: str, fields: Optional[str] = None):
     # --- auth ---
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(401, "Missing session token")
-    session_token = auth_header.split(" ")[1]
-    user_id = verify_jwt(session_token)
+    user_id = get_user_id(request)
+    return fetch_parsed_email(user_id, message_id, fields, request.headers.get("If-None-Match"))
+
+
+def fetch_parsed_email(user_id: str, message_id: str, fields: Optional[str] = None, if_none_match: Optional[str] = None):
+    tree, gmail = requested_fields(fields, projection.parsed_fields)
+    variant = "parsed" + (f":{projection.render(tree)}" if tree else "")
+
+    # --- conditional request: the client already has this message ---
+    etag = message_etag(user_id, message_id, variant)
+    cached = not_modified(if_none_match, etag)
+    if cached is not None:
+        return cached
+
+    def fetch():
+        # --- credentials ---
+        creds = get_credentials(user_id)
+        service = build_service("gmail", "v1", creds)
+
+        # Get message
+        params = {"userId": "me", "id": message_id, "format": "full"}
+        if gmail:
+            gmail_fields, params["format"], metadata_headers = gmail
+            params["fields"] = gmail_fields
+            if metadata_headers:
+                params["metadataHeaders"] = metadata_headers
+        message = execute(service.users().messages().get(**params), user_id)
+
+        with stage("parse"):
+            return projection.project(parse_email_body(message), tree)
+
+    headers = {"ETag": etag, "Cache-Control": MESSAGE_CACHE_CONTROL}
+    return cached_json(user_id, f"{variant}:{message_id}", headers, fetch)
+
+
+@app.get("/get_thread/{thread_id}")
+def get_thread(request: Request, thread_id: str, fields: Optional[str] = None):
+    # --- auth ---
+    user_id = get_user_id(request)
+    return fetch_thread(user_id, thread_id, fields)
+
+
+def fetch_thread(user_id: str, thread_id: str, fields: Optional[str] = None):
+    tree, gmail = requested_fields(fields, projection.thread_fields)
 
     # --- credentials ---
-    token_json = load_token(user_id)
-    creds = Credentials.from_authorized_user_info(token_json, SCOPES)
-    if creds.expired and creds.refresh_token:
-        creds.refresh(GoogleRequest())
-        save_token(user_id, json.loads(creds.to_json()))
-    
-    service = build("gmail", "v1", credentials=creds)
-    
-    # Get message
-    message = service.users().messages().get(
-        userId="me", 
-        id=message_id,
-        format="full"
-    ).execute()
-    
-    return parse_email_body(message)
+    creds = get_credentials(user_id)
+    service = build_service("gmail", "v1", creds)
+
+    # One threads.get instead of a search plus a messages.get per message
+    params = {"userId": "me", "id": thread_id, "format": "full"}
+    if gmail:
+        gmail_fields, params["format"], metadata_headers = gmail
+        params["fields"] = gmail_fields
+        if metadata_headers:
+            params["metadataHeaders"] = metadata_headers
+    thread = execute(service.users().threads().get(**params), user_id)
+
+    with stage("parse"):
+        messages = [parse_email_body(message) for message in thread.get("messages", [])]
+        return projection.project({"id": thread.get("id", thread_id), "messages": messages}, tree)
+
+
+def mailbox_changes(user_id: str, cursor: Optional[str]):
+    creds = get_credentials(user_id)
+    service = build_service("gmail", "v1", creds)
+    if cursor is None:
+        profile = execute(service.users().getProfile(userId="me"), user_id)
+        return profile["historyId"], []
+
+    events = []
+    params = {"userId": "me", "startHistoryId": cursor, "historyTypes": ["messageAdded"]}
+    while True:
+        try:
+            results = execute(service.users().history().list(**params), user_id)
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+            # cursor too old for Gmail's history: start over, clients re-list
+            profile = execute(service.users().getProfile(userId="me"), user_id)
+            return profile["historyId"], [{"type": "resync"}]
+        for record in results.get("history", []):
+            for added in record.get("messagesAdded", []):
+                message = added["message"]
+                events.append({
+                    "type": "message_added",
+                    "history_id": record["id"],
+                    "id": message["id"],
+                    "thread_id": message.get("threadId"),
+                    "labels": message.get("labelIds", []),
+                })
+        cursor = results.get("historyId", cursor)
+        if not results.get("nextPageToken"):
+            return cursor, events
+        params["pageToken"] = results["nextPageToken"]
+
+
+async def poll_changes(user_id: str, cursor: Optional[str]):
+    async with scheduler.slot(user_id, BULK):
+        return await run_in_threadpool(mailbox_changes, user_id, cursor)
+
+
+event_hub = EventHub(poll_changes, EVENTS_POLL_INTERVAL)
+
+
+@app.get("/events")
+async def events(request: Request):
+    # --- auth ---
+    user_id = get_user_id(request)
+
+    # a reconnecting EventSource sends the last id it saw
+    since = request.headers.get("Last-Event-ID") or request.query_params.get("since")
+    if since is not None and not since.isdigit():
+        since = None
+
+    async def stream():
+        async with event_hub.subscribe(user_id, since) as queue:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                message = f"event: {event['type']}\n"
+                if event.get("history_id"):
+                    message += f"id: {event['history_id']}\n"
+                yield message + f"data: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/get_attachment/{message_id}/{attachment_id}")
 def get_attachment(request: Request, message_id: str, attachment_id: str):
     # --- auth ---
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(401, "Missing session token")
-    session_token = auth_header.split(" ")[1]
-    user_id = verify_jwt(session_token)
+    user_id = get_user_id(request)
+    return fetch_attachment(user_id, message_id, attachment_id)
+
 
+def fetch_attachment(user_id: str, message_id: str, attachment_id: str):
     # --- rate limit for attachments ---
     check_attachment_rate(user_id)
 
     # --- credentials ---
-    token_json = load_token(user_id)
-    creds = Credentials.from_authorized_user_info(token_json, SCOPES)
-    if creds.expired and creds.refresh_token:
-        creds.refresh(GoogleRequest())
-        save_token(user_id, json.loads(creds.to_json()))
-    
-    service = build("gmail", "v1", credentials=creds)
+    creds = get_credentials(user_id)
+    service = build_service("gmail", "v1", creds)
     
     # Get attachment
-    attachment = service.users().messages().attachments().get(
+    attachment = execute(service.users().messages().attachments().get(
         userId="me",
         messageId=message_id,
         id=attachment_id
-    ).execute()
+    ), user_id)
     
     # Return base64 encoded data
     return {
         "attachment_id": attachment_id,
         "data": attachment["data"],
         "size": attachment.get("size", 0)
-    }
\ No newline at end of file
+    }
+
+
+# --- multiplexed requests: many tagged reads over one authenticated WebSocket ---
+# op -> (route it stands for, function doing the work)
+WS_OPS = {
+    "list": ("list_emails", fetch_list),
+    "get": ("get_email", fetch_email),
+    "parsed": ("get_parsed_email", fetch_parsed_email),
+    "thread": ("get_thread", fetch_thread),
+    "attachment": ("get_attachment", fetch_attachment),
+}
+
+
+def ws_response(handler, user_id: str, params: dict) -> Response:
+    response = handler(user_id, **params)
+    if not isinstance(response, Response):
+        response = TimedJSONResponse(response)
+    limit, remaining, reset = quota.status(user_id)
+    response.headers["X-Quota-Limit"] = str(limit)
+    response.headers["X-Quota-Remaining"] = str(remaining)
+    response.headers["X-Quota-Reset"] = f"{reset:.1f}"
+    return response
+
+
+async def ws_call(user_id: str, expires: Optional[int], text: str) -> bytes:
+    """Answer one request frame, {"id", "op", "params"}: a JSON line with the id,
+    status and headers, then the body exactly as the HTTP route would send it."""
+    start = time.perf_counter()
+    tag, op = None, "invalid"
+    try:
+        try:
+            message = json.loads(text)
+            tag = message.get("id")
+        except (ValueError, AttributeError):
+            raise HTTPException(400, "Request must be a JSON object")
+        if message.get("op") not in WS_OPS:
+            raise HTTPException(400, f"Unknown op: {message.get('op')}")
+        op = message["op"]
+        if expires and time.time() >= expires:
+            raise HTTPException(401, "Session token expired")
+        route, handler = WS_OPS[op]
+        params = message.get("params") or {}
+        try:
+            inspect.signature(handler).bind(user_id, **params)
+        except TypeError as e:
+            raise HTTPException(400, f"Invalid params: {e}")
+        async with scheduler.slot(user_id, ROUTE_PRIORITY[route]):
+            response = await run_in_threadpool(ws_response, handler, user_id, params)
+    except HTTPException as e:
+        response = JSONResponse({"detail": e.detail}, e.status_code, headers=e.headers)
+    except QuotaExceeded as e:
+        response = await quota_exception_handler(None, e)
+    except Exception:
+        traceback.print_exc()
+        response = JSONResponse({"detail": "Internal Server Error"}, 500)
+    metrics.REQUESTS.inc(f"/ws/{op}", "WS", str(response.status_code))
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - start, f"/ws/{op}", "WS")
+    headers = {name: value for name, value in response.headers.items() if not name.startswith("content-")}
+    head = json.dumps({"id": tag, "status": response.status_code, "headers": headers})
+    return head.encode() + b"\n" + response.body
+
+
+@app.websocket("/ws")
+async def ws(websocket: WebSocket):
+    # --- auth, once for the connection instead of once per request ---
+    try:
+        user_id = get_user_id(websocket)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    expires = jwt.get_unverified_claims(websocket.headers["Authorization"].split(" ", 1)[1]).get("exp")
+    await websocket.accept()
+
+    # Answers go out as soon as they are ready, in any order. Past WS_MAX_IN_FLIGHT
+    # open requests, further ones wait unread in the socket.
+    in_flight = asyncio.Semaphore(WS_MAX_IN_FLIGHT)
+    sending = asyncio.Lock()
+    tasks = set()
+
+    async def answer(text: str):
+        try:
+            frame = await ws_call(user_id, expires, text)
+            async with sending:
+                await websocket.send_bytes(frame)
+        except (WebSocketDisconnect, RuntimeError):
+            # the client went away meanwhile
+            pass
+        finally:
+            in_flight.release()
+
+    try:
+        while True:
+            text = await websocket.receive_text()
+            await in_flight.acquire()
+            task = asyncio.ensure_future(answer(text))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in list(tasks):
+            task.cancel()
@@ -0,0 +1,108 @@
+"""
+Fan-out of mailbox changes to /events subscribers.
+
+Each user with at least one subscriber has exactly one poller, however many
+dashboards or scripts are connected, so Gmail traffic grows with accounts and
+not with clients. The poller stops when its last subscriber leaves.
+
+`poll(user_id, cursor)` is supplied by the backend: it returns the new cursor
+(a Gmail historyId) and the events since `cursor`; with no cursor it only
+returns the current one. An exception with a `retry_after` (QuotaExceeded)
+pauses that user's poller for as long.
+"""
+import asyncio
+import contextlib
+import traceback
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import metrics
+
+Poll = Callable[[str, Optional[str]], Awaitable[Tuple[str, List[dict]]]]
+
+
+class _Subscriber:
+    def __init__(self, queue_size: int):
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(queue_size)
+        self.last_history_id = 0
+        # messages already pushed for last_history_id: one history record can add several
+        self._last_ids: Set[Optional[str]] = set()
+
+    def push(self, event: dict):
+        # the catch-up poll and the shared poller can both report a change
+        history_id = int(event.get("history_id") or 0)
+        if history_id:
+            if history_id < self.last_history_id:
+                return
+            if history_id > self.last_history_id:
+                self.last_history_id = history_id
+                self._last_ids = set()
+            elif event.get("id") in self._last_ids:
+                return
+            self._last_ids.add(event.get("id"))
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A client that stopped reading gets told to re-list instead of
+            # holding an ever growing backlog.
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+
+
+class EventHub:
+    def __init__(self, poll: Poll, interval: float, queue_size: int = 256):
+        self.poll = poll
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[_Subscriber]] = {}
+        self._pollers: Dict[str, "asyncio.Task"] = {}
+
+    @contextlib.asynccontextmanager
+    async def subscribe(self, user_id: str, since: Optional[str] = None) -> AsyncIterator["asyncio.Queue[dict]"]:
+        subscriber = _Subscriber(self.queue_size)
+        cursor = None
+        if since is not None:
+            # a reconnecting client catches up on what it missed, on its own
+            try:
+                cursor, missed = await self.poll(user_id, since)
+            except Exception:
+                missed = [{"type": "resync"}]
+            for event in missed:
+                subscriber.push(event)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        if user_id not in self._pollers:
+            self._pollers[user_id] = asyncio.ensure_future(self._run(user_id, cursor))
+        self._update_gauges()
+        try:
+            yield subscriber.queue
+        finally:
+            subscribers = self._subscribers[user_id]
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[user_id]
+                self._pollers.pop(user_id).cancel()
+            self._update_gauges()
+
+    def _update_gauges(self):
+        metrics.EVENT_SUBSCRIBERS.set(sum(len(s) for s in self._subscribers.values()))
+        metrics.EVENT_POLLERS.set(len(self._pollers))
+
+    def publish(self, user_id: str, event: dict):
+        for subscriber in self._subscribers.get(user_id, ()):
+            subscriber.push(event)
+
+    async def _run(self, user_id: str, cursor: Optional[str]):
+        while True:
+            delay = self.interval
+            try:
+                cursor, events = await self.poll(user_id, cursor)
+                for event in events:
+                    self.publish(user_id, event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is None:
+                    traceback.print_exc()
+                delay = max(delay, retry_after or 0)
+            await asyncio.sleep(delay)
@@ -0,0 +1,501 @@
+"""
+Offline stand-in for the parts of the Gmail and OAuth2 discovery clients the backend uses.
+
+Enable it with GMAIL_API=fake; the mailbox shape is controlled through FAKE_GMAIL_* environment
+variables or configure().
+"""
+import base64
+import email
+import json
+import os
+import random
+import threading
+import time
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email import encoders
+from email.utils import formatdate
+from typing import Optional
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+CONFIG = {
+    "messages": _env_int("FAKE_GMAIL_MESSAGES", 500),
+    "thread_size": _env_int("FAKE_GMAIL_THREAD_SIZE", 3),
+    "body_bytes": _env_int("FAKE_GMAIL_BODY_BYTES", 4096),
+    "attachments": _env_int("FAKE_GMAIL_ATTACHMENTS", 1),
+    "attachment_bytes": _env_int("FAKE_GMAIL_ATTACHMENT_BYTES", 64 * 1024),
+    "latency_ms": _env_int("FAKE_GMAIL_LATENCY_MS", 0),
+    "jitter_ms": _env_int("FAKE_GMAIL_JITTER_MS", 0),
+    # quota units Gmail accepts per rolling minute before answering 429 (0 = unlimited)
+    "quota_per_minute": _env_int("FAKE_GMAIL_QUOTA_PER_MINUTE", 0),
+    # sent messages kept, oldest dropped first (0 = all), so long runs don't grow the mailbox forever
+    "keep_added": _env_int("FAKE_GMAIL_KEEP_ADDED", 0),
+}
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode()
+
+
+def _sleep():
+    latency = CONFIG["latency_ms"]
+    if CONFIG["jitter_ms"]:
+        latency += random.uniform(0, CONFIG["jitter_ms"])
+    if latency > 0:
+        time.sleep(latency / 1000.0)
+
+
+class Mailbox:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._ids = [f"{i:016x}" for i in range(CONFIG["messages"])]
+            self._messages = {}
+            self._attachments = {}
+            self._blob_cache = {}
+            self._next_id = CONFIG["messages"]
+            # ids of added messages; the one at index i has historyId HISTORY_START + i + 1
+            self._history = []
+            self._added = []
+
+    def _thread_id(self, index: int) -> str:
+        return f"{(index // max(CONFIG['thread_size'], 1)) * max(CONFIG['thread_size'], 1):016x}"
+
+    def _is_generated(self, message_id: str) -> bool:
+        try:
+            return len(message_id) == 16 and int(message_id, 16) < CONFIG["messages"]
+        except ValueError:
+            return False
+
+    def _blob(self, size: int) -> bytes:
+        blob = self._blob_cache.get(size)
+        if blob is None:
+            blob = (b"pygmail-fake-attachment-" * (size // 24 + 1))[:size]
+            self._blob_cache[size] = blob
+        return blob
+
+    def _generate(self, message_id: str) -> dict:
+        index = int(message_id, 16)
+        body = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * (CONFIG["body_bytes"] // 57 + 1))[: CONFIG["body_bytes"]]
+        headers = [
+            {"name": "From", "value": f"sender{index % 17}@example.com"},
+            {"name": "To", "value": "me@example.com"},
+            {"name": "Subject", "value": f"Fake message {index}"},
+            {"name": "Date", "value": formatdate(1700000000 + index * 60)},
+            {"name": "Message-ID", "value": f"<{message_id}@fake.example.com>"},
+        ]
+        parts = [
+            {
+                "partId": "0",
+                "mimeType": "multipart/alternative",
+                "body": {"size": 0},
+                "parts": [
+                    {"partId": "0.0", "mimeType": "text/plain", "body": {"size": len(body), "data": _b64(body.encode())}},
+                    {"partId": "0.1", "mimeType": "text/html", "body": {"size": len(body) + 13, "data": _b64(f"<p>{body}</p>\n".encode())}},
+                ],
+            }
+        ]
+        for k in range(CONFIG["attachments"]):
+            attachment_id = f"att-{message_id}-{k}"
+            self._attachments[attachment_id] = CONFIG["attachment_bytes"]
+            parts.append({
+                "partId": str(k + 1),
+                "mimeType": "application/pdf",
+                "filename": f"document_{k}.pdf",
+                "body": {"attachmentId": attachment_id, "size": CONFIG["attachment_bytes"]},
+            })
+        return {
+            "id": message_id,
+            "threadId": self._thread_id(index),
+            "labelIds": ["INBOX"],
+            "snippet": body[:100],
+            "sizeEstimate": len(body) * 2 + CONFIG["attachments"] * CONFIG["attachment_bytes"],
+            "internalDate": str((1700000000 + index * 60) * 1000),
+            "payload": {"mimeType": "multipart/mixed", "headers": headers, "body": {"size": 0}, "parts": parts},
+        }
+
+    def _from_mime(self, message_id: str, thread_id: str, raw: bytes) -> dict:
+        parsed = email.message_from_bytes(raw)
+
+        def convert(part, part_id):
+            node = {"partId": part_id, "mimeType": part.get_content_type(), "headers": [{"name": k, "value": v} for k, v in part.items()]}
+            if part.is_multipart():
+                node["body"] = {"size": 0}
+                node["parts"] = [convert(p, f"{part_id}.{i}" if part_id else str(i)) for i, p in enumerate(part.get_payload())]
+                return node
+            data = part.get_payload(decode=True) or b""
+            filename = part.get_filename()
+            if filename:
+                attachment_id = f"att-{message_id}-{part_id}"
+                self._attachments[attachment_id] = data
+                node["filename"] = filename
+                node["body"] = {"attachmentId": attachment_id, "size": len(data)}
+            else:
+                node["body"] = {"size": len(data), "data": _b64(data)}
+            return node
+
+        return {
+            "id": message_id,
+            "threadId": thread_id,
+            "labelIds": ["SENT"],
+            "snippet": "",
+            "sizeEstimate": len(raw),
+            "internalDate": str(int(time.time() * 1000)),
+            "payload": convert(parsed, ""),
+            "_raw": raw,
+        }
+
+    def ids(self) -> list:
+        with self._lock:
+            return list(self._ids)
+
+    def message(self, message_id: str) -> Optional[dict]:
+        with self._lock:
+            msg = self._messages.get(message_id)
+            if msg is None and self._is_generated(message_id):
+                msg = self._generate(message_id)
+                self._messages[message_id] = msg
+            return msg
+
+    def thread(self, thread_id: str) -> list:
+        with self._lock:
+            ids = [
+                i for i in self._ids
+                if (self._thread_id(int(i, 16)) if self._is_generated(i) else self._messages[i]["threadId"]) == thread_id
+            ]
+        messages = [self.message(i) for i in ids]
+        return sorted(messages, key=lambda m: int(m["internalDate"]))
+
+    def attachment(self, attachment_id: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._attachments.get(attachment_id)
+            if isinstance(data, int):
+                data = self._blob(data)
+            return data
+
+    def add(self, raw: bytes, thread_id: Optional[str] = None) -> dict:
+        with self._lock:
+            message_id = f"{self._next_id:016x}"
+            self._next_id += 1
+            msg = self._from_mime(message_id, thread_id or message_id, raw)
+            self._messages[message_id] = msg
+            self._ids.insert(0, message_id)
+            self._history.append(message_id)
+            self._added.append(message_id)
+            if CONFIG["keep_added"] and len(self._added) > CONFIG["keep_added"]:
+                dropped = self._added.pop(0)
+                del self._messages[dropped]
+                self._ids.remove(dropped)
+                for attachment_id in [a for a in self._attachments if a.startswith(f"att-{dropped}-")]:
+                    del self._attachments[attachment_id]
+            return msg
+
+    def history_id(self) -> int:
+        with self._lock:
+            return HISTORY_START + len(self._history)
+
+    def history(self, start: int) -> list:
+        """(historyId, message) for every message added after `start`."""
+        with self._lock:
+            added = self._history[max(start - HISTORY_START, 0):]
+            offset = max(start, HISTORY_START)
+            return [(offset + i + 1, self._messages[mid]) for i, mid in enumerate(added) if mid in self._messages]
+
+
+HISTORY_START = 1000
+MAILBOX = Mailbox()
+
+
+def configure(**kwargs):
+    unknown = set(kwargs) - set(CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown fake Gmail options: {', '.join(sorted(unknown))}")
+    CONFIG.update(kwargs)
+    MAILBOX.reset()
+    with _QUOTA_LOCK:
+        _QUOTA_SPENT.clear()
+
+
+_QUOTA_LOCK = threading.Lock()
+_QUOTA_SPENT = []  # (timestamp, units)
+
+
+def _charge(method_id: str):
+    if not CONFIG["quota_per_minute"]:
+        return
+    from quota import units_for
+
+    units = units_for(method_id)
+    now = time.time()
+    with _QUOTA_LOCK:
+        while _QUOTA_SPENT and _QUOTA_SPENT[0][0] <= now - 60:
+            _QUOTA_SPENT.pop(0)
+        if sum(u for _, u in _QUOTA_SPENT) + units > CONFIG["quota_per_minute"]:
+            raise http_error(429, "userRateLimitExceeded")
+        _QUOTA_SPENT.append((now, units))
+
+
+def _raw_message(msg: dict) -> bytes:
+    if "_raw" in msg:
+        return msg["_raw"]
+
+    def convert(node):
+        mime_type = node["mimeType"]
+        if mime_type.startswith("multipart/"):
+            part = MIMEMultipart(mime_type.split("/", 1)[1])
+            for child in node.get("parts", []):
+                part.attach(convert(child))
+            return part
+        body = node.get("body", {})
+        if body.get("attachmentId"):
+            part = MIMEBase(*mime_type.split("/", 1))
+            part.set_payload(MAILBOX.attachment(body["attachmentId"]))
+            encoders.encode_base64(part)
+            part.add_header("Content-Disposition", f'attachment; filename="{node.get("filename")}"')
+            return part
+        text = base64.urlsafe_b64decode(body.get("data", "")).decode("utf-8")
+        return MIMEText(text, mime_type.split("/", 1)[1], "utf-8")
+
+    root = convert(msg["payload"])
+    for header in msg["payload"].get("headers", []):
+        root[header["name"]] = header["value"]
+    # messages never change, so render each one once
+    msg["_raw"] = root.as_bytes()
+    return msg["_raw"]
+
+
+def http_error(status: int, reason: str) -> HttpError:
+    content = json.dumps({"error": {"code": status, "message": reason, "errors": [{"reason": reason}]}}).encode()
+    return HttpError(httplib2.Response({"status": status, "reason": reason}), content)
+
+
+class FakeRequest:
+    def __init__(self, method_id: str, fn, *args):
+        self.methodId = method_id
+        self._fn = fn
+        self._args = args
+
+    def execute(self, num_retries: int = 0):
+        _sleep()
+        _charge(self.methodId)
+        return self._fn(*self._args)
+
+
+class FakeBatch:
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request: FakeRequest, callback=None, request_id: Optional[str] = None):
+        self._requests.append((request_id or str(len(self._requests) + 1), request, callback or self._callback))
+
+    def execute(self):
+        _sleep()
+        for request_id, request, callback in self._requests:
+            try:
+                _charge(request.methodId)
+                response, exception = request._fn(*request._args), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+def _format(msg: dict, format: str) -> dict:
+    out = {k: v for k, v in msg.items() if not k.startswith("_")}
+    if format == "minimal":
+        out.pop("payload", None)
+    elif format == "metadata":
+        out["payload"] = {"mimeType": msg["payload"]["mimeType"], "headers": msg["payload"].get("headers", [])}
+    elif format == "raw":
+        out.pop("payload", None)
+        out["raw"] = _b64(_raw_message(msg))
+    return out
+
+
+def _get_message(message_id: str, format: str = "full") -> dict:
+    msg = MAILBOX.message(message_id)
+    if msg is None:
+        raise http_error(404, "Requested entity was not found.")
+    return _format(msg, format)
+
+
+def _list_messages(q: Optional[str], max_results: int, page_token: Optional[str]) -> dict:
+    ids = MAILBOX.ids()
+    if q and q.startswith("thread:"):
+        thread_id = q.split(":", 1)[1].strip()
+        ids = [i for i in ids if MAILBOX.message(i)["threadId"] == thread_id]
+    start = int(page_token or 0)
+    page = ids[start:start + max_results]
+    result = {
+        "messages": [{"id": i, "threadId": MAILBOX.message(i)["threadId"]} for i in page],
+        "resultSizeEstimate": len(ids),
+    }
+    if start + max_results < len(ids):
+        result["nextPageToken"] = str(start + max_results)
+    return result
+
+
+def _get_thread(thread_id: str, format: str = "full") -> dict:
+    messages = MAILBOX.thread(thread_id)
+    if not messages:
+        raise http_error(404, "Requested entity was not found.")
+    return {"id": thread_id, "messages": [_format(m, format) for m in messages]}
+
+
+def _get_profile() -> dict:
+    return {
+        "emailAddress": "me@example.com",
+        "messagesTotal": len(MAILBOX.ids()),
+        "threadsTotal": len(MAILBOX.ids()) // max(CONFIG["thread_size"], 1),
+        "historyId": str(MAILBOX.history_id()),
+    }
+
+
+def _list_history(start_history_id: str, max_results: int, page_token: Optional[str]) -> dict:
+    start = int(start_history_id)
+    if start < HISTORY_START:
+        # Gmail forgets history after about a week and answers 404
+        raise http_error(404, "Requested entity was not found.")
+    records = MAILBOX.history(start)
+    offset = int(page_token or 0)
+    page = records[offset:offset + max_results]
+    result = {
+        "history": [
+            {
+                "id": str(history_id),
+                "messages": [{"id": msg["id"], "threadId": msg["threadId"]}],
+                "messagesAdded": [{"message": {"id": msg["id"], "threadId": msg["threadId"], "labelIds": msg["labelIds"]}}],
+            }
+            for history_id, msg in page
+        ],
+        "historyId": str(MAILBOX.history_id()),
+    }
+    if offset + max_results < len(records):
+        result["nextPageToken"] = str(offset + max_results)
+    if not result["history"]:
+        del result["history"]
+    return result
+
+
+def _get_attachment(message_id: str, attachment_id: str) -> dict:
+    data = MAILBOX.attachment(attachment_id)
+    if data is None:
+        raise http_error(404, "Requested entity was not found.")
+    return {"attachmentId": attachment_id, "size": len(data), "data": _b64(data)}
+
+
+def _send(body: dict) -> dict:
+    raw = base64.urlsafe_b64decode(body["raw"])
+    msg = MAILBOX.add(raw, body.get("threadId"))
+    return {"id": msg["id"], "threadId": msg["threadId"], "labelIds": ["SENT"]}
+
+
+class _Attachments:
+    def get(self, userId: str, messageId: str, id: str, **kwargs):
+        return FakeRequest("gmail.users.messages.attachments.get", _get_attachment, messageId, id)
+
+
+class _Messages:
+    def list(self, userId: str, q: Optional[str] = None, maxResults: int = 100, pageToken: Optional[str] = None, **kwargs):
+        return FakeRequest("gmail.users.messages.list", _list_messages, q, maxResults, pageToken)
+
+    def get(self, userId: str, id: str, format: str = "full", **kwargs):
+        return FakeRequest("gmail.users.messages.get", _get_message, id, format)
+
+    def send(self, userId: str, body: dict, **kwargs):
+        return FakeRequest("gmail.users.messages.send", _send, body)
+
+    def attachments(self):
+        return _Attachments()
+
+
+class _Threads:
+    def get(self, userId: str, id: str, format: str = "full", **kwargs):
+        return FakeRequest("gmail.users.threads.get", _get_thread, id, format)
+
+
+class _History:
+    def list(self, userId: str, startHistoryId: str, maxResults: int = 100, pageToken: Optional[str] = None, **kwargs):
+        return FakeRequest("gmail.users.history.list", _list_history, startHistoryId, maxResults, pageToken)
+
+
+class _Users:
+    def messages(self):
+        return _Messages()
+
+    def threads(self):
+        return _Threads()
+
+    def history(self):
+        return _History()
+
+    def getProfile(self, userId: str, **kwargs):
+        return FakeRequest("gmail.users.getProfile", _get_profile)
+
+
+class FakeGmail:
+    def users(self):
+        return _Users()
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(callback)
+
+
+class _UserInfo:
+    def get(self, **kwargs):
+        return FakeRequest("oauth2.userinfo.get", lambda: {
+            "id": "100000000000000000000",
+            "email": "me@example.com",
+            "verified_email": True,
+            "name": "Fake User",
+            "given_name": "Fake",
+            "family_name": "User",
+            "picture": "https://example.com/avatar.png",
+        })
+
+
+class FakeOAuth2:
+    def userinfo(self):
+        return _UserInfo()
+
+
+def build(serviceName: str, version: str, credentials=None, **kwargs):
+    if serviceName == "gmail":
+        return FakeGmail()
+    if serviceName == "oauth2":
+        return FakeOAuth2()
+    raise ValueError(f"Fake API not available: {serviceName} {version}")
+
+
+# client secrets for make_flow(), so /authorize works offline
+CLIENT_CONFIG = {
+    "installed": {
+        "client_id": "fake-client-id.apps.googleusercontent.com",
+        "client_secret": "fake-client-secret",
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+}
+
+
+def fake_token() -> dict:
+    return {
+        "token": "fake-access-token",
+        "refresh_token": "fake-refresh-token",
+        "client_id": "fake-client-id.apps.googleusercontent.com",
+        "client_secret": "fake-client-secret",
+        "scopes": [],
+        "expiry": "2099-01-01T00:00:00Z",
+    }
@@ -0,0 +1,156 @@
+"""
+Minimal Prometheus text-format metrics for the backend, served on /metrics.
+"""
+import bisect
+import contextlib
+import threading
+import time
+from typing import Dict, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025) + DEFAULT_BUCKETS
+
+REGISTRY = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels) -> float:
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def label_sets(self):
+        with self._lock:
+            return list(self._values)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                # per-bucket counts (plus +Inf), sum, count
+                state = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[labels] = state
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+def render() -> str:
+    _update_cache_ratios()
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter("pygmail_requests_total", "HTTP requests handled, by route and status.", ("route", "method", "status"))
+REQUEST_LATENCY = Histogram("pygmail_request_duration_seconds", "HTTP request latency, by route.", ("route", "method"))
+STAGE_LATENCY = Histogram(
+    "pygmail_stage_duration_seconds",
+    "Time spent in each stage of request handling (queue, jwt, load_token, refresh, build, gmail_api, parse, serialize).",
+    ("stage",),
+    buckets=STAGE_BUCKETS,
+)
+RATE_LIMIT_REJECTIONS = Counter("pygmail_rate_limit_rejections_total", "Requests rejected by a rate limit.", ("limit",))
+CACHE_REQUESTS = Counter("pygmail_cache_requests_total", "Cache lookups, by cache and result (hit or miss).", ("cache", "result"))
+CACHE_HIT_RATIO = Gauge("pygmail_cache_hit_ratio", "Share of cache lookups that were hits.", ("cache",))
+CACHE_BYTES = Gauge("pygmail_cache_bytes", "Bytes held by a cache.", ("cache",))
+SCHEDULER_RUNNING = Gauge("pygmail_scheduler_running", "Requests holding a Gmail scheduler slot.")
+SCHEDULER_WAITING = Gauge("pygmail_scheduler_waiting", "Requests waiting for a Gmail scheduler slot, by priority.", ("priority",))
+EVENT_SUBSCRIBERS = Gauge("pygmail_event_subscribers", "Open /events streams.")
+EVENT_POLLERS = Gauge("pygmail_event_pollers", "Users with a running mailbox poller.")
+
+
+def stage(name: str):
+    return STAGE_LATENCY.time(name)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def _update_cache_ratios():
+    caches = {labels[0] for labels in CACHE_REQUESTS.label_sets()}
+    for cache in caches:
+        hits = CACHE_REQUESTS.value(cache, "hit")
+        total = hits + CACHE_REQUESTS.value(cache, "miss")
+        CACHE_HIT_RATIO.set(hits / total if total else 0.0, cache)
@@ -0,0 +1,134 @@
+"""
+Partial responses: the `fields` parameter, in Gmail's own syntax
+(`messages/id,next_page_token`, `headers(From,Subject),attachments(filename)`).
+
+Each route translates the fields a caller asked for into the Gmail fields it
+needs, so Gmail sends less, then trims its own JSON to exactly what was asked.
+"""
+from typing import Dict, Optional, Tuple, Union
+
+Tree = Dict[str, Union[bool, "Tree"]]
+
+# parsed message field -> Gmail message fields needed to produce it
+PART_FIELDS = "partId,mimeType,filename,body(attachmentId,size)"
+PARSED_SOURCES = {
+    "id": "id",
+    "thread_id": "threadId",
+    "snippet": "snippet",
+    "headers": "payload/headers",
+    "body_plain": "payload",
+    "body_html": "payload",
+    # every part's name and size, not its content; past three levels, whole parts
+    "attachments": f"payload(mimeType,parts({PART_FIELDS},parts({PART_FIELDS},parts)))",
+}
+METADATA_FIELDS = {"id", "thread_id", "snippet", "headers"}
+LIST_SOURCES = {"messages": "messages", "next_page_token": "nextPageToken", "result_size_estimate": "resultSizeEstimate"}
+
+
+def parse(spec: str) -> Tree:
+    """Parse a fields expression into {name: True | subtree}. Raises ValueError."""
+    tree, pos = _parse_list(spec, 0)
+    if pos != len(spec):
+        raise ValueError(f"Unexpected {spec[pos]!r} at position {pos}")
+    return tree
+
+
+def _parse_list(spec: str, pos: int) -> Tuple[Tree, int]:
+    tree: Tree = {}
+    while True:
+        item, pos = _parse_item(spec, pos)
+        for name, sub in item.items():
+            merge(tree, name, sub)
+        if pos < len(spec) and spec[pos] == ",":
+            pos += 1
+            continue
+        return tree, pos
+
+
+def _parse_item(spec: str, pos: int) -> Tuple[Tree, int]:
+    # `a/b` is short for `a(b)`
+    start = pos
+    while pos < len(spec) and spec[pos] not in ",/()":
+        pos += 1
+    name = spec[start:pos].strip()
+    if not name:
+        raise ValueError(f"Expected a field name at position {start}")
+    if pos < len(spec) and spec[pos] == "/":
+        sub, pos = _parse_item(spec, pos + 1)
+    elif pos < len(spec) and spec[pos] == "(":
+        sub, pos = _parse_list(spec, pos + 1)
+        if pos >= len(spec) or spec[pos] != ")":
+            raise ValueError("Unbalanced parentheses")
+        pos += 1
+    else:
+        sub = True
+    return {name: sub}, pos
+
+
+def merge(tree: Tree, name: str, sub):
+    current = tree.get(name)
+    if current is True or sub is True:
+        tree[name] = True
+    elif current is None:
+        tree[name] = sub
+    else:
+        for key, value in sub.items():
+            merge(current, key, value)
+
+
+def render(tree: Tree) -> str:
+    return ",".join(name if sub is True else f"{name}({render(sub)})" for name, sub in tree.items())
+
+
+def project(data, tree: Optional[Tree]):
+    """Keep only the selected fields; lists are projected item by item."""
+    if tree is None:
+        return data
+    if isinstance(data, list):
+        return [project(item, tree) for item in data]
+    if not isinstance(data, dict):
+        return data
+    return {name: data[name] if sub is True else project(data[name], sub) for name, sub in tree.items() if name in data}
+
+
+def _check(tree: Tree, known):
+    unknown = set(tree) - set(known)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+
+def list_fields(tree: Tree) -> str:
+    _check(tree, LIST_SOURCES)
+    gmail: Tree = {}
+    for name, sub in tree.items():
+        merge(gmail, LIST_SOURCES[name], sub)
+    return render(gmail)
+
+
+def parsed_fields(tree: Tree) -> Tuple[str, str, Optional[list]]:
+    """Gmail (fields, format, metadataHeaders) that produce these parsed message fields."""
+    _check(tree, PARSED_SOURCES)
+    if set(tree) <= METADATA_FIELDS:
+        # headers only: format=metadata spares Gmail reading the message body
+        headers = tree.get("headers")
+        metadata_headers = list(headers) if isinstance(headers, dict) else None
+        sources = [PARSED_SOURCES[name] for name in tree]
+        return ",".join(sources), "metadata", metadata_headers
+    gmail: Tree = {}
+    for name in tree:
+        for source_name, sub in parse(PARSED_SOURCES[name]).items():
+            merge(gmail, source_name, sub)
+    return render(gmail), "full", None
+
+
+def thread_fields(tree: Tree) -> Tuple[str, str, Optional[list]]:
+    """Gmail (fields, format, metadataHeaders) for a thread of parsed messages."""
+    _check(tree, ("id", "messages"))
+    messages = tree.get("messages")
+    if messages is True:
+        messages = {name: True for name in PARSED_SOURCES}
+    gmail_messages, format, metadata_headers = parsed_fields(messages or {"id": True})
+    sources = ["id"] if "id" in tree else []
+    if messages is not None:
+        sources.append(f"messages({gmail_messages})")
+    return ",".join(sources), format, metadata_headers
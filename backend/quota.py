@@ -0,0 +1,153 @@
+"""
+Gmail quota-unit accounting.
+
+Google meters the Gmail API in quota units per method, per user and per project
+over a rolling minute. Every Gmail call is charged here first, so the backend
+throttles itself with a clean 429 before Google starts refusing calls. When
+Google does answer 429 or 403 rateLimitExceeded, the call is retried with
+jittered exponential backoff and the user cools down so their other requests
+stop piling onto the same limit. The whole project only cools down when the
+project is the likely limit: its own counter is nearly spent, or Google is
+refusing several users at once. rateLimitExceeded alone also covers per-user
+limits, like too many concurrent requests, and one heavy user mustn't stall
+everyone else.
+"""
+import json
+import random
+import time
+from typing import Optional
+
+from googleapiclient.errors import HttpError
+
+from state import StateStore
+from metrics import stage
+
+# https://developers.google.com/gmail/api/reference/quota
+QUOTA_UNITS = {
+    "gmail.users.getProfile": 1,
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.attachments.get": 5,
+    "gmail.users.messages.send": 100,
+    "gmail.users.threads.list": 10,
+    "gmail.users.threads.get": 10,
+    "gmail.users.history.list": 2,
+}
+DEFAULT_UNITS = 5
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Gmail quota exceeded ({scope}), retry in {retry_after:.0f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def units_for(method: Optional[str]) -> int:
+    if method is None:
+        return DEFAULT_UNITS
+    if not method.startswith("gmail."):
+        return 0
+    return QUOTA_UNITS.get(method, DEFAULT_UNITS)
+
+
+def rate_limit_reason(error: HttpError) -> Optional[str]:
+    status = error.resp.status
+    if status not in (403, 429):
+        return None
+    try:
+        errors = json.loads(error.content)["error"].get("errors") or [{}]
+        reason = errors[0].get("reason")
+    except (ValueError, KeyError, TypeError, AttributeError):
+        reason = None
+    if reason in RATE_LIMIT_REASONS:
+        return reason
+    return "rateLimitExceeded" if status == 429 else None
+
+
+class QuotaTracker:
+    def __init__(
+        self,
+        store: StateStore,
+        user_limit: int,
+        project_limit: int,
+        window: float = 60.0,
+        retries: int = 4,
+        backoff: float = 1.0,
+        max_backoff: float = 32.0,
+        project_usage_ratio: float = 0.9,
+        project_refused_users: int = 3,
+        refusal_window: float = 10.0,
+    ):
+        self.store = store
+        self.user_limit = user_limit
+        self.project_limit = project_limit
+        self.window = window
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.project_usage_ratio = project_usage_ratio
+        self.project_refused_users = project_refused_users
+        self.refusal_window = refusal_window
+
+    def _cooldown(self, user_id: str):
+        now = time.time()
+        for scope, key in (("user", f"quota:cooldown:{user_id}"), ("project", "quota:cooldown:project")):
+            until = self.store.get(key)
+            if until is not None and float(until) > now:
+                raise QuotaExceeded(scope, float(until) - now)
+
+    def charge(self, user_id: str, units: int):
+        if not units:
+            return
+        wait = self.store.spend(f"quota:user:{user_id}", self.window, self.user_limit, units)
+        if wait is not None:
+            raise QuotaExceeded("user", wait)
+        wait = self.store.spend("quota:project", self.window, self.project_limit, units)
+        if wait is not None:
+            self.store.refund(f"quota:user:{user_id}", self.window, units)
+            raise QuotaExceeded("project", wait)
+
+    def _project_limited(self, user_id: str) -> bool:
+        used, _ = self.store.usage("quota:project", self.window)
+        if used >= self.project_limit * self.project_usage_ratio:
+            return True
+        # distinct users refused in this refusal window, each counted once
+        bucket = f"quota:refused:{int(time.time() // self.refusal_window)}"
+        ttl = 2 * self.refusal_window
+        if self.store.incr(f"{bucket}:{user_id}", 1, ttl=ttl) == 1:
+            users = self.store.incr(bucket, 1, ttl=ttl)
+        else:
+            users = int(self.store.get(bucket) or 0)
+        return users >= self.project_refused_users
+
+    def _refused(self, user_id: str, reason: str, delay: float):
+        until = str(time.time() + delay)
+        self.store.set(f"quota:cooldown:{user_id}", until, ttl=delay + 1)
+        if reason == "rateLimitExceeded" and self._project_limited(user_id):
+            self.store.set("quota:cooldown:project", until, ttl=delay + 1)
+
+    def status(self, user_id: str):
+        """(limit, remaining, seconds until some units free up) for a user."""
+        used, reset = self.store.usage(f"quota:user:{user_id}", self.window)
+        return self.user_limit, max(self.user_limit - used, 0), reset
+
+    def execute(self, gmail_request, user_id: str):
+        units = units_for(getattr(gmail_request, "methodId", None))
+        for attempt in range(self.retries + 1):
+            self._cooldown(user_id)
+            self.charge(user_id, units)
+            try:
+                with stage("gmail_api"):
+                    return gmail_request.execute()
+            except HttpError as e:
+                reason = rate_limit_reason(e)
+                if reason is None:
+                    raise
+                # Full jitter, so workers that were refused together don't come back together.
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                self._refused(user_id, reason, delay)
+                if attempt == self.retries:
+                    raise QuotaExceeded("gmail", max(delay, self.backoff))
+                time.sleep(delay)
@@ -0,0 +1,296 @@
+"""
+Local stand-in for Redis, speaking enough of the RESP protocol for state.RedisStore.
+Useful for running several backend workers or nodes without a real Redis server.
+
+Usage:
+python resp_server.py [--host 127.0.0.1] [--port 6379]
+"""
+import argparse
+import asyncio
+import bisect
+import time
+
+
+class Database:
+    def __init__(self):
+        self.values = {}
+        self.zsets = {}
+        self.expires = {}
+
+    def _expire(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.values.pop(key, None)
+            self.zsets.pop(key, None)
+            self.expires.pop(key, None)
+
+    def sweep(self):
+        now = time.time()
+        for key in [k for k, d in self.expires.items() if d <= now]:
+            self._expire(key)
+
+    def ping(self, *args):
+        return args[0] if args else "+PONG"
+
+    def select(self, db):
+        return "+OK"
+
+    def auth(self, *args):
+        return "+OK"
+
+    def flushall(self):
+        self.__init__()
+        return "+OK"
+
+    def dbsize(self):
+        self.sweep()
+        return len(self.values) + sum(1 for zset in self.zsets.values() if zset)
+
+    def get(self, key):
+        self._expire(key)
+        return self.values.get(key)
+
+    def set(self, key, value, *options):
+        self._expire(key)
+        options = [o.upper() for o in options]
+        if "NX" in options and (key in self.values or key in self.zsets):
+            return None
+        self.values[key] = value
+        self.expires.pop(key, None)
+        for unit, scale in (("EX", 1.0), ("PX", 0.001)):
+            if unit in options:
+                self.expires[key] = time.time() + float(options[options.index(unit) + 1]) * scale
+        return "+OK"
+
+    def mget(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def incrby(self, key, amount):
+        self._expire(key)
+        value = int(self.values.get(key, 0)) + int(amount)
+        self.values[key] = str(value)
+        return value
+
+    def getdel(self, key):
+        value = self.get(key)
+        self.delete(key)
+        return value
+
+    def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            self._expire(key)
+            if self.values.pop(key, None) is not None or self.zsets.pop(key, None) is not None:
+                removed += 1
+            self.expires.pop(key, None)
+        return removed
+
+    def pexpire(self, key, ms):
+        self._expire(key)
+        if key not in self.values and key not in self.zsets:
+            return 0
+        self.expires[key] = time.time() + int(ms) / 1000.0
+        return 1
+
+    def expire(self, key, seconds):
+        return self.pexpire(key, int(seconds) * 1000)
+
+    def _zset(self, key):
+        self._expire(key)
+        return self.zsets.setdefault(key, [])
+
+    def zadd(self, key, *pairs):
+        zset = self._zset(key)
+        added = 0
+        for score, member in zip(pairs[0::2], pairs[1::2]):
+            score = float(score)
+            existing = [i for i, (_, m) in enumerate(zset) if m == member]
+            if existing:
+                zset.pop(existing[0])
+            else:
+                added += 1
+            bisect.insort(zset, (score, member))
+        return added
+
+    def zrem(self, key, *members):
+        zset = self._zset(key)
+        before = len(zset)
+        zset[:] = [(s, m) for s, m in zset if m not in members]
+        return before - len(zset)
+
+    def zcard(self, key):
+        return len(self._zset(key))
+
+    @staticmethod
+    def _in_range(low, high):
+        # "(" makes a bound exclusive; float() reads -inf and +inf
+        low_open, high_open = low.startswith("("), high.startswith("(")
+        low, high = float(low.lstrip("(")), float(high.lstrip("("))
+        return lambda s: (low < s if low_open else low <= s) and (s < high if high_open else s <= high)
+
+    def zremrangebyscore(self, key, low, high):
+        zset = self._zset(key)
+        inside = self._in_range(low, high)
+        before = len(zset)
+        zset[:] = [(s, m) for s, m in zset if not inside(s)]
+        return before - len(zset)
+
+    def zcount(self, key, low, high):
+        inside = self._in_range(low, high)
+        return sum(1 for s, _ in self._zset(key) if inside(s))
+
+    def zrangebyscore(self, key, low, high, *options):
+        inside = self._in_range(low, high)
+        items = [(s, m) for s, m in self._zset(key) if inside(s)]
+        options = [o.upper() for o in options]
+        if "LIMIT" in options:
+            offset, count = (int(o) for o in options[options.index("LIMIT") + 1:options.index("LIMIT") + 3])
+            items = items[offset:] if count < 0 else items[offset:offset + count]
+        if "WITHSCORES" in options:
+            return [x for s, m in items for x in (m, repr(s))]
+        return [m for _, m in items]
+
+    def zrange(self, key, start, stop, *options):
+        zset = self._zset(key)
+        start, stop = int(start), int(stop)
+        stop = len(zset) + stop if stop < 0 else stop
+        items = zset[start:stop + 1]
+        if "WITHSCORES" in [o.upper() for o in options]:
+            return [x for s, m in items for x in (m, repr(s))]
+        return [m for _, m in items]
+
+
+def encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, Exception):
+        return b"-ERR %s\r\n" % str(value).encode()
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(encode(v) for v in value)
+    if isinstance(value, str) and value.startswith("+"):
+        return value.encode() + b"\r\n"
+    data = value.encode() if isinstance(value, str) else value
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+async def read_command(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        return line.decode().split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        size = int((await reader.readline())[1:-2])
+        args.append((await reader.readexactly(size + 2))[:-2].decode())
+    return args
+
+
+# commands that change their keys, which aborts transactions WATCHing them
+WRITES = {"set", "incrby", "getdel", "delete", "pexpire", "expire", "zadd", "zrem", "zremrangebyscore"}
+
+
+class Server:
+    def __init__(self):
+        self.db = Database()
+        # WATCHed key -> writes since it was first watched, and by how many connections
+        self.versions = {}
+        self.watchers = {}
+
+    def execute(self, args):
+        name = args[0].lower()
+        if name == "del":
+            name = "delete"
+        fn = getattr(self.db, name, None)
+        if fn is None or name.startswith("_") or name == "sweep":
+            return Exception(f"unknown command '{args[0]}'")
+        if name in WRITES or name == "flushall":
+            keys = self.versions if name == "flushall" else args[1:] if name == "delete" else args[1:2]
+            for key in keys:
+                if key in self.versions:
+                    self.versions[key] += 1
+        try:
+            return fn(*args[1:])
+        except (TypeError, ValueError, IndexError) as e:
+            return Exception(str(e))
+
+    def watch(self, key) -> int:
+        self.watchers[key] = self.watchers.get(key, 0) + 1
+        return self.versions.setdefault(key, 0)
+
+    def unwatch(self, watched: dict):
+        for key in watched:
+            self.watchers[key] -= 1
+            if not self.watchers[key]:
+                del self.watchers[key], self.versions[key]
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        queued = None
+        # WATCHed key -> its version when watched
+        watched = {}
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                if not args:
+                    continue
+                name = args[0].upper()
+                if name == "MULTI":
+                    queued = []
+                    writer.write(encode("+OK"))
+                elif name == "EXEC":
+                    # Commands run back to back with no await in between, which is
+                    # what makes MULTI/EXEC atomic on this single-threaded server.
+                    if any(self.versions.get(key, 0) != version for key, version in watched.items()):
+                        results = None
+                    else:
+                        results = [self.execute(c) for c in queued or []]
+                    self.unwatch(watched)
+                    queued, watched = None, {}
+                    writer.write(encode(results))
+                elif name == "WATCH" and queued is None:
+                    for key in args[1:]:
+                        if key not in watched:
+                            watched[key] = self.watch(key)
+                    writer.write(encode("+OK"))
+                elif name == "UNWATCH":
+                    self.unwatch(watched)
+                    watched = {}
+                    writer.write(encode("+OK"))
+                elif queued is not None:
+                    queued.append(args)
+                    writer.write(encode("+QUEUED"))
+                else:
+                    writer.write(encode(self.execute(args)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.unwatch(watched)
+            writer.close()
+
+    async def sweeper(self):
+        while True:
+            await asyncio.sleep(1)
+            self.db.sweep()
+
+    async def serve(self, host: str, port: int):
+        server = await asyncio.start_server(self.handle, host, port)
+        asyncio.ensure_future(self.sweeper())
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Redis stand-in for the pygmail backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    asyncio.run(Server().serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Cache of rendered JSON responses (parsed messages, metadata), so a message that
+several clients of one user ask for within minutes costs one Gmail call.
+
+Memory is an LRU bounded in bytes per user and in total. With a directory set,
+entries are also written (encrypted) to disk, which is bounded separately and
+outlives restarts; a memory miss that hits disk is promoted back to memory.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import metrics
+
+
+class DiskTier:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        encrypt: Callable[[bytes], bytes],
+        decrypt: Callable[[bytes], bytes],
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.encrypt = encrypt
+        self.decrypt = decrypt
+        self._lock = threading.Lock()
+        self.bytes = sum(p.stat().st_size for p in self.directory.glob("*/*") if p.is_file())
+
+    def _path(self, user_id: str, key: str) -> Path:
+        user = hashlib.sha256(user_id.encode()).hexdigest()[:16]
+        return self.directory / user / hashlib.sha256(key.encode()).hexdigest()[:32]
+
+    def get(self, user_id: str, key: str, ttl: float) -> Optional[Tuple[bytes, float]]:
+        """(body, when it was stored), or None."""
+        path = self._path(user_id, key)
+        try:
+            stored_at = path.stat().st_mtime
+            if stored_at + ttl <= time.time():
+                self._remove(path)
+                return None
+            return self.decrypt(path.read_bytes()), stored_at
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # unreadable or written with another key: drop it
+            self._remove(path)
+            return None
+
+    def put(self, user_id: str, key: str, body: bytes):
+        path = self._path(user_id, key)
+        path.parent.mkdir(exist_ok=True)
+        data = self.encrypt(body)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        with self._lock:
+            # an overwritten entry's bytes are gone
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+            self.bytes += len(data) - replaced
+            over = self.bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def _remove(self, path: Path):
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self.bytes -= size
+
+    def _evict(self):
+        # Oldest first, down to 90% so eviction doesn't run on every write.
+        files = sorted(
+            (p.stat().st_mtime, p.stat().st_size, p) for p in self.directory.glob("*/*")
+            if p.is_file() and not p.name.endswith(".tmp")
+        )
+        with self._lock:
+            self.bytes = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, _, path in files:
+            if self.bytes <= target:
+                break
+            self._remove(path)
+
+
+class ResponseCache:
+    def __init__(self, user_bytes: int, total_bytes: int, ttl: float, disk: Optional[DiskTier] = None):
+        self.user_bytes = user_bytes
+        self.total_bytes = total_bytes
+        self.ttl = ttl
+        self.disk = disk
+        self._lock = threading.Lock()
+        # (user_id, key) -> (body, stored_at), oldest first, across all users
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # user_id -> keys, oldest first
+        self._users: Dict[str, "OrderedDict[str, None]"] = {}
+        self._user_sizes: Dict[str, int] = {}
+        self.bytes = 0
+        # entries past their TTL are dropped when read, or by a sweep every `ttl` seconds
+        self._swept = time.time()
+
+    def get(self, user_id: str, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is not None and entry[1] + self.ttl <= time.time():
+                self._drop(user_id, key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end((user_id, key))
+                self._users[user_id].move_to_end(key)
+        metrics.record_cache("response", entry is not None)
+        if entry is not None:
+            return entry[0]
+        if self.disk is None:
+            return None
+        found = self.disk.get(user_id, key, self.ttl)
+        metrics.record_cache("response_disk", found is not None)
+        if found is None:
+            return None
+        body, stored_at = found
+        # keeps its age from disk, so it still expires `ttl` after it was fetched
+        self._store(user_id, key, body, stored_at)
+        return body
+
+    def put(self, user_id: str, key: str, body: bytes):
+        self._store(user_id, key, body)
+        if self.disk is not None:
+            self.disk.put(user_id, key, body)
+            metrics.CACHE_BYTES.set(self.disk.bytes, "response_disk")
+
+    def _store(self, user_id: str, key: str, body: bytes, stored_at: Optional[float] = None):
+        if len(body) > self.user_bytes:
+            return
+        with self._lock:
+            self._sweep()
+            if (user_id, key) in self._entries:
+                self._drop(user_id, key)
+            self._entries[(user_id, key)] = (body, time.time() if stored_at is None else stored_at)
+            self._users.setdefault(user_id, OrderedDict())[key] = None
+            self._user_sizes[user_id] = self._user_sizes.get(user_id, 0) + len(body)
+            self.bytes += len(body)
+            while self._user_sizes[user_id] > self.user_bytes:
+                self._drop(user_id, next(iter(self._users[user_id])))
+            while self.bytes > self.total_bytes:
+                self._drop(*next(iter(self._entries)))
+            metrics.CACHE_BYTES.set(self.bytes, "response")
+
+    def _sweep(self):
+        now = time.time()
+        if now - self._swept < self.ttl:
+            return
+        self._swept = now
+        for user_id, key in [k for k, (_, stored_at) in self._entries.items() if stored_at + self.ttl <= now]:
+            self._drop(user_id, key)
+
+    def _drop(self, user_id: str, key: str):
+        body, _ = self._entries.pop((user_id, key))
+        keys = self._users[user_id]
+        del keys[key]
+        self._user_sizes[user_id] -= len(body)
+        self.bytes -= len(body)
+        if not keys:
+            del self._users[user_id]
+            del self._user_sizes[user_id]
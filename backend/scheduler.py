@@ -0,0 +1,119 @@
+"""
+Fair scheduling of requests that call Gmail.
+
+Every request takes a slot before it runs. At most `capacity` run at once, and
+at most `per_user` for any one user. When a slot frees up, waiting requests are
+picked by priority class first (INTERACTIVE before BULK), then by user: the
+user who has been served least so far goes next, so one user's export queues
+behind itself instead of in front of everyone else.
+
+Waiting happens on the event loop, not in threadpool threads, so a backlog
+from one user never ties up the threads other users' requests need.
+"""
+import asyncio
+import contextlib
+from collections import deque
+from typing import Dict
+
+import metrics
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+
+class FairScheduler:
+    def __init__(self, capacity: int, per_user: int):
+        self.capacity = capacity
+        self.per_user = per_user
+        self._running = 0
+        self._user_running: Dict[str, int] = {}
+        # priority -> user -> waiting futures, in arrival order
+        self._waiting: Dict[int, Dict[str, deque]] = {p: {} for p in PRIORITY_NAMES}
+        # virtual time: slots granted to a user, offset so newcomers start level with everyone else
+        self._served: Dict[str, int] = {}
+        self._clock = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id: str, priority: int = BULK):
+        await self._acquire(user_id, priority)
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+    def waiting(self, priority: int) -> int:
+        return sum(len(q) for q in self._waiting[priority].values())
+
+    async def _acquire(self, user_id: str, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[priority].setdefault(user_id, deque()).append(future)
+        self._dispatch()
+        if future.done():
+            return
+        try:
+            with metrics.stage("queue"):
+                await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # granted just as the client went away; hand the slot back
+                self._release(user_id)
+            else:
+                self._discard(priority, user_id, future)
+            raise
+
+    def _discard(self, priority: int, user_id: str, future):
+        queue = self._waiting[priority].get(user_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            if not queue:
+                del self._waiting[priority][user_id]
+        self._update_gauges()
+
+    def _next(self):
+        for priority in sorted(self._waiting):
+            users = [
+                u for u in self._waiting[priority]
+                if self._user_running.get(u, 0) < self.per_user
+            ]
+            if users:
+                user_id = min(users, key=lambda u: self._served.get(u, self._clock))
+                return priority, user_id
+        return None
+
+    def _dispatch(self):
+        while self._running < self.capacity:
+            picked = self._next()
+            if picked is None:
+                break
+            priority, user_id = picked
+            queue = self._waiting[priority][user_id]
+            future = queue.popleft()
+            if not queue:
+                del self._waiting[priority][user_id]
+            if future.done():
+                continue
+            served = max(self._served.get(user_id, self._clock), self._clock)
+            self._clock = served
+            self._served[user_id] = served + 1
+            self._running += 1
+            self._user_running[user_id] = self._user_running.get(user_id, 0) + 1
+            future.set_result(None)
+        self._update_gauges()
+
+    def _release(self, user_id: str):
+        self._running -= 1
+        remaining = self._user_running[user_id] - 1
+        if remaining:
+            self._user_running[user_id] = remaining
+        else:
+            del self._user_running[user_id]
+            if not any(user_id in users for users in self._waiting.values()):
+                # idle users start again from the current clock
+                self._served.pop(user_id, None)
+        self._dispatch()
+
+    def _update_gauges(self):
+        metrics.SCHEDULER_RUNNING.set(self._running)
+        for priority, name in PRIORITY_NAMES.items():
+            metrics.SCHEDULER_WAITING.set(self.waiting(priority), name)
@@ -0,0 +1,191 @@
+import json
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Callable, Optional
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class SendQueue:
+    def __init__(
+        self,
+        db_path: str,
+        send_fn: Callable[[str, dict], dict],
+        workers: int = 4,
+        encrypt: Callable[[bytes], bytes] = lambda b: b,
+        decrypt: Callable[[bytes], bytes] = lambda b: b,
+        poll_interval: float = 5.0,
+        lease_seconds: float = 300.0,
+        retry_on: tuple = (),
+        keep_finished: float = 7 * 24 * 3600,
+    ):
+        self.db_path = db_path
+        self.send_fn = send_fn
+        self.workers = workers
+        self.encrypt = encrypt
+        self.decrypt = decrypt
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        # exceptions meaning "not sent, try again later"; retry_after (seconds) is honoured if set
+        self.retry_on = retry_on
+        # sent and failed jobs stay this long for status lookups, then are deleted
+        self.keep_finished = keep_finished
+        self._jobs: "queue.Queue[str]" = queue.Queue()
+        # ids in _jobs, so the poller doesn't queue a job again while it waits there
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS send_jobs ("
+                "job_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, payload BLOB, "
+                "status TEXT NOT NULL, result TEXT, error TEXT, "
+                "created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS send_jobs_status ON send_jobs (status, updated)")
+
+    def start(self):
+        if self._threads:
+            return
+        self._recover()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"send-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        t = threading.Thread(target=self._poller, name="send-poller", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def _recover(self):
+        # Several backend processes can share the database, so this picks up jobs
+        # accepted by any of them. A job stuck mid-send past its lease may or may
+        # not have reached Gmail, so it is reported instead of being retried and
+        # possibly duplicated.
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE send_jobs SET status = ?, payload = NULL, error = ?, updated = ? WHERE status = ? AND updated < ?",
+                (FAILED, "Interrupted while sending; delivery unknown", now, SENDING, now - self.lease_seconds),
+            )
+            pending = self._conn.execute(
+                "SELECT job_id FROM send_jobs WHERE status = ? AND updated < ? ORDER BY created",
+                (QUEUED, now - self.poll_interval),
+            ).fetchall()
+        for (job_id,) in pending:
+            self._put(job_id)
+
+    def _put(self, job_id: str):
+        with self._pending_lock:
+            if job_id in self._pending:
+                return
+            self._pending.add(job_id)
+        self._jobs.put(job_id)
+
+    def _prune(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM send_jobs WHERE status IN (?, ?) AND updated < ?",
+                (SENT, FAILED, time.time() - self.keep_finished),
+            )
+
+    def _poller(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self._recover()
+                self._prune()
+            except sqlite3.Error:
+                traceback.print_exc()
+
+    def enqueue(self, user_id: str, send_body: dict) -> str:
+        job_id = secrets.token_urlsafe(16)
+        now = time.time()
+        payload = self.encrypt(json.dumps(send_body).encode())
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO send_jobs (job_id, user_id, payload, status, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, user_id, payload, QUEUED, now, now),
+            )
+        self._put(job_id)
+        return job_id
+
+    def status(self, user_id: str, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, result, error, created, updated FROM send_jobs WHERE job_id = ? AND user_id = ?",
+                (job_id, user_id),
+            ).fetchone()
+        if row is None:
+            return None
+        status, result, error, created, updated = row
+        result = json.loads(result) if result else {}
+        return {
+            "job_id": job_id,
+            "status": status,
+            "message_id": result.get("id"),
+            "thread_id": result.get("threadId"),
+            "error": error,
+            "created": created,
+            "updated": updated,
+        }
+
+    def _claim(self, job_id: str):
+        with self._lock, self._conn:
+            # The conditional UPDATE is the claim, so two processes can't both take a job.
+            claimed = self._conn.execute(
+                "UPDATE send_jobs SET status = ?, updated = ? WHERE job_id = ? AND status = ?",
+                (SENDING, time.time(), job_id, QUEUED),
+            ).rowcount
+            if claimed != 1:
+                return None
+            return self._conn.execute(
+                "SELECT user_id, payload FROM send_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+
+    def _finish(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE send_jobs SET status = ?, payload = NULL, result = ?, error = ?, updated = ? WHERE job_id = ?",
+                (status, json.dumps(result) if result else None, error, time.time(), job_id),
+            )
+
+    def _requeue(self, job_id: str, delay: float):
+        # The poller picks up queued jobs once `updated` is poll_interval old.
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE send_jobs SET status = ?, updated = ? WHERE job_id = ?",
+                (QUEUED, time.time() + delay - self.poll_interval, job_id),
+            )
+
+    def _worker(self):
+        while True:
+            job_id = self._jobs.get()
+            with self._pending_lock:
+                self._pending.discard(job_id)
+            try:
+                claimed = self._claim(job_id)
+                if claimed is None:
+                    continue
+                user_id, payload = claimed
+                send_body = json.loads(self.decrypt(payload).decode())
+                try:
+                    result = self.send_fn(user_id, send_body)
+                except self.retry_on as e:
+                    self._requeue(job_id, getattr(e, "retry_after", self.poll_interval))
+                except Exception as e:
+                    traceback.print_exc()
+                    self._finish(job_id, FAILED, error=str(getattr(e, "detail", None) or e))
+                else:
+                    self._finish(job_id, SENT, result=result)
+            finally:
+                self._jobs.task_done()
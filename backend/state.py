@@ -0,0 +1,474 @@
+"""
+Shared state for OAuth flows, rate limits and key material.
+
+STATE_STORE selects the backend:
+    memory                       (default) per-process, single worker only
+    sqlite:///state.db           shared by every worker on one machine (sqlite:////abs/path.db for absolute paths)
+    redis://host:port/db         shared by every worker and node
+"""
+import abc
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Optional
+from urllib.parse import urlparse
+
+
+class StateStore(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abc.abstractmethod
+    def set_if_absent(self, key: str, value: str) -> str:
+        """Store value unless key exists; return whichever value is stored."""
+
+    @abc.abstractmethod
+    def pop(self, key: str) -> Optional[str]:
+        """Atomically read and delete key."""
+
+    @abc.abstractmethod
+    def hit(self, key: str, window: float, limit: int) -> Optional[float]:
+        """Record an event in a sliding window. Returns None if it is within limit,
+        otherwise the number of seconds until the oldest event leaves the window
+        (the rejected event is not recorded)."""
+
+    @abc.abstractmethod
+    def incr(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        """Add amount to an integer value (missing counts as 0) and return the new value."""
+
+    def get_many(self, keys) -> list:
+        return [self.get(key) for key in keys]
+
+    def stats(self) -> dict:
+        """Number of entries held, by kind, for watching the store's size."""
+        return {}
+
+    def spend(self, key: str, window: float, limit: int, amount: int, buckets: int = 10) -> Optional[float]:
+        """Weighted version of hit(): add amount to a rolling window kept as `buckets`
+        counters. Returns None if the window total stays within limit, otherwise
+        the seconds until enough of the window expires (nothing is spent)."""
+        width = window / buckets
+        now = time.time()
+        current = int(now // width)
+        oldest = current - buckets + 1
+        used = [int(v or 0) for v in self.get_many([f"{key}:{i}" for i in range(oldest, current)])]
+        # Add first and take it back if over, so concurrent spenders can't both squeeze in.
+        used.append(self.incr(f"{key}:{current}", amount, ttl=window + width))
+        over = sum(used) - limit
+        if over <= 0:
+            return None
+        used[-1] = self.incr(f"{key}:{current}", -amount, ttl=window + width)
+        for i, units in enumerate(used):
+            over -= units
+            if over <= 0:
+                return (oldest + i + buckets) * width - now
+        return window
+
+    def refund(self, key: str, window: float, amount: int, buckets: int = 10) -> None:
+        """Give back units from spend() that ended up unused."""
+        width = window / buckets
+        self.incr(f"{key}:{int(time.time() // width)}", -amount, ttl=window + width)
+
+    def usage(self, key: str, window: float, buckets: int = 10):
+        """Units spent in the rolling window, and seconds until the oldest of them expire."""
+        width = window / buckets
+        now = time.time()
+        current = int(now // width)
+        oldest = current - buckets + 1
+        used = [int(v or 0) for v in self.get_many([f"{key}:{i}" for i in range(oldest, current + 1)])]
+        reset = next(((oldest + i + buckets) * width - now for i, units in enumerate(used) if units), 0.0)
+        return sum(used), reset
+
+
+class MemoryStore(StateStore):
+    def __init__(self, sweep_interval: float = 60.0):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._windows = {}
+        # Expired values and idle windows are otherwise only dropped when their key
+        # is touched again, which an abandoned OAuth flow or a departed user never does.
+        self.sweep_interval = sweep_interval
+        self._swept = time.time()
+        self._longest_window = 0.0
+
+    def _sweep(self, now: float):
+        if now - self._swept < self.sweep_interval:
+            return
+        self._swept = now
+        for key in [k for k, (_, expires) in self._values.items() if expires is not None and expires <= now]:
+            del self._values[key]
+        # every event older than the longest window is out of its own window too
+        for key in [k for k, dq in self._windows.items() if not dq or now - dq[-1] >= self._longest_window]:
+            del self._windows[key]
+
+    def _live(self, key: str, now: float):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= now:
+            del self._values[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key, time.time())
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        with self._lock:
+            now = time.time()
+            self._sweep(now)
+            self._values[key] = (value, now + ttl if ttl else None)
+
+    def set_if_absent(self, key: str, value: str) -> str:
+        with self._lock:
+            existing = self._live(key, time.time())
+            if existing is not None:
+                return existing
+            self._values[key] = (value, None)
+            return value
+
+    def pop(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._live(key, time.time())
+            self._values.pop(key, None)
+            return value
+
+    def incr(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        with self._lock:
+            now = time.time()
+            self._sweep(now)
+            value = int(self._live(key, now) or 0) + amount
+            expires = self._values[key][1] if key in self._values else None
+            self._values[key] = (str(value), now + ttl if ttl else expires)
+            return value
+
+    def hit(self, key: str, window: float, limit: int) -> Optional[float]:
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            self._longest_window = max(self._longest_window, window)
+            dq = self._windows.get(key)
+            if dq is None:
+                dq = deque()
+                self._windows[key] = dq
+            while dq and now - dq[0] >= window:
+                dq.popleft()
+            if len(dq) >= limit:
+                return window - (now - dq[0])
+            dq.append(now)
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "values": len(self._values),
+                "windows": len(self._windows),
+                "window_events": sum(len(dq) for dq in self._windows.values()),
+            }
+
+
+class SQLiteStore(StateStore):
+    def __init__(self, path: str, sweep_interval: float = 60.0):
+        self.path = path
+        self._local = threading.local()
+        self.sweep_interval = sweep_interval
+        self._swept = time.time()
+        self._longest_window = 0.0
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS hits (key TEXT NOT NULL, ts REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS hits_key_ts ON hits (key, ts)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None so each BEGIN IMMEDIATE below is an explicit,
+            # cross-process write lock rather than Python's implicit transactions.
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def _sweep(self, now: float):
+        # Rows of keys never read again would stay forever. Workers may sweep at
+        # the same time; the deletes are idempotent.
+        if now - self._swept < self.sweep_interval:
+            return
+        self._swept = now
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE expires IS NOT NULL AND expires <= ?", (now,))
+        if self._longest_window:
+            conn.execute("DELETE FROM hits WHERE ts <= ?", (now - self._longest_window,))
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        self._sweep(now)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+            (key, value, now + ttl if ttl else None),
+        )
+
+    def set_if_absent(self, key: str, value: str) -> str:
+        conn = self._transaction()
+        try:
+            now = time.time()
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires IS NOT NULL AND expires <= ?", (key, now))
+            conn.execute("INSERT OR IGNORE INTO kv (key, value, expires) VALUES (?, ?, NULL)", (key, value))
+            stored = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+            return stored
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def pop(self, key: str) -> Optional[str]:
+        conn = self._transaction()
+        try:
+            row = conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+            ).fetchone()
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            conn.execute("COMMIT")
+            return row[0] if row else None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def incr(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        self._sweep(time.time())
+        conn = self._transaction()
+        try:
+            now = time.time()
+            conn.execute("DELETE FROM kv WHERE key = ? AND expires IS NOT NULL AND expires <= ?", (key, now))
+            conn.execute(
+                "INSERT INTO kv (key, value, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value, "
+                "expires = excluded.expires",
+                (key, str(amount), now + ttl if ttl else None),
+            )
+            value = int(conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0])
+            conn.execute("COMMIT")
+            return value
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_many(self, keys) -> list:
+        keys = list(keys)
+        rows = dict(self._conn().execute(
+            f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(keys))}) AND (expires IS NULL OR expires > ?)",
+            (*keys, time.time()),
+        ).fetchall())
+        return [rows.get(key) for key in keys]
+
+    def hit(self, key: str, window: float, limit: int) -> Optional[float]:
+        now = time.time()
+        self._longest_window = max(self._longest_window, window)
+        self._sweep(now)
+        conn = self._transaction()
+        try:
+            conn.execute("DELETE FROM hits WHERE key = ? AND ts <= ?", (key, now - window))
+            count, oldest = conn.execute("SELECT COUNT(*), MIN(ts) FROM hits WHERE key = ?", (key,)).fetchone()
+            if count >= limit:
+                conn.execute("COMMIT")
+                return window - (now - oldest)
+            conn.execute("INSERT INTO hits (key, ts) VALUES (?, ?)", (key, now))
+            conn.execute("COMMIT")
+            return None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        values = conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        windows, events = conn.execute("SELECT COUNT(DISTINCT key), COUNT(*) FROM hits").fetchone()
+        return {"values": values, "windows": windows, "window_events": events}
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisConnection:
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None, timeout: float = 5.0):
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._sock.makefile("rb")
+        if password:
+            self.command("AUTH", password)
+        if db:
+            self.command("SELECT", db)
+
+    def _encode(self, args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(out)
+
+    def _read(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._file.read(size + 2)[:-2]
+            return data.decode()
+        if kind == b"*":
+            size = int(rest)
+            if size < 0:
+                return None
+            return [self._read() for _ in range(size)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def command(self, *args):
+        self._sock.sendall(self._encode(args))
+        reply = self._read()
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    def transaction(self, *commands):
+        payload = self._encode(["MULTI"]) + b"".join(self._encode(c) for c in commands) + self._encode(["EXEC"])
+        self._sock.sendall(payload)
+        replies = [self._read() for _ in range(len(commands) + 2)]
+        result = replies[-1]
+        if isinstance(result, RedisError):
+            raise result
+        return result
+
+    def close(self):
+        try:
+            self._file.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class RedisStore(StateStore):
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self._host = parsed.hostname or "127.0.0.1"
+        self._port = parsed.port or 6379
+        self._db = int(parsed.path.lstrip("/") or 0)
+        self._password = parsed.password
+        self._local = threading.local()
+
+    def _conn(self) -> RedisConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = RedisConnection(self._host, self._port, self._db, self._password)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, fn, idempotent: bool = True):
+        try:
+            return fn(self._conn())
+        except (ConnectionError, OSError):
+            self._conn().close()
+            self._local.conn = None
+            # A write may have reached the server before the connection dropped,
+            # and counting it twice is worse than one failed request.
+            if not idempotent:
+                raise
+            # One reconnect, for servers restarted or idle connections dropped.
+            return fn(self._conn())
+
+    def get(self, key: str) -> Optional[str]:
+        return self._call(lambda c: c.command("GET", key))
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        if ttl:
+            self._call(lambda c: c.command("SET", key, value, "PX", int(ttl * 1000)))
+        else:
+            self._call(lambda c: c.command("SET", key, value))
+
+    def set_if_absent(self, key: str, value: str) -> str:
+        self._call(lambda c: c.command("SET", key, value, "NX"))
+        return self.get(key)
+
+    def pop(self, key: str) -> Optional[str]:
+        return self._call(lambda c: c.transaction(("GET", key), ("DEL", key)), idempotent=False)[0]
+
+    def incr(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        if not ttl:
+            return self._call(lambda c: c.command("INCRBY", key, amount), idempotent=False)
+        value, _ = self._call(lambda c: c.transaction(("INCRBY", key, amount), ("PEXPIRE", key, int(ttl * 1000))), idempotent=False)
+        return value
+
+    def get_many(self, keys) -> list:
+        return self._call(lambda c: c.command("MGET", *keys))
+
+    def stats(self) -> dict:
+        # Redis expires keys itself
+        try:
+            return {"values": self._call(lambda c: c.command("DBSIZE"))}
+        except RedisError:
+            # only for monitoring: a server without DBSIZE mustn't break the caller
+            return {}
+
+    def hit(self, key: str, window: float, limit: int) -> Optional[float]:
+        def attempt(c: RedisConnection) -> Optional[float]:
+            # WATCH makes counting and adding one step: a rejected event is never added,
+            # so nobody sees it counted. If another caller changes the window in between,
+            # EXEC does nothing and the count is taken again.
+            while True:
+                now = time.time()
+                start = f"({now - window}"
+                c.command("WATCH", key)
+                if c.command("ZCOUNT", key, start, "+inf") >= limit:
+                    oldest = c.command("ZRANGEBYSCORE", key, start, "+inf", "WITHSCORES", "LIMIT", 0, 1)
+                    c.command("UNWATCH")
+                    return window - (now - float(oldest[1])) if oldest else window
+                added = c.transaction(
+                    ("ZREMRANGEBYSCORE", key, "-inf", now - window),
+                    ("ZADD", key, now, f"{now}:{secrets.token_hex(4)}"),
+                    ("PEXPIRE", key, int(window * 1000)),
+                )
+                if added is not None:
+                    return None
+
+        return self._call(attempt, idempotent=False)
+
+
+def open_store(url: Optional[str] = None) -> StateStore:
+    url = url or os.environ.get("STATE_STORE", "memory")
+    if url == "memory":
+        return MemoryStore()
+    if url.startswith("sqlite:///"):
+        return SQLiteStore(url[len("sqlite:///"):])
+    if url.startswith("redis://"):
+        return RedisStore(url)
+    raise ValueError(f"Unknown STATE_STORE: {url}")
@@ -0,0 +1,65 @@
+import contextlib
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+sys.path.insert(0, str(ROOT / "pygmail"))
+
+# backend.py reads its configuration at import time, so the scratch directory
+# has to outlive every fake_backend() in the process.
+_TMP = tempfile.TemporaryDirectory(prefix="pygmail-bench-")
+os.environ["GMAIL_API"] = "fake"
+os.environ["TOKEN_STORE_DIR"] = os.path.join(_TMP.name, "tokens")
+os.environ["SEND_QUEUE_DB"] = os.path.join(_TMP.name, "send_queue.db")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def fake_backend(**fake_config):
+    """Run backend.py against the fake Gmail API on a local port and yield a ready GmailClient."""
+    import uvicorn
+    import backend
+    import fake_gmail
+    from pygmail import GmailClient
+
+    fake_gmail.configure(**fake_config)
+    # The production limits would turn every benchmark into a sleep test.
+    backend.MAX_EMAILS = 10 ** 9
+    backend.MAX_ATTACHMENTS = 10 ** 9
+    backend.quota.user_limit = backend.quota.project_limit = 10 ** 9
+    backend.CLIENT_CONFIG = fake_gmail.CLIENT_CONFIG
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(backend.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError("Backend did not start")
+        time.sleep(0.01)
+
+    user_id = "bench-user"
+    backend.save_token(user_id, fake_gmail.fake_token())
+    client = GmailClient(
+        backend_url=f"http://127.0.0.1:{port}",
+        session_file=os.path.join(_TMP.name, "session.token"),
+        rpm=10 ** 9,
+    )
+    client.init(backend.make_jwt(user_id))
+    try:
+        yield client
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
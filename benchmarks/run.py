@@ -0,0 +1,154 @@
+"""
+Offline benchmark suite for pygmail and the backend.
+
+Usage:
+python benchmarks/run.py [--only NAME] [--output results.json] [--baseline results.json] [--tolerance 0.2]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from harness import ROOT, fake_backend
+
+BENCHMARKS = {}
+
+# Modules `import pygmail` must not load; they belong to the sync, async, OAuth and export paths.
+LAZY_MODULES = ("requests", "aiohttp", "aiofiles", "asyncio", "http.server", "webbrowser", "csv", "argparse")
+
+IMPORT_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import pygmail
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+''' % (LAZY_MODULES,)
+
+
+def benchmark(name: str):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def _result(ops: int, seconds: float, nbytes: int = 0) -> dict:
+    result = {"ops": ops, "seconds": round(seconds, 4), "ops_per_sec": round(ops / seconds, 2) if seconds else 0.0}
+    if nbytes:
+        result["mb_per_sec"] = round(nbytes / seconds / 1e6, 2) if seconds else 0.0
+    return result
+
+
+@benchmark("import_pygmail")
+def bench_import_pygmail(messages: int):
+    runs = 10
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([str(ROOT / "pygmail"), os.environ.get("PYTHONPATH", "")]))
+    total = 0.0
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_PROBE], env=env, capture_output=True, text=True, check=True)
+        probe = json.loads(out.stdout)
+        if probe["loaded"]:
+            raise RuntimeError(f"import pygmail eagerly loaded: {', '.join(probe['loaded'])}")
+        total += probe["seconds"]
+    return _result(runs, total)
+
+
+@benchmark("parse_email_body")
+def bench_parse_email_body(messages: int):
+    import backend
+    import fake_gmail
+
+    fake_gmail.configure(messages=messages)
+    ids = fake_gmail.MAILBOX.ids()
+    payloads = [fake_gmail._get_message(mid) for mid in ids]
+    start = time.perf_counter()
+    for payload in payloads:
+        backend.parse_email_body(payload)
+    return _result(len(payloads), time.perf_counter() - start)
+
+
+@benchmark("export_emails")
+def bench_export_emails(messages: int):
+    with fake_backend(messages=messages) as client, tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "export.csv")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            client.export_emails("all", output_file=output)
+        return _result(messages, time.perf_counter() - start, os.path.getsize(output))
+
+
+@benchmark("download_attachments")
+def bench_download_attachments(messages: int):
+    count = max(messages // 10, 1)
+    attachment_bytes = 256 * 1024
+    with fake_backend(messages=count, attachments=2, attachment_bytes=attachment_bytes) as client, tempfile.TemporaryDirectory() as tmp:
+        ids = [m["id"] for m in client.list_emails(max_results=count)["messages"]]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for mid in ids:
+                client.download_all_attachments(mid, tmp)
+        return _result(count * 2, time.perf_counter() - start, count * 2 * attachment_bytes)
+
+
+@benchmark("send_email")
+def bench_send_email(messages: int):
+    count = max(messages // 5, 1)
+    with fake_backend(messages=0) as client, tempfile.TemporaryDirectory() as tmp:
+        attachment = os.path.join(tmp, "report.pdf")
+        with open(attachment, "wb") as f:
+            f.write(os.urandom(32 * 1024))
+        start = time.perf_counter()
+        for i in range(count):
+            client.send_email(
+                to="sink@example.com",
+                subject=f"Benchmark {i}",
+                body="Benchmark body",
+                attachments=[attachment] if i % 2 else None,
+            )
+        return _result(count, time.perf_counter() - start)
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name, {}).get("ops_per_sec")
+        if before and result["ops_per_sec"] < before * (1 - tolerance):
+            regressions.append(f"{name}: {result['ops_per_sec']} ops/s vs baseline {before} ops/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pygmail benchmarks")
+    parser.add_argument("--only", action="append", choices=sorted(BENCHMARKS), help="Benchmark to run (can repeat)")
+    parser.add_argument("--messages", type=int, default=200, help="Mailbox size used by the benchmarks")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Fail if any benchmark is slower than this earlier results file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown against the baseline (default: 0.2)")
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or list(BENCHMARKS):
+        results[name] = BENCHMARKS[name](args.messages)
+        print(f"{name}: {results[name]}", file=sys.stderr)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Soak test: run the backend against the fake Gmail API for a long time and watch
+it for memory and latency drift.
+
+Usage:
+python benchmarks/soak.py [--duration 3600] [--sample-every 60] [--warmup 300] [--output soak.json]
+
+A steady mix of reads, sends and abandoned OAuth flows comes from a rotating set
+of users, a new one every --churn seconds, so anything kept per user or per flow
+and never let go shows up as growth. Every sample records the process RSS, the
+sizes of the backend's long-lived structures and the latency percentiles since
+the previous sample. Client and backend share the process, so RSS covers both.
+
+After the warmup the run fails (exit status 1) if RSS grows by more than
+--rss-budget-mb, a structure grows past --structure-budget times its largest
+warmup size plus --structure-slack, or a sample's p99 latency passes
+--latency-budget times the warmup's plus --latency-slack-ms.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from harness import fake_backend
+
+MIX = "list=2,get=6,parsed=6,attachment=2,send=1,authorize=1"
+
+
+def parse_mix(spec: str) -> dict:
+    ops = ("list", "get", "parsed", "attachment", "send", "authorize")
+    mix = {}
+    for item in spec.split(","):
+        op, _, weight = item.partition("=")
+        if op.strip() not in ops:
+            raise ValueError(f"Unknown operation {op!r}, expected one of {', '.join(ops)}")
+        mix[op.strip()] = int(weight or 1)
+    return {op: weight for op, weight in mix.items() if weight > 0}
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        import resource
+        # peak rather than current RSS, where /proc isn't there
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 1e6 if sys.platform == "darwin" else maxrss / 1e3
+
+
+def structure_sizes() -> dict:
+    """Entry counts of the backend structures that live as long as the process."""
+    import backend
+
+    sizes = {f"state_store.{name}": count for name, count in backend.STATE_STORE.stats().items()}
+    cache = backend.response_cache
+    sizes["response_cache.entries"] = len(cache._entries)
+    sizes["response_cache.users"] = len(cache._users)
+    sizes["response_cache.bytes"] = cache.bytes
+    sizes["scheduler.served"] = len(backend.scheduler._served)
+    sizes["scheduler.running_users"] = len(backend.scheduler._user_running)
+    sizes["event_hub.pollers"] = len(backend.event_hub._pollers)
+    sizes["gc_objects"] = len(gc.get_objects())
+    sizes["threads"] = threading.active_count()
+    return sizes
+
+
+def percentiles(latencies: list) -> dict:
+    from pygmail.hooks import _percentile
+
+    return {
+        "p50": round(_percentile(latencies, 50) * 1000, 2),
+        "p90": round(_percentile(latencies, 90) * 1000, 2),
+        "p99": round(_percentile(latencies, 99) * 1000, 2),
+    }
+
+
+class Users:
+    """The active users: each op picks one, and every `churn` seconds the oldest is replaced by a new one."""
+
+    def __init__(self, backend_url: str, count: int, directory: str):
+        self.backend_url = backend_url
+        self.directory = directory
+        self._lock = threading.Lock()
+        self.seen = 0
+        self.active = [self._new() for _ in range(count)]
+
+    def _new(self):
+        import backend
+        import fake_gmail
+        from pygmail import GmailClient, RetryPolicy
+
+        self.seen += 1
+        user_id = f"soak-user-{self.seen}"
+        backend.save_token(user_id, fake_gmail.fake_token())
+        client = GmailClient(
+            self.backend_url,
+            session_file=os.path.join(self.directory, f"{user_id}.token"),
+            rpm=10 ** 9,
+            response_cache_size=0,
+            retry=RetryPolicy(max_attempts=1),
+        )
+        client.init(backend.make_jwt(user_id))
+        return client
+
+    def pick(self):
+        with self._lock:
+            return random.choice(self.active)
+
+    def rotate(self):
+        client = self._new()
+        with self._lock:
+            old = self.active.pop(0)
+            self.active.append(client)
+        old.close()
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = {}
+
+    def record(self, seconds: float, error):
+        with self._lock:
+            self.latencies.append(seconds)
+            if error is not None:
+                name = type(error).__name__
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def take(self):
+        with self._lock:
+            latencies, errors = self.latencies, self.errors
+            self.latencies, self.errors = [], {}
+        return latencies, errors
+
+
+def run_op(op: str, client, backend_url: str, message_ids: list, attachments: list):
+    import requests
+
+    if op == "list":
+        client.list_emails(max_results=10)
+    elif op == "get":
+        client.get_email(random.choice(message_ids), format="metadata")
+    elif op == "parsed":
+        client.get_parsed_email(random.choice(message_ids))
+    elif op == "attachment":
+        client.get_attachment(*random.choice(attachments))
+    elif op == "send":
+        client.send_email(to="sink@example.com", subject="pygmail soak", body="Sent by the soak test.")
+    else:
+        # a flow that is started and never finished
+        requests.get(f"{backend_url}/authorize", timeout=30).raise_for_status()
+
+
+def check(sample: dict, baseline: dict, args) -> list:
+    """Budgets the sample is over, as readable lines."""
+    over = []
+    growth = sample["rss_mb"] - baseline["rss_mb"]
+    if growth > args.rss_budget_mb:
+        over.append(f"rss: grew {growth:.1f} MB, budget {args.rss_budget_mb} MB")
+    for name, size in sample["structures"].items():
+        limit = baseline["structures"].get(name, 0) * args.structure_budget + args.structure_slack
+        if size > limit:
+            over.append(f"{name}: {size}, budget {limit:.0f}")
+    limit = baseline["latency_ms"]["p99"] * args.latency_budget + args.latency_slack_ms
+    if sample["latency_ms"]["p99"] > limit:
+        over.append(f"p99 latency: {sample['latency_ms']['p99']} ms, budget {limit:.1f} ms")
+    return over
+
+
+def soak(args) -> dict:
+    import backend
+    import fake_gmail
+
+    mix = parse_mix(args.mix)
+    ops, weights = list(mix), list(mix.values())
+    # short lifetimes, so expiry happens many times within a run
+    backend.OAUTH_STATE_TTL = args.ttl
+    backend.response_cache.ttl = args.ttl
+    backend.STATE_STORE.sweep_interval = min(getattr(backend.STATE_STORE, "sweep_interval", args.ttl), args.ttl)
+
+    with fake_backend(messages=args.messages, keep_added=args.keep_sent, latency_ms=args.gmail_latency_ms) as client, \
+            tempfile.TemporaryDirectory(prefix="pygmail-soak-") as directory:
+        message_ids = [m["id"] for m in client.list_emails(max_results=100)["messages"]]
+        attachments = [
+            (mid, a["attachment_id"]) for mid in message_ids[:20]
+            for a in client.get_parsed_email(mid).get("attachments", [])
+        ]
+        if not attachments:
+            mix.pop("attachment", None)
+            ops, weights = list(mix), list(mix.values())
+        users = Users(client.backend_url, args.users, directory)
+        recorder = Recorder()
+        stop = threading.Event()
+        interval = args.concurrency / args.rate
+
+        def worker():
+            next_op = time.monotonic()
+            while not stop.is_set():
+                op = random.choices(ops, weights)[0]
+                start = time.perf_counter()
+                error = None
+                try:
+                    run_op(op, users.pick(), client.backend_url, message_ids, attachments)
+                except Exception as e:
+                    error = e
+                recorder.record(time.perf_counter() - start, error)
+                next_op += interval
+                stop.wait(max(0.0, next_op - time.monotonic()))
+
+        def churn():
+            while not stop.wait(args.churn):
+                try:
+                    users.rotate()
+                except Exception as e:
+                    print(f"Adding a user failed: {e!r}", file=sys.stderr)
+
+        threads = [threading.Thread(target=worker, name=f"soak-{i}", daemon=True) for i in range(args.concurrency)]
+        threads.append(threading.Thread(target=churn, name="soak-churn", daemon=True))
+        for thread in threads:
+            thread.start()
+
+        started = time.monotonic()
+        samples, violations, baseline = [], [], None
+        failed = set()
+        while True:
+            elapsed = time.monotonic() - started
+            if elapsed >= args.duration:
+                break
+            time.sleep(min(args.sample_every, args.duration - elapsed))
+            latencies, errors = recorder.take()
+            gc.collect()
+            sample = {
+                "elapsed": round(time.monotonic() - started, 1),
+                "rss_mb": round(rss_mb(), 2),
+                "ops": len(latencies),
+                "errors": errors,
+                "latency_ms": percentiles(latencies),
+                "users_seen": users.seen,
+                "structures": structure_sizes(),
+                "fake_gmail_messages": len(fake_gmail.MAILBOX._messages),
+            }
+            samples.append(sample)
+            print(
+                f"{sample['elapsed']:>8.0f}s  rss {sample['rss_mb']:.1f} MB  ops {sample['ops']}  "
+                f"errors {sum(errors.values())}  p99 {sample['latency_ms']['p99']} ms  users {users.seen}",
+                file=sys.stderr,
+            )
+            if sample["elapsed"] < args.warmup:
+                continue
+            if baseline is None:
+                warmup = samples[:-1] or samples
+                baseline = {
+                    "rss_mb": warmup[-1]["rss_mb"],
+                    # sizes swing as entries expire; measure against the top of the swing
+                    "structures": {name: max(s["structures"].get(name, 0) for s in warmup) for name in sample["structures"]},
+                    "latency_ms": warmup[-1]["latency_ms"],
+                }
+            for line in check(sample, baseline, args):
+                budget = line.split(":")[0]
+                if budget not in failed:
+                    failed.add(budget)
+                    violations.append(f"at {sample['elapsed']:.0f}s {line}")
+
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=30)
+        for user in users.active:
+            user.close()
+
+    return {
+        "config": {name: value for name, value in vars(args).items() if name != "output"},
+        "baseline": baseline,
+        "samples": samples,
+        "violations": violations,
+        "passed": baseline is not None and not violations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test the backend against fake Gmail")
+    parser.add_argument("--duration", type=float, default=3600, help="Seconds to run (default: 3600)")
+    parser.add_argument("--sample-every", type=float, default=60, help="Seconds between samples (default: 60)")
+    parser.add_argument("--warmup", type=float, default=300, help="Seconds before budgets apply (default: 300)")
+    parser.add_argument("--mix", default=MIX, help=f"Weighted operations (default: {MIX})")
+    parser.add_argument("--rate", type=float, default=50, help="Operations per second, across all workers (default: 50)")
+    parser.add_argument("--concurrency", "-c", type=int, default=8, help="Worker threads (default: 8)")
+    parser.add_argument("--users", type=int, default=20, help="Users active at once (default: 20)")
+    parser.add_argument("--churn", type=float, default=5, help="Seconds between replacing an active user with a new one (default: 5)")
+    parser.add_argument("--ttl", type=int, default=60, help="OAuth state and response cache lifetime in seconds (default: 60)")
+    parser.add_argument("--messages", type=int, default=200, help="Fake mailbox size (default: 200)")
+    parser.add_argument("--keep-sent", type=int, default=500, help="Sent messages the fake mailbox keeps (default: 500)")
+    parser.add_argument("--gmail-latency-ms", type=int, default=0, help="Simulated Gmail latency per call (default: 0)")
+    parser.add_argument("--rss-budget-mb", type=float, default=64, help="Allowed RSS growth after warmup (default: 64)")
+    parser.add_argument("--structure-budget", type=float, default=1.5, help="Allowed structure size, as a multiple of the warmup's (default: 1.5)")
+    parser.add_argument("--structure-slack", type=int, default=200, help="Entries allowed on top of --structure-budget (default: 200)")
+    parser.add_argument("--latency-budget", type=float, default=2.0, help="Allowed p99 latency, as a multiple of the warmup's (default: 2.0)")
+    parser.add_argument("--latency-slack-ms", type=float, default=20, help="Milliseconds allowed on top of --latency-budget (default: 20)")
+    parser.add_argument("--output", "-o", help="Write the samples and verdict as JSON to this file")
+    args = parser.parse_args()
+    if args.warmup >= args.duration:
+        parser.error("--warmup must be shorter than --duration")
+
+    report = soak(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for line in report["violations"]:
+        print(f"OVER BUDGET {line}", file=sys.stderr)
+    print(json.dumps({"passed": report["passed"], "baseline": report["baseline"], "last": report["samples"][-1] if report["samples"] else None}, indent=2))
+    if not report["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
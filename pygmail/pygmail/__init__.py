@@ -1,3 +1,7 @@
 from .client import GmailClient
+from .hooks import StatsCollector
+from .models import Attachment, MessageRef, ParsedEmail
+from .pool import GmailClientPool
+from .retry import CircuitBreaker, CircuitOpenError, RetryPolicy
 
-__all__ = ["GmailClient"]
+__all__ = ["GmailClient", "GmailClientPool", "StatsCollector", "RetryPolicy", "CircuitBreaker", "CircuitOpenError", "ParsedEmail", "Attachment", "MessageRef"]
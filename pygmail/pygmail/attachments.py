@@ -0,0 +1,66 @@
+import hashlib
+import os
+import shutil
+import stat
+import threading
+from pathlib import Path
+from typing import Set
+
+
+class ContentStore:
+    """Files stored once by SHA-256 of their content and hard-linked to where they're wanted,
+    so an attachment repeated across many messages takes its disk space once."""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def put(self, data: bytes) -> Path:
+        digest = hashlib.sha256(data).hexdigest()
+        blob = self.root / digest[:2] / digest
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            # Read-only, since every hard link shares it: editing one copy would change them all.
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            try:
+                os.replace(tmp, blob)
+            except OSError:
+                # another thread or process stored the same content first (Windows won't
+                # replace the read-only blob); it's identical, so use theirs
+                os.chmod(tmp, stat.S_IWUSR)
+                tmp.unlink()
+                if not blob.exists():
+                    raise
+        return blob
+
+    def save(self, data: bytes, dest: Path) -> Path:
+        blob = self.put(data)
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if dest.exists():
+            dest.unlink()
+        try:
+            os.link(blob, dest)
+        except OSError:
+            # other filesystem, or no hard links (e.g. FAT): fall back to a copy
+            shutil.copyfile(blob, dest)
+        return dest
+
+
+def unique_path(directory: Path, filename: str, taken: Set[Path]) -> Path:
+    # Attachment names come from whoever sent the mail, so never let them leave the directory.
+    filename = Path(filename.replace("\\", "/")).name
+    if filename in ("", ".", ".."):
+        filename = "unnamed_attachment"
+    output_path = directory / filename
+    counter = 1
+    while output_path.exists() or output_path in taken:
+        name_parts = filename.rsplit(".", 1)
+        if len(name_parts) == 2:
+            output_path = directory / f"{name_parts[0]}_{counter}.{name_parts[1]}"
+        else:
+            output_path = directory / f"{filename}_{counter}"
+        counter += 1
+    taken.add(output_path)
+    return output_path
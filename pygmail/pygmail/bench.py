@@ -0,0 +1,274 @@
+"""
+The load generator behind `pygmail bench`.
+
+Runs a weighted mix of operations against a backend at one or more concurrency
+levels, through the sync or async client, and reports throughput, latency
+percentiles, error and 429 rates and the client's CPU time, so the effect of
+changing `rpm`, backend workers or cache sizes can be measured the same way
+every time.
+"""
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .client import GmailClient
+from .hooks import StatsCollector, _percentile
+
+OPS = ("list", "get", "parsed", "attachment", "send")
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    """`list=1,get=4` -> {"list": 1, "get": 4}. Raises ValueError."""
+    mix = {}
+    for item in spec.split(","):
+        op, _, weight = item.partition("=")
+        op = op.strip()
+        if op not in OPS:
+            raise ValueError(f"Unknown operation {op!r}, expected one of {', '.join(OPS)}")
+        try:
+            mix[op] = int(weight) if weight else 1
+        except ValueError:
+            raise ValueError(f"Weight of {op!r} is not a whole number: {weight!r}")
+        if mix[op] < 0:
+            raise ValueError(f"Weight of {op!r} is negative")
+    mix = {op: weight for op, weight in mix.items() if weight}
+    if not mix:
+        raise ValueError("Empty operation mix")
+    return mix
+
+
+class Workload:
+    """The operations of a mix, on a sample of the mailbox fetched by prepare()."""
+
+    def __init__(self, client: GmailClient, mix: Dict[str, int], sink: Optional[str] = None, attachment_bytes: int = 0,
+                 sample: int = 50, query: Optional[str] = None, seed: Optional[int] = None):
+        if "send" in mix and not sink:
+            raise ValueError("The send operation needs a sink address to send to")
+        self.client = client
+        self.mix = mix
+        self.sink = sink
+        self.attachment_bytes = attachment_bytes
+        self.sample = sample
+        self.query = query
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._ops = list(mix)
+        self._weights = [mix[op] for op in self._ops]
+        self._sent = 0
+        self.message_ids: List[str] = []
+        self.attachments: List[tuple] = []
+        self.attachment_file: Optional[str] = None
+
+    def prepare(self, directory: str):
+        if self.mix.keys() - {"send"}:
+            found = self.client.list_emails(max_results=self.sample, query=self.query).get("messages", [])
+            self.message_ids = [msg["id"] for msg in found]
+            if not self.message_ids:
+                raise RuntimeError("No emails to read; send some first or change --query")
+        if "attachment" in self.mix:
+            for message_id in self.message_ids:
+                email = self.client.get_parsed_email(message_id, fields="attachments(attachment_id)")
+                self.attachments += [(message_id, a["attachment_id"]) for a in email.get("attachments", []) if a.get("attachment_id")]
+            if not self.attachments:
+                raise RuntimeError("None of the sampled emails has attachments")
+        if "send" in self.mix and self.attachment_bytes:
+            self.attachment_file = os.path.join(directory, "bench-attachment.bin")
+            with open(self.attachment_file, "wb") as f:
+                f.write(os.urandom(self.attachment_bytes))
+
+    def next_op(self) -> str:
+        with self._lock:
+            return self._random.choices(self._ops, self._weights)[0]
+
+    def _pick(self, items: list):
+        with self._lock:
+            return self._random.choice(items)
+
+    def _send_args(self) -> dict:
+        with self._lock:
+            self._sent += 1
+            number = self._sent
+        return {
+            "to": self.sink,
+            "subject": f"pygmail bench {number}",
+            "body": "Sent by pygmail bench.",
+            "attachments": [self.attachment_file] if self.attachment_file else None,
+        }
+
+    def run(self, op: str):
+        client = self.client
+        if op == "list":
+            return client.list_emails(max_results=10, query=self.query)
+        if op == "get":
+            return client.get_email(self._pick(self.message_ids), format="metadata")
+        if op == "parsed":
+            return client.get_parsed_email(self._pick(self.message_ids))
+        if op == "attachment":
+            return client.get_attachment(*self._pick(self.attachments))
+        return client.send_email(**self._send_args())
+
+    async def run_async(self, op: str):
+        client = self.client
+        if op == "list":
+            return await client.list_emails_async(max_results=10, query=self.query)
+        if op == "get":
+            return await client.get_email_async(self._pick(self.message_ids), format="metadata")
+        if op == "parsed":
+            return await client.get_parsed_email_async(self._pick(self.message_ids))
+        if op == "attachment":
+            return await client.get_attachment_async(*self._pick(self.attachments))
+        return await client.send_email_async(**self._send_args())
+
+
+class _Recorder:
+    def __init__(self, requests: Optional[int], duration: Optional[float]):
+        self.requests = requests
+        self.deadline = time.perf_counter() + duration if duration else None
+        self._started = 0
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.error_types: Dict[str, int] = {}
+
+    def claim(self) -> bool:
+        """Whether another operation should start."""
+        with self._lock:
+            if self.requests is not None and self._started >= self.requests:
+                return False
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                return False
+            self._started += 1
+            return True
+
+    def record(self, op: str, seconds: float, error: Optional[BaseException]):
+        with self._lock:
+            self.latencies.setdefault(op, []).append(seconds)
+            if error is not None:
+                self.errors[op] = self.errors.get(op, 0) + 1
+                name = type(error).__name__
+                self.error_types[name] = self.error_types.get(name, 0) + 1
+
+
+def _latency_ms(latencies: List[float]) -> dict:
+    return {
+        "p50": round(_percentile(latencies, 50) * 1000, 2),
+        "p90": round(_percentile(latencies, 90) * 1000, 2),
+        "p99": round(_percentile(latencies, 99) * 1000, 2),
+        "max": round(max(latencies) * 1000, 2) if latencies else 0.0,
+        "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+def _run_sync(workload: Workload, recorder: _Recorder, concurrency: int):
+    def worker():
+        while recorder.claim():
+            op = workload.next_op()
+            start = time.perf_counter()
+            error = None
+            try:
+                workload.run(op)
+            except Exception as e:
+                error = e
+            recorder.record(op, time.perf_counter() - start, error)
+
+    threads = [threading.Thread(target=worker, name=f"pygmail-bench-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def _run_async(workload: Workload, recorder: _Recorder, concurrency: int):
+    import asyncio
+
+    async def worker():
+        while recorder.claim():
+            op = workload.next_op()
+            start = time.perf_counter()
+            error = None
+            try:
+                await workload.run_async(op)
+            except Exception as e:
+                error = e
+            recorder.record(op, time.perf_counter() - start, error)
+
+    async def main():
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    asyncio.run(main())
+
+
+def run_level(workload: Workload, concurrency: int, mode: str = "sync", requests: Optional[int] = 200, duration: Optional[float] = None) -> dict:
+    """Run the workload at one concurrency level and summarize it."""
+    recorder = _Recorder(requests, duration)
+    stats = StatsCollector()
+    workload.client.add_hook(stats)
+    cpu_before = os.times()
+    start = time.perf_counter()
+    try:
+        (_run_async if mode == "async" else _run_sync)(workload, recorder, concurrency)
+    finally:
+        workload.client.hooks.remove(stats)
+    seconds = time.perf_counter() - start
+    cpu_after = os.times()
+
+    latencies = [s for values in recorder.latencies.values() for s in values]
+    ops = len(latencies)
+    errors = sum(recorder.errors.values())
+    http = stats.summary()
+    rate_limited = http["status_counts"].get(429, 0)
+    cpu_user = cpu_after.user - cpu_before.user
+    cpu_system = cpu_after.system - cpu_before.system
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "ops": ops,
+        "seconds": round(seconds, 3),
+        "throughput": round(ops / seconds, 2) if seconds else 0.0,
+        "latency_ms": _latency_ms(latencies),
+        "errors": errors,
+        "error_rate": round(errors / ops, 4) if ops else 0.0,
+        "error_types": recorder.error_types,
+        "http": {
+            "requests": http["requests"],
+            "status_counts": {str(status): count for status, count in sorted(http["status_counts"].items())},
+            "rate_limited": rate_limited,
+            "rate_limited_rate": round(rate_limited / http["requests"], 4) if http["requests"] else 0.0,
+            "retries": http["retries"],
+            "throttled_seconds": round(http["throttled_seconds"], 3),
+            "bytes_sent": http["bytes_sent"],
+            "bytes_received": http["bytes_received"],
+        },
+        "cpu_seconds": {"user": round(cpu_user, 3), "system": round(cpu_system, 3)},
+        "cpu_ms_per_op": round((cpu_user + cpu_system) / ops * 1000, 3) if ops else 0.0,
+        "by_op": {
+            op: {"ops": len(values), "errors": recorder.errors.get(op, 0), "latency_ms": _latency_ms(values)}
+            for op, values in sorted(recorder.latencies.items())
+        },
+    }
+
+
+def run(client: GmailClient, mix: Dict[str, int], concurrency: List[int], modes: List[str], requests: Optional[int] = 200,
+        duration: Optional[float] = None, **workload_kwargs) -> dict:
+    """Prepare the workload once, then run it for every mode and concurrency level."""
+    import datetime
+    import tempfile
+
+    started = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    workload = Workload(client, mix, **workload_kwargs)
+    with tempfile.TemporaryDirectory(prefix="pygmail-bench-") as directory:
+        workload.prepare(directory)
+        runs = [run_level(workload, level, mode, requests, duration) for mode in modes for level in concurrency]
+    return {
+        "started": started,
+        "backend_url": client.backend_url,
+        "transport": client.transport,
+        "rpm": client.rpm,
+        "mix": mix,
+        "requests_per_run": requests if duration is None else None,
+        "duration_per_run": duration,
+        "sample": {"emails": len(workload.message_ids), "attachments": len(workload.attachments)},
+        "runs": runs,
+    }
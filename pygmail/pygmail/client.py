@@ -1,93 +1,161 @@
-import threading
-import webbrowser
-from typing import List, Optional, Union
-from urllib import parse
-import http.server
-import requests
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+from collections import OrderedDict, deque
 from pathlib import Path
+import os
+import threading
 import time
-import argparse
+import logging
 import base64
-import asyncio
-import aiohttp
-import aiofiles
-import csv
 
-LOCAL_PORT = 8080
-CALLBACK_PATHS = ("/", "/oauth2callback")
+from .hooks import Hook, logger
+from .retry import CircuitBreaker, CircuitOpenError, RetryPolicy, parse_retry_after
+
+# requests, aiohttp, aiofiles, asyncio, csv and the OAuth loopback server are
+# imported where they are first needed, so `import pygmail` and short CLI
+# commands don't pay for the paths they never use.
+if TYPE_CHECKING:
+    import aiohttp
+    import requests
 
 
 class GmailClient:
-    def __init__(self, backend_url: str = "http://37.27.51.34:31873", session_file: Union[str, Path] = None, rpm: int = 60):
+    # Share of the backend's Gmail quota left untouched: below it, calls wait for the window to roll.
+    QUOTA_RESERVE = 0.05
+
+    def __init__(self, backend_url: str = "http://37.27.51.34:31873", session_file: Union[str, Path] = None, rpm: int = 60, hooks: Optional[List[Hook]] = None, retry: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None, response_cache_size: int = 256, index_path: Optional[Union[str, Path]] = None, parse_locally: bool = False, parse_processes: Optional[int] = None, models: bool = False, transport: str = "http", http: Optional["requests.Session"] = None, outbox_path: Optional[Union[str, Path]] = None):
         self.backend_url = backend_url.rstrip("/")
         self.session_file = Path(session_file) if session_file else Path.home() / ".pygmail" / "session.token"
         self.session_token: Optional[str] = None
         self.rpm = rpm
         self._last_call = 0
         self._min_interval = 60.0 / rpm
+        self._quota_resume = 0.0
+        self._rate_lock = threading.Lock()
+        self.hooks: List[Hook] = list(hooks or [])
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        # message responses by request, with their ETags, for conditional requests
+        self.response_cache_size = response_cache_size
+        self._responses: "OrderedDict[str, tuple]" = OrderedDict()
+        self._responses_lock = threading.Lock()
+        # local full-text index of fetched messages, opened on first use
+        self.index_path = Path(index_path) if index_path else None
+        self._index = None
+        # fetch raw messages and parse them here, in a process pool, instead of on the backend
+        self.parse_locally = parse_locally
+        self.parse_processes = parse_processes
+        self._parse_pool = None
+        # return compact ParsedEmail/MessageRef objects (pygmail.models) instead of dicts
+        self.models = models
+        # "websocket": reads share one connection to the backend's /ws channel, authenticated once
+        if transport not in ("http", "websocket"):
+            raise ValueError(f"Unknown transport: {transport!r}")
+        self.transport = transport
+        self._websocket = None
+        self._websocket_lock = threading.Lock()
+        # a requests.Session to send through, e.g. one shared by a GmailClientPool; by default one connection per request
+        self.http = http
+        # emails sent with queued=True wait here; by default next to the session file
+        self.outbox_path = Path(outbox_path) if outbox_path else self.session_file.with_name(self.session_file.stem + ".outbox.db")
+        self._outbox = None
+        self._outbox_flusher = None
+        self._outbox_lock = threading.Lock()
 
-    class OAuthHandler(http.server.BaseHTTPRequestHandler):
-        server_data = {"code": None, "state": None}
-        server_event = threading.Event()
-
-        def do_GET(self):
-            parsed = parse.urlparse(self.path)
-            if parsed.path not in CALLBACK_PATHS:
-                self.send_response(404)
-                self.end_headers()
-                self.wfile.write(b"Not found")
-                return
-
-            qs = parse.parse_qs(parsed.query)
-            code = qs.get("code", [None])[0]
-            state = qs.get("state", [None])[0]
-            self.__class__.server_data["code"] = code
-            self.__class__.server_data["state"] = state
-            self.__class__.server_event.set()
-
-            self.send_response(200)
-            self.send_header("Content-type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(b"<html><body><h2>Authentication complete, you can close this window.</h2></body></html>")
-
-        def log_message(self, format, *args):
-            return
+    @property
+    def index(self):
+        if self._index is None:
+            from .index import LocalIndex
+            self._index = LocalIndex(self.index_path)
+        return self._index
 
-    def _run_local_server(self, timeout: int = 300):
-        handler = self.OAuthHandler
-        handler.server_data = {"code": None, "state": None}
-        handler.server_event = threading.Event()
+    @property
+    def outbox(self):
+        with self._outbox_lock:
+            if self._outbox is None:
+                from .outbox import Outbox
+                self._outbox = Outbox(self.outbox_path)
+            return self._outbox
 
-        httpd = http.server.ThreadingHTTPServer(("127.0.0.1", LOCAL_PORT), handler)
-        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
-        thread.start()
+    @property
+    def outbox_flusher(self):
+        outbox = self.outbox
+        with self._outbox_lock:
+            if self._outbox_flusher is None:
+                from .outbox import OutboxFlusher
+                self._outbox_flusher = OutboxFlusher(self, outbox)
+            return self._outbox_flusher
 
-        waited = handler.server_event.wait(timeout=timeout)
-        if not waited:
-            try:
-                httpd.shutdown()
-                httpd.server_close()
-            except Exception:
-                pass
-            return None, None
+    @property
+    def parse_pool(self):
+        if self._parse_pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_processes)
+        return self._parse_pool
 
-        code = handler.server_data.get("code")
-        state = handler.server_data.get("state")
-        try:
-            httpd.shutdown()
-            httpd.server_close()
-        except Exception:
-            pass
-        return code, state
+    def close(self):
+        if self._parse_pool is not None:
+            self._parse_pool.shutdown()
+            self._parse_pool = None
+        if self._index is not None:
+            self._index.close()
+            self._index = None
+        if self._websocket is not None:
+            self._websocket.close()
+            self._websocket = None
+        if self._outbox_flusher is not None:
+            self._outbox_flusher.stop()
+            self._outbox_flusher = None
+        if self._outbox is not None:
+            self._outbox.close()
+            self._outbox = None
+
+    @property
+    def websocket(self):
+        with self._websocket_lock:
+            if self._websocket is not None and self._websocket.session_token != self.session_token:
+                # signed in again since it connected
+                self._websocket.close()
+                self._websocket = None
+            if self._websocket is None:
+                from .ws import WebSocketTransport
+                self._websocket = WebSocketTransport(self.backend_url, self.session_token)
+            return self._websocket
+
+    def _websocket_call(self, method: str, path: str, kwargs: dict) -> Optional[Tuple[str, dict]]:
+        if self.transport != "websocket":
+            return None
+        from .ws import to_call
+        return to_call(method, path, kwargs.get("params"), kwargs.get("headers"))
+
+    def _indexed(self, messages: List[dict]):
+        if self.index_path is not None and messages:
+            self.index.add(messages)
+
+    def _parsed(self, data: dict):
+        if not self.models:
+            return data
+        from .models import ParsedEmail
+        return ParsedEmail.from_dict(data)
+
+    def _listed(self, result: dict) -> dict:
+        if self.models and result.get("messages"):
+            from .models import MessageRef
+            result["messages"] = [MessageRef.from_dict(msg) for msg in result["messages"]]
+        return result
+
+    def _run_local_server(self, timeout: int = 300):
+        from .oauth import run_local_server
+        return run_local_server(timeout=timeout)
 
     def authenticate(self, open_browser: bool = True, timeout: int = 300) -> str:
-        resp = requests.get(f"{self.backend_url}/authorize")
+        resp = self._request("GET", "/authorize", headers={})
         resp.raise_for_status()
         data = resp.json()
         auth_url = data["auth_url"]
         expected_state = data.get("state")
 
         if open_browser:
+            import webbrowser
             webbrowser.open(auth_url)
         else:
             print("Open this URL in your browser:", auth_url)
@@ -98,8 +166,8 @@ class GmailClient:
 
         state_to_send = returned_state or expected_state
 
-        token_resp = requests.post(
-            f"{self.backend_url}/exchange_code", json={"code": code, "state": state_to_send}
+        token_resp = self._request(
+            "POST", "/exchange_code", headers={}, json={"code": code, "state": state_to_send}
         )
         token_resp.raise_for_status()
         self.session_token = token_resp.json()["session_token"]
@@ -113,12 +181,131 @@ class GmailClient:
 
         return self.session_token
     
-    def _rate_limit(self):
+    def _throttle_delay(self) -> float:
         now = time.time()
-        elapsed = now - self._last_call
-        if elapsed < self._min_interval:
-            time.sleep(self._min_interval - elapsed)
-        self._last_call = time.time()
+        return max(self._min_interval - (now - self._last_call), self._quota_resume - now, 0.0)
+
+    def _follow_quota(self, headers):
+        remaining = headers.get("X-Quota-Remaining")
+        if remaining is None:
+            return
+        limit = int(headers.get("X-Quota-Limit") or 0)
+        if int(remaining) <= limit * self.QUOTA_RESERVE:
+            self._quota_resume = time.time() + float(headers.get("X-Quota-Reset") or 0)
+
+    def _reserve_call(self) -> float:
+        # Claim the next slot before sleeping, so concurrent callers queue up
+        # behind each other instead of all waking at the same moment.
+        with self._rate_lock:
+            wait = self._throttle_delay()
+            self._last_call = time.time() + wait
+        return wait
+
+    def _rate_limit(self):
+        wait = self._reserve_call()
+        if wait > 0:
+            time.sleep(wait)
+            self._emit("rate_limit", seconds=wait)
+
+    def add_hook(self, hook: Hook) -> None:
+        self.hooks.append(hook)
+
+    def _emit(self, event: str, **data):
+        for hook in self.hooks:
+            try:
+                hook(event, data)
+            except Exception:
+                logger.exception("Hook %r failed on %s event", hook, event)
+
+    def _send(self, method: str, path: str, **kwargs) -> "requests.Response":
+        import requests
+
+        call = self._websocket_call(method, path, kwargs)
+        self._emit("request_start", method=method, path=path)
+        start = time.perf_counter()
+        try:
+            if call is not None:
+                from .ws import sync_response
+                try:
+                    status, headers, body, sent = self.websocket.call(*call)
+                except ConnectionError as e:
+                    raise requests.ConnectionError(e) from e
+                resp = sync_response(f"{self.backend_url}{path}", status, headers, body)
+            else:
+                resp = (self.http or requests).request(method, f"{self.backend_url}{path}", **kwargs)
+                sent = len(resp.request.body) if resp.request.body else 0
+        except Exception as e:
+            self._emit("request_end", method=method, path=path, status=None, duration=time.perf_counter() - start,
+                       bytes_sent=0, bytes_received=0, error=repr(e))
+            raise
+        self._follow_quota(resp.headers)
+        self._emit("request_end", method=method, path=path, status=resp.status_code, duration=time.perf_counter() - start,
+                   bytes_sent=sent, bytes_received=len(resp.content), error=None)
+        return resp
+
+    def _request(self, method: str, path: str, **kwargs) -> "requests.Response":
+        import requests
+        from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+        kwargs.setdefault("headers", {"Authorization": f"Bearer {self.session_token}"})
+        for attempt in range(1, self.retry.max_attempts + 1):
+            probe = self.breaker.check()
+            if attempt > 1:
+                for _, value in kwargs.get("files") or []:
+                    if isinstance(value, tuple) and hasattr(value[1], "seek"):
+                        value[1].seek(0)
+            try:
+                resp = self._send(method, path, **kwargs)
+            except requests.RequestException as e:
+                self.breaker.record(False)
+                cause = getattr(e.args[0], "reason", None) if e.args else None
+                connect_failed = isinstance(e, requests.ConnectTimeout) or isinstance(cause, (NewConnectionError, ConnectTimeoutError))
+                if attempt == self.retry.max_attempts or not self.retry.should_retry(method, connect_failed=connect_failed):
+                    raise
+                delay, reason = self.retry.delay(attempt), repr(e)
+            except BaseException:
+                if probe:
+                    self.breaker.release()
+                raise
+            else:
+                self.breaker.record(resp.status_code < 500)
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                if (
+                    attempt == self.retry.max_attempts
+                    or not self.retry.should_retry(method, status=resp.status_code)
+                    or (retry_after or 0) > self.retry.max_retry_after
+                ):
+                    return resp
+                delay, reason = self.retry.delay(attempt, retry_after), resp.status_code
+            self._emit("retry", method=method, path=path, attempt=attempt, delay=delay, reason=reason)
+            time.sleep(delay)
+
+    def _stored(self, key: str) -> Optional[tuple]:
+        with self._responses_lock:
+            return self._responses.get(key)
+
+    def _validator_headers(self, stored: Optional[tuple]) -> dict:
+        headers = {"Authorization": f"Bearer {self.session_token}"}
+        if stored is not None:
+            headers["If-None-Match"] = stored[0]
+        return headers
+
+    def _stored_json(self, key: str, stored: Optional[tuple], status: int, etag: Optional[str], body: bytes) -> dict:
+        import json
+
+        if status == 304 and stored is not None:
+            with self._responses_lock:
+                if key in self._responses:
+                    self._responses.move_to_end(key)
+            # parsed again each time so callers can't change each other's copies
+            return json.loads(stored[1])
+        if etag and self.response_cache_size > 0:
+            with self._responses_lock:
+                self._responses[key] = (etag, body)
+                self._responses.move_to_end(key)
+                while len(self._responses) > self.response_cache_size:
+                    self._responses.popitem(last=False)
+        return json.loads(body)
 
     def init(self, session_token_or_path: Optional[Union[str, Path]] = None) -> None:
         if session_token_or_path is None:
@@ -152,7 +339,7 @@ class GmailClient:
         if not self.session_token:
             return False
         try:
-            resp = requests.get(f"{self.backend_url}/me", headers={"Authorization": f"Bearer {self.session_token}"})
+            resp = self._request("GET", "/me")
             return resp.status_code == 200
         except Exception:
             return False
@@ -160,14 +347,16 @@ class GmailClient:
     def me(self) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
-        resp = requests.get(f"{self.backend_url}/me", headers={"Authorization": f"Bearer {self.session_token}"})
+        resp = self._request("GET", "/me")
         resp.raise_for_status()
         return resp.json()
 
     # holy long ass function definition
-    def send_email(self, to: Union[str, List[str]], subject: str, body: Optional[str] = None, html: Optional[str] = None, cc: Optional[Union[str, List[str]]] = None, bcc: Optional[Union[str, List[str]]] = None, attachments: Optional[List[Union[str, Path]]] = None, reply: Optional[str] = None) -> dict:
+    def send_email(self, to: Union[str, List[str]], subject: str, body: Optional[str] = None, html: Optional[str] = None, cc: Optional[Union[str, List[str]]] = None, bcc: Optional[Union[str, List[str]]] = None, attachments: Optional[List[Union[str, Path, Tuple[str, bytes]]]] = None, reply: Optional[str] = None, background: bool = False, queued: bool = False) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
+        if queued:
+            return self._queue_email(to, subject, body, html, cc, bcc, attachments, reply)
 
         def normalize_list(v):
             if v is None:
@@ -197,12 +386,18 @@ class GmailClient:
             data.append(("html", html))
         if reply:
             data.append(("reply", reply))
+        if background:
+            data.append(("background", "true"))
 
         files = []
         file_objs = []
         try:
             if attachments:
                 for p in attachments:
+                    if isinstance(p, tuple):
+                        # (filename, content), e.g. from the outbox
+                        files.append(("attachments", p))
+                        continue
                     pth = Path(p)
                     if not pth.exists():
                         raise FileNotFoundError(f"Attachment not found: {p}")
@@ -214,11 +409,11 @@ class GmailClient:
 
             # Always send as multipart/form-data by using files parameter
             # even if files list is empty
-            resp = requests.post(
-                f"{self.backend_url}/send_email",
+            resp = self._request(
+                "POST",
+                "/send_email",
                 data=data,
                 files=files if files else [],  # Send empty list instead of None
-                headers={"Authorization": f"Bearer {self.session_token}"},
             )
             resp.raise_for_status()
             return resp.json()
@@ -226,12 +421,49 @@ class GmailClient:
             for f in file_objs:
                 f.close()            
 
+    def _queue_email(self, to, subject, body, html, cc, bcc, attachments, reply, flush: bool = True) -> dict:
+        from .outbox import account_of
+
+        def normalize_list(v):
+            if v is None:
+                return []
+            return [str(x) for x in v] if isinstance(v, (list, tuple)) else [str(v)]
+
+        files = []
+        for p in attachments or []:
+            if isinstance(p, tuple):
+                files.append((p[0], bytes(p[1])))
+                continue
+            pth = Path(p)
+            if not pth.exists():
+                raise FileNotFoundError(f"Attachment not found: {p}")
+            # copied now: the file may be gone or changed by the time it is sent
+            files.append((pth.name, pth.read_bytes()))
+        message = {
+            "to": normalize_list(to), "cc": normalize_list(cc), "bcc": normalize_list(bcc),
+            "subject": subject, "body": body, "html": html, "reply": reply,
+        }
+        outbox_id = self.outbox.enqueue(account_of(self.session_token), message, files)
+        if flush:
+            flusher = self.outbox_flusher
+            flusher.start()
+            flusher.wake()
+        return {"outbox_id": outbox_id, "status": "queued"}
+
+    def get_send_status(self, job_id: str) -> dict:
+        if not self.session_token:
+            raise RuntimeError("Client not initialized. Call init() first.")
+
+        resp = self._request("GET", f"/send_status/{job_id}")
+        resp.raise_for_status()
+        return resp.json()
+
     def authenticate_cli(self, open_browser: bool = True):
         token = self.authenticate(open_browser=open_browser)
         print("Authentication successful. Session token saved to:", str(self.session_file))
         return token
 
-    def list_emails(self, max_results: int = 10, query: Optional[str] = None, page_token: Optional[str] = None) -> dict:
+    def list_emails(self, max_results: int = 10, query: Optional[str] = None, page_token: Optional[str] = None, fields: Optional[str] = None) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
         
@@ -240,43 +472,85 @@ class GmailClient:
             params["query"] = query
         if page_token:
             params["page_token"] = page_token
+        if fields:
+            params["fields"] = fields
         
         self._rate_limit()
         
-        resp = requests.get(
-            f"{self.backend_url}/list_emails",
-            params=params,
-            headers={"Authorization": f"Bearer {self.session_token}"}
-        )
+        resp = self._request("GET", "/list_emails", params=params)
         resp.raise_for_status()
-        return resp.json()
+        return self._listed(resp.json())
 
-    def get_email(self, message_id: str, format: str = "full") -> dict:
+    def get_email(self, message_id: str, format: str = "full", fields: Optional[str] = None) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
         
         self._rate_limit()
         
-        resp = requests.get(
-            f"{self.backend_url}/get_email/{message_id}",
-            params={"format": format},
-            headers={"Authorization": f"Bearer {self.session_token}"}
-        )
+        params = {"format": format, **({"fields": fields} if fields else {})}
+        key = f"/get_email/{message_id}?format={format}" + (f"&fields={fields}" if fields else "")
+        stored = self._stored(key)
+        resp = self._request("GET", f"/get_email/{message_id}", params=params, headers=self._validator_headers(stored))
+        if resp.status_code != 304:
+            resp.raise_for_status()
+        return self._stored_json(key, stored, resp.status_code, resp.headers.get("ETag"), resp.content)
+
+    def _fetch_raw(self, message_id: str) -> dict:
+        self._rate_limit()
+        # not through get_email, whose response cache has no use for whole raw messages
+        resp = self._request("GET", f"/get_email/{message_id}", params={"format": "raw"})
         resp.raise_for_status()
         return resp.json()
 
-    def get_parsed_email(self, message_id: str) -> dict:
+    def get_parsed_email(self, message_id: str, fields: Optional[str] = None) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
+
+        # a partial response is smaller than the raw message, so `fields` always goes to the backend
+        if self.parse_locally and not fields:
+            from .mime import ATTACHMENT_ID_FIELDS, add_attachment_ids, parse_raw_response
+            data = self.parse_pool.submit(parse_raw_response, self._fetch_raw(message_id)).result()
+            if data["attachments"]:
+                # needed to download them; a small request, only for messages that have any
+                data = add_attachment_ids(data, self.get_email(message_id, fields=ATTACHMENT_ID_FIELDS))
+            self._indexed([data])
+            return self._parsed(data)
         
         self._rate_limit()
         
-        resp = requests.get(
-            f"{self.backend_url}/get_parsed_email/{message_id}",
-            headers={"Authorization": f"Bearer {self.session_token}"}
-        )
+        path = f"/get_parsed_email/{message_id}"
+        key = path + (f"?fields={fields}" if fields else "")
+        stored = self._stored(key)
+        resp = self._request("GET", path, params={"fields": fields} if fields else None, headers=self._validator_headers(stored))
+        if resp.status_code != 304:
+            resp.raise_for_status()
+        data = self._stored_json(key, stored, resp.status_code, resp.headers.get("ETag"), resp.content)
+        if resp.status_code != 304 and not fields:
+            self._indexed([data])
+        return self._parsed(data)
+
+    def get_thread(self, thread_id: str, fields: Optional[str] = None) -> dict:
+        if not self.session_token:
+            raise RuntimeError("Client not initialized. Call init() first.")
+
+        self._rate_limit()
+
+        resp = self._request("GET", f"/get_thread/{thread_id}", params={"fields": fields} if fields else None)
         resp.raise_for_status()
-        return resp.json()
+        thread = resp.json()
+        if not fields:
+            self._indexed(thread.get("messages", []))
+        if "messages" in thread:
+            thread["messages"] = [self._parsed(msg) for msg in thread["messages"]]
+        return thread
+
+    def search_local(self, query: str, limit: int = 20, newest_first: bool = False) -> List[dict]:
+        """Search messages this client has fetched, without contacting the backend.
+
+        Needs `index_path`. Takes words, "quoted phrases", OR/NOT and from:, to:, subject:, body: prefixes."""
+        if self.index_path is None:
+            raise RuntimeError("Local index disabled. Pass index_path to GmailClient().")
+        return self.index.search(query, limit=limit, newest_first=newest_first)
 
     def get_attachment(self, message_id: str, attachment_id: str, output_path: Optional[Union[str, Path]] = None) -> bytes:
         if not self.session_token:
@@ -284,10 +558,7 @@ class GmailClient:
         
         self._rate_limit()
         
-        resp = requests.get(
-            f"{self.backend_url}/get_attachment/{message_id}/{attachment_id}",
-            headers={"Authorization": f"Bearer {self.session_token}"}
-        )
+        resp = self._request("GET", f"/get_attachment/{message_id}/{attachment_id}")
         resp.raise_for_status()
         
         data = resp.json()
@@ -302,49 +573,123 @@ class GmailClient:
         
         return attachment_bytes
 
-    def download_all_attachments(self, message_id: str, output_dir: Union[str, Path] = "./attachments") -> List[Path]:
-        output_dir = Path(output_dir)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Get parsed email to find attachments
-        email_data = self.get_parsed_email(message_id)
-        attachments = email_data.get("attachments", [])
-        
-        if not attachments:
-            return []
-        
-        saved_paths = []
-        for att in attachments:
-            filename = att.get("filename", "unnamed_attachment")
+    def _plan_attachments(self, message_id: str, email_data: dict, directory: Path, taken: set) -> List[Tuple[str, Path]]:
+        from .attachments import unique_path
+
+        plan = []
+        for att in email_data.get("attachments", []):
             attachment_id = att.get("attachment_id")
-            
             if not attachment_id:
                 continue
-            
-            # Handle duplicate filenames
-            output_path = output_dir / filename
-            counter = 1
-            while output_path.exists():
-                name_parts = filename.rsplit(".", 1)
-                if len(name_parts) == 2:
-                    output_path = output_dir / f"{name_parts[0]}_{counter}.{name_parts[1]}"
-                else:
-                    output_path = output_dir / f"{filename}_{counter}"
-                counter += 1
-            
-            self.get_attachment(message_id, attachment_id, output_path)
-            saved_paths.append(output_path)
-            print(f"Downloaded: {output_path}")
-        
-        return saved_paths
+            plan.append((attachment_id, unique_path(directory, att.get("filename") or "unnamed_attachment", taken)))
+        return plan
+
+    def download_attachments(self, message_ids: List[str], output_dir: Union[str, Path] = "./attachments", concurrency: int = 8, store_dir: Optional[Union[str, Path]] = None, flat: bool = False) -> Dict[str, List[Path]]:
+        """Download every attachment of many messages, `concurrency` requests at a time.
+
+        Files go to output_dir/<message_id>/ (or straight into output_dir with flat=True).
+        Identical files are stored once under store_dir (default output_dir/.store) and hard-linked.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from .attachments import ContentStore
+
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        store = ContentStore(store_dir or output_dir / ".store")
+        taken = set()
+        results: Dict[str, List[Path]] = {}
+
+        def fetch(message_id, attachment_id, path):
+            store.save(self.get_attachment(message_id, attachment_id), path)
+            logger.info("Downloaded: %s", path)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            jobs = []
+            for message_id, email_data in zip(message_ids, pool.map(self.get_parsed_email, message_ids)):
+                directory = output_dir if flat else output_dir / message_id
+                plan = self._plan_attachments(message_id, email_data, directory, taken)
+                results[message_id] = [path for _, path in plan]
+                jobs.extend(pool.submit(fetch, message_id, attachment_id, path) for attachment_id, path in plan)
+            for job in jobs:
+                job.result()
+        return results
+
+    def download_all_attachments(self, message_id: str, output_dir: Union[str, Path] = "./attachments", concurrency: int = 8, store_dir: Optional[Union[str, Path]] = None) -> List[Path]:
+        return self.download_attachments([message_id], output_dir, concurrency, store_dir, flat=True)[message_id]
     
-    def export_emails(self, target: Union[str, List[str]], output_file: str = "emails_export.csv", format: str = "csv"):
+    def mirror(self, directory: Union[str, Path], query: Optional[str] = None, concurrency: int = 8, progress: Optional[Callable[[int, int], None]] = None) -> dict:
+        """Keep a Maildir copy of the mailbox (or of what `query` matches) in `directory`.
+
+        Messages are fetched whole (format=raw), `concurrency` at a time, while the listing
+        continues. IDs already in the directory's manifest are skipped, so re-runs only fetch new mail."""
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
+
+        from concurrent.futures import ThreadPoolExecutor, as_completed
+        from .mirror import Maildir
+
+        maildir = Maildir(directory)
+        known = maildir.known()
+
+        def fetch(mid):
+            data = self._fetch_raw(mid)
+            raw = data["raw"]
+            raw = base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4))
+            maildir.write(mid, raw, data.get("internalDate"), data.get("labelIds"))
+
+        listed = 0
+        futures = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            page_token = None
+            while True:
+                res = self.list_emails(max_results=100, query=query, page_token=page_token)
+                for msg in res.get("messages", []):
+                    listed += 1
+                    if msg["id"] not in known:
+                        # pages can overlap when mail arrives during the listing
+                        known.add(msg["id"])
+                        futures[pool.submit(fetch, msg["id"])] = msg["id"]
+                page_token = res.get("next_page_token")
+                if not page_token:
+                    break
+            logger.info("Mirroring %d new of %d messages to %s", len(futures), listed, maildir.directory)
+
+            done, failed, batch = 0, [], []
+            for future in as_completed(futures):
+                mid = futures[future]
+                try:
+                    future.result()
+                    batch.append(mid)
+                except Exception as e:
+                    # not in the manifest, so the next run tries it again
+                    logger.warning("  Failed to mirror message %s: %s", mid, e)
+                    failed.append(mid)
+                done += 1
+                # A crash loses at most one batch of manifest lines; those messages are
+                # fetched again and overwrite their own files.
+                if len(batch) >= 100:
+                    maildir.record(batch)
+                    batch = []
+                if done % 50 == 0:
+                    logger.info("  Mirrored %d/%d...", done, len(futures))
+                if progress:
+                    progress(done, len(futures))
+            maildir.record(batch)
+
+        logger.info("Mirrored %d new messages to %s", done - len(failed), maildir.directory)
+        return {"listed": listed, "fetched": done - len(failed), "skipped": listed - len(futures), "failed": failed}
+
+    def export_emails(self, target: Union[str, List[str]], output_file: str = "emails_export.csv", format: str = "csv", progress: Optional[Callable[[int, int], None]] = None):
+        if not self.session_token:
+            raise RuntimeError("Client not initialized. Call init() first.")
+
+        import csv
         
         messages_to_fetch = []
+        # messages that arrived already parsed (a whole thread comes in one request)
+        prefetched = {}
         
-        print(f"Gathering message list for target: {target}...")
+        logger.info("Gathering message list for target: %s...", target)
 
         if isinstance(target, list):
             messages_to_fetch = [{"id": mid} for mid in target]
@@ -354,64 +699,211 @@ class GmailClient:
                 res = self.list_emails(max_results=50, page_token=page_token)
                 msgs = res.get("messages", [])
                 messages_to_fetch.extend(msgs)
-                print(f"  Found {len(messages_to_fetch)} messages so far...")
+                logger.info("  Found %d messages so far...", len(messages_to_fetch))
                 page_token = res.get("next_page_token")
                 if not page_token:
                     break
         elif target.startswith("thread:"):
             thread_id = target.split(":")[1]
-            res = self.list_emails(max_results=100, query=f"thread:{thread_id}")
-            messages_to_fetch = res.get("messages", [])
+            thread = self.get_thread(thread_id)
+            prefetched = {msg["id"]: msg for msg in thread.get("messages", [])}
+            messages_to_fetch = [{"id": mid} for mid in prefetched]
         else:
             res = self.list_emails(max_results=100, query=target)
             messages_to_fetch = res.get("messages", [])
 
-        print(f"Starting download of {len(messages_to_fetch)} emails.")
+        logger.info("Starting download of %d emails.", len(messages_to_fetch))
         
-        fieldnames = ["id", "thread_id", "date", "from", "to", "subject", "snippet", "body_plain", "has_attachments"]
+        header = ["id", "thread_id", "date", "from", "to", "subject", "snippet", "body_plain", "has_attachments"]
+
+        def patiently(fetch, mid):
+            # Requests are already retried; an open circuit means the backend is down,
+            # so wait it out instead of failing every remaining message.
+            for attempt in range(1, self.retry.max_attempts + 1):
+                try:
+                    return fetch(mid)
+                except CircuitOpenError as e:
+                    if attempt == self.retry.max_attempts:
+                        raise
+                    logger.warning("  Backend unavailable, waiting %.0fs...", e.retry_after)
+                    time.sleep(e.retry_after)
+
+        def fetch_row(mid):
+            data = prefetched.pop(mid, None)
+            if data is None:
+                data = patiently(self.get_parsed_email, mid)
+            return to_row(data)
+
+        def to_row(data):
+            # a plain list in `header` order: no per-row dict for csv to unpack again
+            headers = data["headers"]
+            return [
+                data.get("id"),
+                data.get("thread_id"),
+                headers.get("Date"),
+                headers.get("From"),
+                headers.get("To"),
+                headers.get("Subject"),
+                data.get("snippet"),
+                (data.get("body_plain") or "")[:32000],
+                "Yes" if data.get("attachments") else "No",
+            ]
         
         try:
             with open(output_file, mode='w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                writer.writeheader()
+                writer = csv.writer(csvfile)
+                writer.writerow(header)
+                failed = []
+                # With local parsing the next messages download while earlier ones are
+                # parsed in the pool; rows are still written in order.
+                parsing = deque()
+
+                def write_parsed(limit):
+                    while len(parsing) > limit:
+                        mid, future = parsing.popleft()
+                        try:
+                            data = future.result()
+                            self._indexed([data])
+                            writer.writerow(to_row(data))
+                        except Exception as e:
+                            logger.warning("  Failed to parse message %s, will retry: %s", mid, e)
+                            failed.append(mid)
+
+                if self.parse_locally:
+                    from .mime import parse_raw_response
+                    window = 2 * (self.parse_processes or os.cpu_count() or 1)
                 
                 for i, msg_obj in enumerate(messages_to_fetch):
                     mid = msg_obj["id"]
                     try:
-                        data = self.get_parsed_email(mid)
-                        row = {
-                            "id": data.get("id"),
-                            "thread_id": data.get("thread_id"),
-                            "date": data["headers"].get("Date"),
-                            "from": data["headers"].get("From"),
-                            "to": data["headers"].get("To"),
-                            "subject": data["headers"].get("Subject"),
-                            "snippet": data.get("snippet"),
-                            "body_plain": data.get("body_plain", "")[:32000],
-                            "has_attachments": "Yes" if data.get("attachments") else "No"
-                        }
-                        writer.writerow(row)
+                        if self.parse_locally and mid not in prefetched:
+                            parsing.append((mid, self.parse_pool.submit(parse_raw_response, patiently(self._fetch_raw, mid))))
+                            write_parsed(window)
+                        else:
+                            writer.writerow(fetch_row(mid))
                         if i % 5 == 0:
-                            print(f"  Processed {i+1}/{len(messages_to_fetch)}...")
+                            logger.info("  Processed %d/%d...", i + 1, len(messages_to_fetch))
                             
                     except Exception as e:
-                        print(f"  Failed to fetch message {mid}: {e}")
+                        logger.warning("  Failed to fetch message %s, will retry: %s", mid, e)
+                        failed.append(mid)
+
+                    if progress:
+                        progress(i + 1, len(messages_to_fetch))
+
+                write_parsed(0)
+
+                lost = 0
+                if failed:
+                    logger.info("Retrying %d failed messages...", len(failed))
+                    for mid in failed:
+                        try:
+                            writer.writerow(fetch_row(mid))
+                        except Exception as e:
+                            logger.error("  Failed to fetch message %s: %s", mid, e)
+                            lost += 1
                         
-            print(f"Successfully exported {len(messages_to_fetch)} emails to {output_file}")
+            logger.info("Successfully exported %d emails to %s", len(messages_to_fetch) - lost, output_file)
             
         except IOError as e:
-            print(f"Error writing file: {e}")
+            logger.error("Error writing file: %s", e)
 
     async def _async_rate_limit(self):
-        now = time.time()
-        elapsed = now - self._last_call
-        if elapsed < self._min_interval:
-            await asyncio.sleep(self._min_interval - elapsed)
-        self._last_call = time.time()
+        wait = self._reserve_call()
+        if wait > 0:
+            import asyncio
+            await asyncio.sleep(wait)
+            self._emit("rate_limit", seconds=wait)
+
+    async def _send_async(self, method: str, path: str, **kwargs) -> "Tuple[aiohttp.ClientResponse, bytes]":
+        import aiohttp
+
+        call = self._websocket_call(method, path, kwargs)
+        self._emit("request_start", method=method, path=path)
+        start = time.perf_counter()
+        status, received, error = None, 0, None
+        try:
+            if call is not None:
+                from .ws import AsyncResponse
+                try:
+                    status, headers, body, _ = await self.websocket.call_async(*call)
+                except ConnectionError as e:
+                    raise aiohttp.ClientConnectionError(str(e)) from e
+                resp = AsyncResponse(f"{self.backend_url}{path}", status, headers)
+                self._follow_quota(resp.headers)
+                received = len(body)
+                return resp, body
+            async with aiohttp.ClientSession() as session:
+                async with session.request(method, f"{self.backend_url}{path}", **kwargs) as resp:
+                    status = resp.status
+                    self._follow_quota(resp.headers)
+                    # read before the session closes; the body can't be read afterwards
+                    body = await resp.read()
+                    received = len(body)
+                    return resp, body
+        except Exception as e:
+            error = repr(e)
+            raise
+        finally:
+            self._emit("request_end", method=method, path=path, status=status, duration=time.perf_counter() - start,
+                       bytes_sent=None, bytes_received=received, error=error)
+
+    async def _request_async(self, method: str, path: str, **kwargs) -> dict:
+        import json
+
+        _, body = await self._response_async(method, path, **kwargs)
+        return json.loads(body)
+
+    async def _response_async(self, method: str, path: str, **kwargs) -> "Tuple[aiohttp.ClientResponse, bytes]":
+        import asyncio
+        import aiohttp
+
+        kwargs.setdefault("headers", {"Authorization": f"Bearer {self.session_token}"})
+        # Request bodies like FormData can only be sent once, so `data` may be a
+        # function building a fresh one for each attempt.
+        data = kwargs.get("data")
+        for attempt in range(1, self.retry.max_attempts + 1):
+            probe = self.breaker.check()
+            if callable(data):
+                kwargs["data"] = data()
+            try:
+                resp, body = await self._send_async(method, path, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.breaker.record(False)
+                connect_failed = isinstance(e, aiohttp.ClientConnectorError)
+                if attempt == self.retry.max_attempts or not self.retry.should_retry(method, connect_failed=connect_failed):
+                    raise
+                delay, reason = self.retry.delay(attempt), repr(e)
+            except BaseException:
+                # cancelled (wait_for, task.cancel) or failed outside the transport
+                if probe:
+                    self.breaker.release()
+                raise
+            else:
+                self.breaker.record(resp.status < 500)
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                if (
+                    attempt == self.retry.max_attempts
+                    or not self.retry.should_retry(method, status=resp.status)
+                    or (retry_after or 0) > self.retry.max_retry_after
+                ):
+                    if resp.status != 304:
+                        resp.raise_for_status()
+                    return resp, body
+                delay, reason = self.retry.delay(attempt, retry_after), resp.status
+            self._emit("retry", method=method, path=path, attempt=attempt, delay=delay, reason=reason)
+            await asyncio.sleep(delay)
 
-    async def send_email_async(self, to: Union[str, List[str]], subject: str, body: Optional[str] = None, html: Optional[str] = None, cc: Optional[Union[str, List[str]]] = None, bcc: Optional[Union[str, List[str]]] = None, attachments: Optional[List[Union[str, Path]]] = None, reply: Optional[str] = None) -> dict:
+    async def send_email_async(self, to: Union[str, List[str]], subject: str, body: Optional[str] = None, html: Optional[str] = None, cc: Optional[Union[str, List[str]]] = None, bcc: Optional[Union[str, List[str]]] = None, attachments: Optional[List[Union[str, Path, Tuple[str, bytes]]]] = None, reply: Optional[str] = None, background: bool = False, queued: bool = False) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
+        if queued:
+            import asyncio
+            import functools
+            # reads the attachments and writes to SQLite, so off the event loop
+            return await asyncio.get_running_loop().run_in_executor(
+                None, functools.partial(self._queue_email, to, subject, body, html, cc, bcc, attachments, reply)
+            )
 
         def normalize_list(v):
             if v is None:
@@ -422,44 +914,111 @@ class GmailClient:
         cc_list = normalize_list(cc)
         bcc_list = normalize_list(bcc)
 
-        form_data = aiohttp.FormData()
-        form_data.add_field("subject", subject)
+        import aiohttp
+        import aiofiles
+
+        fields = [("subject", subject, None)]
         
         for email in to_list:
-            form_data.add_field("to", email)
+            fields.append(("to", email, None))
         for email in cc_list:
-            form_data.add_field("cc", email)
+            fields.append(("cc", email, None))
         for email in bcc_list:
-            form_data.add_field("bcc", email)
+            fields.append(("bcc", email, None))
         
         if body:
-            form_data.add_field("body", body)
+            fields.append(("body", body, None))
         if html:
-            form_data.add_field("html", html)
+            fields.append(("html", html, None))
         if reply:
-            form_data.add_field("reply", reply)
+            fields.append(("reply", reply, None))
+        if background:
+            fields.append(("background", "true", None))
 
         if attachments:
             for p in attachments:
+                if isinstance(p, tuple):
+                    fields.append(("attachments", p[1], p[0]))
+                    continue
                 pth = Path(p)
                 if not pth.exists():
                     raise FileNotFoundError(f"Attachment not found: {p}")
                 async with aiofiles.open(pth, "rb") as f:
                     content = await f.read()
-                    form_data.add_field("attachments", content, filename=pth.name)
+                    fields.append(("attachments", content, pth.name))
+
+        def form_data():
+            form = aiohttp.FormData()
+            for name, value, filename in fields:
+                form.add_field(name, value, filename=filename)
+            return form
 
         await self._async_rate_limit()
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.backend_url}/send_email",
-                data=form_data,
-                headers={"Authorization": f"Bearer {self.session_token}"}
-            ) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        return await self._request_async("POST", "/send_email", data=form_data)
+
+    async def watch(self, since: Optional[str] = None) -> AsyncIterator[dict]:
+        """Yield mailbox changes as the backend sees them, e.g.
+        {"type": "message_added", "id": ..., "thread_id": ..., "labels": [...], "history_id": ...}.
 
-    async def list_emails_async(self, max_results: int = 10, query: Optional[str] = None, page_token: Optional[str] = None) -> dict:
+        A {"type": "resync"} event means changes were missed and the mailbox should be listed again.
+        Dropped connections are re-opened, resuming after the last change seen."""
+        if not self.session_token:
+            raise RuntimeError("Client not initialized. Call init() first.")
+
+        import asyncio
+        import json
+        import aiohttp
+
+        # the backend sends a keepalive every 15s, so a silent minute means a dead connection
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
+        failures = 0
+        while True:
+            headers = {"Authorization": f"Bearer {self.session_token}", "Accept": "text/event-stream"}
+            if since:
+                headers["Last-Event-ID"] = since
+            # not reported as request_start/request_end: a stream open for hours would skew latency stats
+            status, error = None, None
+            try:
+                async with aiohttp.ClientSession(timeout=timeout) as session:
+                    async with session.get(f"{self.backend_url}/events", headers=headers) as resp:
+                        status = resp.status
+                        if resp.status not in self.retry.retry_statuses:
+                            resp.raise_for_status()
+                        if resp.status == 200:
+                            failures = 0
+                            data = []
+                            async for raw in resp.content:
+                                line = raw.decode("utf-8").rstrip("\r\n")
+                                if line.startswith(":"):
+                                    continue
+                                if line:
+                                    field, _, value = line.partition(":")
+                                    if field == "data":
+                                        data.append(value[1:] if value.startswith(" ") else value)
+                                    continue
+                                if not data:
+                                    continue
+                                event = json.loads("\n".join(data))
+                                data = []
+                                since = event.get("history_id") or since
+                                yield event
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                error = repr(e)
+            failures += 1
+            if failures >= self.retry.max_attempts:
+                raise RuntimeError(f"Event stream failed {failures} times in a row: {error or status}")
+            delay = self.retry.delay(failures)
+            self._emit("retry", method="GET", path="/events", attempt=failures, delay=delay, reason=error or status)
+            await asyncio.sleep(delay)
+
+    async def get_send_status_async(self, job_id: str) -> dict:
+        if not self.session_token:
+            raise RuntimeError("Client not initialized. Call init() first.")
+
+        return await self._request_async("GET", f"/send_status/{job_id}")
+
+    async def list_emails_async(self, max_results: int = 10, query: Optional[str] = None, page_token: Optional[str] = None, fields: Optional[str] = None) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
         
@@ -468,46 +1027,64 @@ class GmailClient:
             params["query"] = query
         if page_token:
             params["page_token"] = page_token
+        if fields:
+            params["fields"] = fields
         
         await self._async_rate_limit()
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.backend_url}/list_emails",
-                params=params,
-                headers={"Authorization": f"Bearer {self.session_token}"}
-            ) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        return self._listed(await self._request_async("GET", "/list_emails", params=params))
 
-    async def get_email_async(self, message_id: str, format: str = "full") -> dict:
+    async def get_email_async(self, message_id: str, format: str = "full", fields: Optional[str] = None) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
         
         await self._async_rate_limit()
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.backend_url}/get_email/{message_id}",
-                params={"format": format},
-                headers={"Authorization": f"Bearer {self.session_token}"}
-            ) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        params = {"format": format, **({"fields": fields} if fields else {})}
+        key = f"/get_email/{message_id}?format={format}" + (f"&fields={fields}" if fields else "")
+        stored = self._stored(key)
+        resp, body = await self._response_async("GET", f"/get_email/{message_id}", params=params, headers=self._validator_headers(stored))
+        return self._stored_json(key, stored, resp.status, resp.headers.get("ETag"), body)
 
-    async def get_parsed_email_async(self, message_id: str) -> dict:
+    async def get_parsed_email_async(self, message_id: str, fields: Optional[str] = None) -> dict:
         if not self.session_token:
             raise RuntimeError("Client not initialized. Call init() first.")
+
+        if self.parse_locally and not fields:
+            import asyncio
+            from .mime import ATTACHMENT_ID_FIELDS, add_attachment_ids, parse_raw_response
+
+            await self._async_rate_limit()
+            raw = await self._request_async("GET", f"/get_email/{message_id}", params={"format": "raw"})
+            data = await asyncio.get_running_loop().run_in_executor(self.parse_pool, parse_raw_response, raw)
+            if data["attachments"]:
+                data = add_attachment_ids(data, await self.get_email_async(message_id, fields=ATTACHMENT_ID_FIELDS))
+            self._indexed([data])
+            return self._parsed(data)
         
         await self._async_rate_limit()
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.backend_url}/get_parsed_email/{message_id}",
-                headers={"Authorization": f"Bearer {self.session_token}"}
-            ) as resp:
-                resp.raise_for_status()
-                return await resp.json()
+        path = f"/get_parsed_email/{message_id}"
+        key = path + (f"?fields={fields}" if fields else "")
+        stored = self._stored(key)
+        resp, body = await self._response_async("GET", path, params={"fields": fields} if fields else None, headers=self._validator_headers(stored))
+        data = self._stored_json(key, stored, resp.status, resp.headers.get("ETag"), body)
+        if resp.status != 304 and not fields:
+            self._indexed([data])
+        return self._parsed(data)
+
+    async def get_thread_async(self, thread_id: str, fields: Optional[str] = None) -> dict:
+        if not self.session_token:
+            raise RuntimeError("Client not initialized. Call init() first.")
+
+        await self._async_rate_limit()
+
+        thread = await self._request_async("GET", f"/get_thread/{thread_id}", params={"fields": fields} if fields else None)
+        if not fields:
+            self._indexed(thread.get("messages", []))
+        if "messages" in thread:
+            thread["messages"] = [self._parsed(msg) for msg in thread["messages"]]
+        return thread
 
     async def get_attachment_async(self, message_id: str, attachment_id: str, output_path: Optional[Union[str, Path]] = None) -> bytes:
         if not self.session_token:
@@ -515,17 +1092,13 @@ class GmailClient:
         
         await self._async_rate_limit()
         
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.backend_url}/get_attachment/{message_id}/{attachment_id}",
-                headers={"Authorization": f"Bearer {self.session_token}"}
-            ) as resp:
-                resp.raise_for_status()
-                data = await resp.json()
+        data = await self._request_async("GET", f"/get_attachment/{message_id}/{attachment_id}")
         
         attachment_bytes = base64.urlsafe_b64decode(data["data"])
         
         if output_path:
+            import aiofiles
+
             output_path = Path(output_path)
             output_path.parent.mkdir(parents=True, exist_ok=True)
             async with aiofiles.open(output_path, "wb") as f:
@@ -533,42 +1106,47 @@ class GmailClient:
         
         return attachment_bytes
 
-    async def get_all_attachments(self, message_id: str, output_dir: Union[str, Path] = "./attachments") -> List[Path]:
+    async def download_attachments_async(self, message_ids: List[str], output_dir: Union[str, Path] = "./attachments", concurrency: int = 8, store_dir: Optional[Union[str, Path]] = None, flat: bool = False) -> Dict[str, List[Path]]:
+        import asyncio
+        from .attachments import ContentStore
+
         output_dir = Path(output_dir)
         output_dir.mkdir(parents=True, exist_ok=True)
-        
-        email_data = await self.get_parsed_email_async(message_id)
-        attachments = email_data.get("attachments", [])
-        
-        if not attachments:
-            return []
-        
-        saved_paths = []
-        for att in attachments:
-            filename = att.get("filename", "unnamed_attachment")
-            attachment_id = att.get("attachment_id")
-            
-            if not attachment_id:
-                continue
-            
-            output_path = output_dir / filename
-            counter = 1
-            while output_path.exists():
-                name_parts = filename.rsplit(".", 1)
-                if len(name_parts) == 2:
-                    output_path = output_dir / f"{name_parts[0]}_{counter}.{name_parts[1]}"
-                else:
-                    output_path = output_dir / f"{filename}_{counter}"
-                counter += 1
-            
-            await self.get_attachment_async(message_id, attachment_id, output_path)
-            saved_paths.append(output_path)
-            print(f"Downloaded: {output_path}")
-        
-        return saved_paths
+        store = ContentStore(store_dir or output_dir / ".store")
+        limit = asyncio.Semaphore(concurrency)
+        loop = asyncio.get_running_loop()
+        taken = set()
+        results: Dict[str, List[Path]] = {}
+
+        async def fetch(message_id, attachment_id, path):
+            async with limit:
+                data = await self.get_attachment_async(message_id, attachment_id)
+            # hashing and writing large files would stall the event loop
+            await loop.run_in_executor(None, store.save, data, path)
+            logger.info("Downloaded: %s", path)
+
+        async def fetch_message(message_id):
+            async with limit:
+                email_data = await self.get_parsed_email_async(message_id)
+            directory = output_dir if flat else output_dir / message_id
+            plan = self._plan_attachments(message_id, email_data, directory, taken)
+            results[message_id] = [path for _, path in plan]
+            await asyncio.gather(*(fetch(message_id, attachment_id, path) for attachment_id, path in plan))
+
+        await asyncio.gather(*(fetch_message(message_id) for message_id in message_ids))
+        return {message_id: results[message_id] for message_id in message_ids}
+
+    async def get_all_attachments(self, message_id: str, output_dir: Union[str, Path] = "./attachments", concurrency: int = 8, store_dir: Optional[Union[str, Path]] = None) -> List[Path]:
+        results = await self.download_attachments_async([message_id], output_dir, concurrency, store_dir, flat=True)
+        return results[message_id]
 
 def main():
+    import argparse
+
+    from .index import DEFAULT_INDEX
+
     parser = argparse.ArgumentParser(prog="pygmail", description="pygmail CLI")
+    parser.add_argument("--index", nargs="?", const=str(DEFAULT_INDEX), help=f"Keep fetched emails in a local search index (default: {DEFAULT_INDEX})")
     sub = parser.add_subparsers(dest="command")
 
     auth_p = sub.add_parser("authenticate", help="Authenticate via browser-based OAuth loopback")
@@ -583,6 +1161,17 @@ def main():
     send_p.add_argument("--html", help="HTML string or path to .html file")
     send_p.add_argument("--attach", action="append", help="Attachment file path")
     send_p.add_argument("--reply", help="Thread ID to reply to")
+    send_p.add_argument("--background", action="store_true", help="Queue the email on the backend and return a job ID")
+    send_p.add_argument("--queue", action="store_true", help="Put the email in the local outbox and return; `pygmail outbox flush` sends it")
+
+    outbox_p = sub.add_parser("outbox", help="Show or send the emails waiting in the local outbox")
+    outbox_p.add_argument("action", nargs="?", choices=("list", "flush"), default="list", help="list (default) or flush: send everything waiting, then exit")
+    outbox_p.add_argument("--status", choices=("queued", "sending", "submitted", "sent", "failed"), help="Only list emails in this state")
+    outbox_p.add_argument("--max", type=int, default=20, help="Maximum number of emails to list")
+    outbox_p.add_argument("--timeout", type=float, default=600, help="With flush, give up after this many seconds (default: 600); what is left waits for the next flush")
+
+    status_p = sub.add_parser("status", help="Show the status of a background send job")
+    status_p.add_argument("job_id", help="Job ID returned by send --background")
 
     sub.add_parser("me", help="Show authenticated user info")
     init_p = sub.add_parser("init", help="Load session token from a file or paste token")
@@ -591,23 +1180,89 @@ def main():
     list_p = sub.add_parser("list", help="List emails")
     list_p.add_argument("--max", type=int, default=10, help="Maximum number of emails to list")
     list_p.add_argument("--query", help="Gmail search query (e.g., 'is:unread from:someone@example.com')")
+    list_p.add_argument("--accounts", metavar="DIR", help="List every account with a session file (*.token) in DIR")
+
+    search_p = sub.add_parser("search", help="Search emails and show their headers")
+    search_p.add_argument("query", help="Search query")
+    search_p.add_argument("--max", type=int, default=20, help="Maximum number of results")
+    search_p.add_argument("--local", action="store_true", help="Search the local index instead of Gmail, no network needed")
+    search_p.add_argument("--newest", action="store_true", help="With --local, order by date instead of relevance")
 
     get_p = sub.add_parser("get", help="Get email details")
     get_p.add_argument("message_id", help="Message ID")
 
-    dl_p = sub.add_parser("download", help="Download attachments from an email")
-    dl_p.add_argument("message_id", help="Message ID")
+    dl_p = sub.add_parser("download", help="Download attachments from one or more emails")
+    dl_p.add_argument("message_id", nargs="+", help="Message ID(s); with several, each gets its own subdirectory")
     dl_p.add_argument("--output", "-o", default="./attachments", help="Output directory (default: ./attachments)")
     dl_p.add_argument("--attachment-id", help="Specific attachment ID to download (downloads all if not specified)")
+    dl_p.add_argument("--concurrency", "-c", type=int, default=8, help="Downloads in flight at once (default: 8)")
+
+    mirror_p = sub.add_parser("mirror", help="Keep a local Maildir copy of your mailbox up to date")
+    mirror_p.add_argument("directory", help="Maildir directory (created if missing)")
+    mirror_p.add_argument("--query", help="Only mirror emails matching this Gmail search query")
+    mirror_p.add_argument("--concurrency", "-c", type=int, default=8, help="Downloads in flight at once (default: 8)")
 
     exp_p = sub.add_parser("export", help="Export emails to CSV")
     exp_p.add_argument("target", help="'all', 'thread:THREAD_ID', or a specific message_id")
-    exp_p.add_argument("--output", "-o", default="export.csv", help="Output filename (default: export.csv)")
+    exp_p.add_argument("--output", "-o", default="export.csv", help="Output filename (default: export.csv); a directory with --accounts")
+    exp_p.add_argument("--accounts", metavar="DIR", help="Export every account with a session file (*.token) in DIR, at once, to OUTPUT/<account>.csv")
+
+    bench_p = sub.add_parser("bench", help="Load test a backend and print a JSON report")
+    bench_p.add_argument("--backend", help="Backend URL (default: the client's default)")
+    bench_p.add_argument("--mix", default="list=1,get=4,parsed=4,attachment=1",
+                         help="Weighted operations out of list, get, parsed, attachment, send (default: list=1,get=4,parsed=4,attachment=1)")
+    bench_p.add_argument("--concurrency", "-c", default="1,4,16", help="Comma-separated concurrency levels, one run each (default: 1,4,16)")
+    bench_p.add_argument("--mode", choices=("sync", "async", "both"), default="sync", help="Client path to drive (default: sync)")
+    bench_p.add_argument("--requests", "-n", type=int, default=200, help="Operations per run (default: 200)")
+    bench_p.add_argument("--duration", type=float, help="Seconds per run, instead of --requests")
+    bench_p.add_argument("--sink", help="Address that send operations send to (required for send)")
+    bench_p.add_argument("--attachment-bytes", type=int, default=0, help="Attach a file of this size to every send")
+    bench_p.add_argument("--query", help="Gmail search query choosing the emails to read")
+    bench_p.add_argument("--sample", type=int, default=50, help="Emails to read from (default: 50)")
+    bench_p.add_argument("--rpm", type=int, default=10 ** 6, help="Client-side requests per minute (default: effectively unlimited)")
+    bench_p.add_argument("--transport", choices=("http", "websocket"), default="http", help="Client transport (default: http)")
+    bench_p.add_argument("--no-retry", action="store_true", help="Fail on the first error or 429 instead of retrying")
+    bench_p.add_argument("--client-cache", action="store_true", help="Keep the client's response cache on (repeat reads become 304s)")
+    bench_p.add_argument("--seed", type=int, help="Random seed for the operation sequence")
+    bench_p.add_argument("--output", "-o", help="Write the JSON report here instead of printing it")
 
     args = parser.parse_args()
-    client = GmailClient()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    index_path = args.index
+    if args.command == "search" and args.local:
+        index_path = index_path or str(DEFAULT_INDEX)
+    client = GmailClient(index_path=index_path)
+
+    if args.command == "bench":
+        import json
+        from . import bench
 
-    if args.command == "authenticate":
+        try:
+            mix = bench.parse_mix(args.mix)
+            concurrency = [int(level) for level in args.concurrency.split(",")]
+        except ValueError as e:
+            parser.error(str(e))
+        client = GmailClient(
+            **({"backend_url": args.backend} if args.backend else {}),
+            rpm=args.rpm,
+            retry=RetryPolicy(max_attempts=1) if args.no_retry else None,
+            response_cache_size=256 if args.client_cache else 0,
+            transport=args.transport,
+        )
+        client.init()
+        logging.getLogger("pygmail").setLevel(logging.ERROR)
+        report = bench.run(
+            client, mix, concurrency, ["sync", "async"] if args.mode == "both" else [args.mode],
+            requests=None if args.duration else args.requests, duration=args.duration,
+            sink=args.sink, attachment_bytes=args.attachment_bytes, sample=args.sample, query=args.query, seed=args.seed,
+        )
+        client.close()
+        text = json.dumps(report, indent=2)
+        if args.output:
+            Path(args.output).write_text(text + "\n", encoding="utf-8")
+        else:
+            print(text)
+    elif args.command == "authenticate":
         client.authenticate_cli(open_browser=not args.no_browser)
     elif args.command == "send":
         client.init()
@@ -615,32 +1270,89 @@ def main():
         if args.html:
             p = Path(args.html)
             html_content = p.read_text(encoding="utf-8") if p.exists() else args.html
-        resp = client.send_email(
-            to=args.to,
-            cc=args.cc,
-            bcc=args.bcc,
-            subject=args.subject,
-            body=args.body,
-            html=html_content,
-            attachments=args.attach,
-            reply=args.reply,
-        )
-        print("Message sent:", resp)
+        if args.queue:
+            # the process is about to exit, so no flusher thread: `pygmail outbox flush` sends it
+            resp = client._queue_email(args.to, args.subject, args.body, html_content, args.cc, args.bcc, args.attach, args.reply, flush=False)
+        else:
+            resp = client.send_email(
+                to=args.to,
+                cc=args.cc,
+                bcc=args.bcc,
+                subject=args.subject,
+                body=args.body,
+                html=html_content,
+                attachments=args.attach,
+                reply=args.reply,
+                background=args.background,
+            )
+        if args.queue:
+            print(f"Message {resp['outbox_id']} added to the outbox; run `pygmail outbox flush` to send it")
+        elif args.background:
+            print("Message queued:", resp)
+        else:
+            print("Message sent:", resp)
+    elif args.command == "outbox" and args.action == "flush":
+        from .outbox import UNFINISHED
+
+        client.init()
+        counts = client.outbox_flusher.drain(timeout=args.timeout)
+        print(", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "Outbox is empty")
+        if any(counts.get(status) for status in UNFINISHED):
+            print("Some emails are still waiting (is the backend reachable?); run `pygmail outbox flush` again later")
+    elif args.command == "outbox":
+        for email in client.outbox.list(status=args.status, limit=args.max):
+            print(f"{email['outbox_id']}  {email['status']}  {', '.join(email['to'])}  {email['subject']}")
+            if email["error"]:
+                print(f"  Error: {email['error']}")
+            if email["message_id"]:
+                print(f"  Message ID: {email['message_id']}")
+        print(", ".join(f"{count} {status}" for status, count in sorted(client.outbox.counts().items())) or "Outbox is empty")
+    elif args.command == "status":
+        client.init()
+        print(client.get_send_status(args.job_id))
     elif args.command == "me":
         client.init()
         print(client.me())
     elif args.command == "init":
         client.init(args.token)
         print("Token loaded.")
+    elif args.command == "list" and args.accounts:
+        from .pool import GmailClientPool
+
+        with GmailClientPool.from_directory(args.accounts) as pool:
+            for account, result in pool.list_emails(max_results=args.max, query=args.query, fields="messages/id,result_size_estimate"):
+                if isinstance(result, Exception):
+                    print(f"{account}: failed ({result})")
+                    continue
+                print(f"{account}: found {result.get('result_size_estimate', 0)} emails")
+                for msg in result.get("messages", []):
+                    print(f"  - {msg['id']}")
     elif args.command == "list":
         client.init()
-        result = client.list_emails(max_results=args.max, query=args.query)
+        result = client.list_emails(max_results=args.max, query=args.query, fields="messages/id,result_size_estimate")
         print(f"Found {result.get('result_size_estimate', 0)} emails")
         for msg in result.get("messages", []):
             print(f"  - {msg['id']}")
+    elif args.command == "search":
+        if args.local:
+            try:
+                results = client.search_local(args.query, limit=args.max, newest_first=args.newest)
+            except ValueError as e:
+                parser.error(str(e))
+        else:
+            client.init()
+            found = client.list_emails(max_results=args.max, query=args.query).get("messages", [])
+            results = [client.get_parsed_email(msg["id"]) for msg in found]
+        for email in results:
+            headers = email["headers"]
+            print(f"{email['id']}  {headers.get('Date', '')}")
+            print(f"  From: {headers.get('From', 'N/A')}")
+            print(f"  Subject: {headers.get('Subject', 'N/A')}")
+            print(f"  {email.get('snippet') or ''}")
+        print(f"{len(results)} result(s)")
     elif args.command == "get":
         client.init()
-        email = client.get_parsed_email(args.message_id)
+        email = client.get_parsed_email(args.message_id, fields="headers,snippet,attachments(filename,size,attachment_id)")
         print(f"From: {email['headers'].get('From', 'N/A')}")
         print(f"To: {email['headers'].get('To', 'N/A')}")
         print(f"Subject: {email['headers'].get('Subject', 'N/A')}")
@@ -654,22 +1366,37 @@ def main():
         client.init()
         if args.attachment_id:
             # Download specific attachment
-            email = client.get_parsed_email(args.message_id)
+            message_id = args.message_id[0]
+            email = client.get_parsed_email(message_id)
             att = next((a for a in email.get('attachments', []) if a['attachment_id'] == args.attachment_id), None)
             if not att:
                 print(f"Attachment {args.attachment_id} not found")
             else:
-                filename = att.get('filename', 'unnamed_attachment')
+                filename = Path(att.get('filename') or 'unnamed_attachment').name
                 output_path = Path(args.output) / filename
-                client.get_attachment(args.message_id, args.attachment_id, output_path)
+                client.get_attachment(message_id, args.attachment_id, output_path)
                 print(f"Downloaded: {output_path}")
         else:
             # Download all attachments
-            paths = client.get_all_attachments(args.message_id, args.output)
-            if paths:
-                print(f"Downloaded {len(paths)} attachment(s) to {args.output}")
+            results = client.download_attachments(
+                args.message_id, args.output, concurrency=args.concurrency, flat=len(args.message_id) == 1
+            )
+            count = sum(len(paths) for paths in results.values())
+            if count:
+                print(f"Downloaded {count} attachment(s) to {args.output}")
             else:
                 print("No attachments found")
+    elif args.command == "mirror":
+        client.init()
+        result = client.mirror(args.directory, query=args.query, concurrency=args.concurrency)
+        print(f"Fetched {result['fetched']} new email(s), {result['skipped']} already mirrored, {len(result['failed'])} failed")
+    elif args.command == "export" and args.accounts:
+        from .pool import GmailClientPool
+
+        output_dir = args.output if args.output != "export.csv" else "."
+        with GmailClientPool.from_directory(args.accounts) as pool:
+            for account, result in pool.export_emails(args.target, output_dir):
+                print(f"{account}: {'failed (' + str(result) + ')' if isinstance(result, Exception) else result}")
     elif args.command == "export":
         client.init()
         client.export_emails(target=args.target, output_file=args.output)
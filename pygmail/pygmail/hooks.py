@@ -0,0 +1,75 @@
+import logging
+import math
+import threading
+from typing import Callable, Dict
+
+logger = logging.getLogger("pygmail")
+
+# A hook is any callable taking (event, data). Events:
+#   "request_start" -- method, path
+#   "request_end"   -- method, path, status, duration, bytes_sent, bytes_received, error
+#   "rate_limit"    -- seconds spent sleeping in the client-side rate limiter
+#   "retry"         -- method, path, attempt, delay, reason (status code or error) before a request is retried
+Hook = Callable[[str, Dict], None]
+
+
+def _percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+class StatsCollector:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.latencies = []
+            self.requests = 0
+            self.errors = 0
+            self.status_counts: Dict[int, int] = {}
+            self.bytes_sent = 0
+            self.bytes_received = 0
+            self.retries = 0
+            self.throttled_seconds = 0.0
+            self.throttle_events = 0
+
+    def __call__(self, event: str, data: Dict):
+        with self._lock:
+            if event == "request_end":
+                self.requests += 1
+                self.latencies.append(data["duration"])
+                status = data.get("status")
+                if status is not None:
+                    self.status_counts[status] = self.status_counts.get(status, 0) + 1
+                if data.get("error") or (status is not None and status >= 400):
+                    self.errors += 1
+                self.bytes_sent += data.get("bytes_sent") or 0
+                self.bytes_received += data.get("bytes_received") or 0
+            elif event == "rate_limit":
+                self.throttled_seconds += data["seconds"]
+                self.throttle_events += 1
+            elif event == "retry":
+                self.retries += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            latencies = list(self.latencies)
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "status_counts": dict(self.status_counts),
+                "latency_p50": _percentile(latencies, 50),
+                "latency_p95": _percentile(latencies, 95),
+                "latency_max": max(latencies) if latencies else 0.0,
+                "network_seconds": sum(latencies),
+                "throttled_seconds": self.throttled_seconds,
+                "throttle_events": self.throttle_events,
+                "retries": self.retries,
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+            }
@@ -0,0 +1,180 @@
+import shlex
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Union
+
+DEFAULT_INDEX = Path.home() / ".pygmail" / "index.db"
+
+# Gmail-style prefixes that map onto an indexed column
+FIELDS = {"from": "sender", "to": "recipients", "subject": "subject", "body": "body"}
+OPERATORS = ("AND", "OR", "NOT")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    thread_id TEXT,
+    date TEXT,
+    timestamp REAL,
+    sender TEXT,
+    recipients TEXT,
+    subject TEXT,
+    snippet TEXT,
+    body TEXT,
+    has_attachments INTEGER
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    subject, sender, recipients, snippet, body, content='messages', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, subject, sender, recipients, snippet, body)
+    VALUES (new.rowid, new.subject, new.sender, new.recipients, new.snippet, new.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, subject, sender, recipients, snippet, body)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.recipients, old.snippet, old.body);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, subject, sender, recipients, snippet, body)
+    VALUES ('delete', old.rowid, old.subject, old.sender, old.recipients, old.snippet, old.body);
+    INSERT INTO messages_fts(rowid, subject, sender, recipients, snippet, body)
+    VALUES (new.rowid, new.subject, new.sender, new.recipients, new.snippet, new.body);
+END;
+"""
+
+
+def _timestamp(date: str):
+    from email.utils import parsedate_to_datetime
+    try:
+        return parsedate_to_datetime(date).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def to_match(query: str) -> str:
+    """Turn a Gmail-like query (`from:alice invoice "q3 report"`) into an FTS5 expression.
+
+    Every term is quoted, so addresses and punctuation are searched for literally
+    instead of being read as FTS5 syntax. Raises ValueError for a query starting
+    with NOT, which FTS5 has no way to express."""
+    try:
+        words = shlex.split(query)
+    except ValueError:
+        words = query.split()
+    terms = []
+    for word in words:
+        if word.upper() in OPERATORS:
+            operator = word.upper()
+            if terms and terms[-1] in OPERATORS:
+                # doubled operators: "a OR OR b" is "a OR b", "a AND NOT b" is "a NOT b"
+                if operator == "NOT" or terms[-1] != "NOT":
+                    terms[-1] = operator
+            else:
+                terms.append(operator)
+            continue
+        field, sep, value = word.partition(":")
+        column = FIELDS.get(field.lower()) if sep else None
+        if column is None:
+            column, value = None, word
+        if not value:
+            continue
+        quoted = '"' + value.replace('"', '""') + '"'
+        terms.append(f"{column}:{quoted}" if column else quoted)
+    # operators are only valid between terms
+    if terms and terms[-1] in OPERATORS:
+        terms.pop()
+    if terms and terms[0] == "NOT" and len(terms) > 1:
+        raise ValueError("NOT needs a term before it, e.g. \"invoice NOT paid\"")
+    if terms and terms[0] in OPERATORS:
+        terms.pop(0)
+    return " ".join(terms)
+
+
+class LocalIndex:
+    """Full-text index (SQLite FTS5) of parsed messages, filled as the client fetches them."""
+
+    def __init__(self, path: Union[str, Path] = DEFAULT_INDEX):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # shared by the client's download and export threads, serialized by _lock
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        try:
+            self._db.executescript(SCHEMA)
+        except sqlite3.OperationalError as e:
+            self._db.close()
+            raise RuntimeError(f"Local search needs SQLite with FTS5: {e}") from e
+
+    def add(self, messages: Iterable[dict]):
+        rows = []
+        for data in messages:
+            headers = data.get("headers", {})
+            date = headers.get("Date")
+            rows.append((
+                data.get("id"),
+                data.get("thread_id"),
+                date,
+                _timestamp(date),
+                headers.get("From"),
+                ", ".join(h for h in (headers.get("To"), headers.get("Cc")) if h),
+                headers.get("Subject"),
+                data.get("snippet"),
+                data.get("body_plain") or data.get("body_html") or "",
+                1 if data.get("attachments") else 0,
+            ))
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                """
+                INSERT INTO messages (id, thread_id, date, timestamp, sender, recipients, subject, snippet, body, has_attachments)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    thread_id = excluded.thread_id, date = excluded.date, timestamp = excluded.timestamp,
+                    sender = excluded.sender, recipients = excluded.recipients, subject = excluded.subject,
+                    snippet = excluded.snippet, body = excluded.body, has_attachments = excluded.has_attachments
+                """,
+                rows,
+            )
+
+    def search(self, query: str, limit: int = 20, newest_first: bool = False) -> List[Dict]:
+        match = to_match(query)
+        if not match:
+            return []
+        order = "m.timestamp DESC" if newest_first else "bm25(messages_fts)"
+        with self._lock:
+            try:
+                cursor = self._db.execute(
+                    f"""
+                    SELECT m.id, m.thread_id, m.date, m.sender, m.recipients, m.subject, m.snippet, m.has_attachments
+                    FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid
+                    WHERE messages_fts MATCH ?
+                    ORDER BY {order}
+                    LIMIT ?
+                    """,
+                    (match, limit),
+                )
+                rows = cursor.fetchall()
+            except sqlite3.OperationalError as e:
+                raise ValueError(f"Can't search for {query!r}: {e}") from e
+        return [
+            {
+                "id": row[0],
+                "thread_id": row[1],
+                "headers": {"Date": row[2], "From": row[3], "To": row[4], "Subject": row[5]},
+                "snippet": row[6],
+                "has_attachments": bool(row[7]),
+            }
+            for row in rows
+        ]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
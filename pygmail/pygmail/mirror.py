@@ -0,0 +1,52 @@
+import os
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Set, Union
+
+MANIFEST = ".pygmail-mirror"
+
+# Gmail labels that have a Maildir flag
+FLAGS = (("DRAFT", "D"), ("STARRED", "F"))
+
+
+class Maildir:
+    """Writes messages into a Maildir (cur/, new/, tmp/), one file per Gmail message,
+    and remembers the mirrored IDs in a manifest so the next run only fetches new ones."""
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory).expanduser()
+        for sub in ("cur", "new", "tmp"):
+            (self.directory / sub).mkdir(parents=True, exist_ok=True)
+        self.manifest = self.directory / MANIFEST
+        self._lock = threading.Lock()
+
+    def known(self) -> Set[str]:
+        try:
+            with open(self.manifest, encoding="utf-8") as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def record(self, message_ids: Iterable[str]):
+        with self._lock, open(self.manifest, "a", encoding="utf-8") as f:
+            for message_id in message_ids:
+                f.write(message_id + "\n")
+
+    def write(self, message_id: str, raw: bytes, internal_date: Optional[str] = None, labels: Optional[List[str]] = None) -> Path:
+        labels = labels or []
+        flags = "".join(flag for label, flag in FLAGS if label in labels)
+        if "UNREAD" not in labels:
+            flags += "S"
+        flags = "".join(sorted(flags))
+        # The name only depends on the message, so a message fetched again after a
+        # crash replaces its own file instead of showing up twice.
+        seconds = int(internal_date or 0) // 1000
+        name = f"{seconds}.{message_id}.pygmail"
+        tmp = self.directory / "tmp" / name
+        # Gmail hands out CRLF line endings; Maildir files use the local convention.
+        tmp.write_bytes(raw.replace(b"\r\n", b"\n"))
+        if seconds:
+            os.utime(tmp, (seconds, seconds))
+        dest = self.directory / "cur" / f"{name}:2,{flags}"
+        os.replace(tmp, dest)
+        return dest
@@ -0,0 +1,146 @@
+"""
+Compact message models, for holding many messages in memory at once.
+
+They take a fraction of the memory of the equivalent nested dicts: no per-object
+__dict__, interned header names, and bodies kept as UTF-8 bytes, compressed
+when large, that are only decoded when read. For code written against the dicts,
+`email["headers"]` and `email.get("attachments")` still work, and `to_dict()`
+gives the original structure back.
+"""
+import sys
+import zlib
+from typing import Dict, List, Optional
+
+# bodies shorter than this aren't worth compressing
+COMPRESS_MIN = 512
+# first byte of a packed body
+PLAIN, COMPRESSED = b"p", b"z"
+
+
+class _Model:
+    __slots__ = ()
+
+    def __getitem__(self, name: str):
+        if name not in self.__slots__ and name not in getattr(type(self), "_properties", ()):
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name: str, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__[:2])
+        return f"{type(self).__name__}({fields})"
+
+
+class MessageRef(_Model):
+    __slots__ = ("id", "thread_id")
+
+    def __init__(self, id: str, thread_id: Optional[str] = None):
+        self.id = id
+        self.thread_id = thread_id
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MessageRef":
+        return cls(data["id"], data.get("threadId", data.get("thread_id")))
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "threadId": self.thread_id}
+
+
+class Attachment(_Model):
+    __slots__ = ("filename", "mime_type", "attachment_id", "size", "part_id")
+
+    def __init__(self, filename: Optional[str], mime_type: Optional[str], attachment_id: Optional[str], size: Optional[int], part_id: Optional[str] = None):
+        self.filename = filename
+        self.mime_type = sys.intern(mime_type) if mime_type else mime_type
+        self.attachment_id = attachment_id
+        self.size = size
+        # only set for messages parsed locally
+        self.part_id = part_id
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Attachment":
+        return cls(data.get("filename"), data.get("mime_type"), data.get("attachment_id"), data.get("size"), data.get("part_id"))
+
+    def to_dict(self) -> dict:
+        data = {"filename": self.filename, "mime_type": self.mime_type, "attachment_id": self.attachment_id, "size": self.size}
+        if self.part_id is not None:
+            data["part_id"] = self.part_id
+        return data
+
+
+def _pack(text: Optional[str], compress: bool) -> bytes:
+    if not text:
+        return b""
+    data = text.encode("utf-8")
+    if compress and len(data) >= COMPRESS_MIN:
+        return COMPRESSED + zlib.compress(data, 1)
+    return PLAIN + data
+
+
+def _unpack(data: bytes) -> str:
+    if not data:
+        return ""
+    if data[:1] == COMPRESSED:
+        return zlib.decompress(data[1:]).decode("utf-8")
+    return data[1:].decode("utf-8")
+
+
+class ParsedEmail(_Model):
+    __slots__ = ("id", "thread_id", "snippet", "headers", "attachments", "_body_plain", "_body_html")
+    _properties = ("body_plain", "body_html")
+
+    def __init__(
+        self,
+        id: Optional[str],
+        thread_id: Optional[str] = None,
+        snippet: Optional[str] = None,
+        headers: Optional[Dict[str, str]] = None,
+        body_plain: Optional[str] = None,
+        body_html: Optional[str] = None,
+        attachments: Optional[List[Attachment]] = None,
+        compress: bool = True,
+    ):
+        self.id = id
+        self.thread_id = thread_id
+        self.snippet = snippet
+        self.headers = {sys.intern(name): value for name, value in (headers or {}).items()}
+        self.attachments = attachments or []
+        self._body_plain = _pack(body_plain, compress)
+        self._body_html = _pack(body_html, compress)
+
+    @classmethod
+    def from_dict(cls, data: dict, compress: bool = True) -> "ParsedEmail":
+        return cls(
+            data.get("id"),
+            data.get("thread_id"),
+            data.get("snippet"),
+            data.get("headers"),
+            data.get("body_plain"),
+            data.get("body_html"),
+            [Attachment.from_dict(a) for a in data.get("attachments", [])],
+            compress=compress,
+        )
+
+    @property
+    def body_plain(self) -> str:
+        return _unpack(self._body_plain)
+
+    @property
+    def body_html(self) -> str:
+        return _unpack(self._body_html)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "thread_id": self.thread_id,
+            "snippet": self.snippet,
+            "headers": dict(self.headers),
+            "body_plain": self.body_plain,
+            "body_html": self.body_html,
+            "attachments": [a.to_dict() for a in self.attachments],
+        }
@@ -0,0 +1,62 @@
+import http.server
+import threading
+from urllib import parse
+
+LOCAL_PORT = 8080
+CALLBACK_PATHS = ("/", "/oauth2callback")
+
+
+class OAuthHandler(http.server.BaseHTTPRequestHandler):
+    server_data = {"code": None, "state": None}
+    server_event = threading.Event()
+
+    def do_GET(self):
+        parsed = parse.urlparse(self.path)
+        if parsed.path not in CALLBACK_PATHS:
+            self.send_response(404)
+            self.end_headers()
+            self.wfile.write(b"Not found")
+            return
+
+        qs = parse.parse_qs(parsed.query)
+        code = qs.get("code", [None])[0]
+        state = qs.get("state", [None])[0]
+        self.__class__.server_data["code"] = code
+        self.__class__.server_data["state"] = state
+        self.__class__.server_event.set()
+
+        self.send_response(200)
+        self.send_header("Content-type", "text/html; charset=utf-8")
+        self.end_headers()
+        self.wfile.write(b"<html><body><h2>Authentication complete, you can close this window.</h2></body></html>")
+
+    def log_message(self, format, *args):
+        return
+
+
+def run_local_server(timeout: int = 300):
+    handler = OAuthHandler
+    handler.server_data = {"code": None, "state": None}
+    handler.server_event = threading.Event()
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", LOCAL_PORT), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    waited = handler.server_event.wait(timeout=timeout)
+    if not waited:
+        try:
+            httpd.shutdown()
+            httpd.server_close()
+        except Exception:
+            pass
+        return None, None
+
+    code = handler.server_data.get("code")
+    state = handler.server_data.get("state")
+    try:
+        httpd.shutdown()
+        httpd.server_close()
+    except Exception:
+        pass
+    return code, state
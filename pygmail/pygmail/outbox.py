@@ -0,0 +1,408 @@
+"""
+A durable outbox for outgoing email.
+
+`send_email(..., queued=True)` writes the email and its attachments to a local
+SQLite database and returns at once; an OutboxFlusher thread then sends from
+there at the rate the backend allows, and records what happened to each email.
+While the backend is down or rate limiting, emails wait in the database, so
+they survive restarts too. Delivery is at least once: an email whose sender
+died mid-request is sent again.
+
+Each email records the account it was queued from, and a flusher only sends its
+own account's emails, so clients signed in as different users can share a file.
+"""
+import base64
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from .hooks import logger
+
+QUEUED = "queued"
+# claimed by a flusher, until `due`
+SENDING = "sending"
+# handed to the backend's send queue, waiting for its result
+SUBMITTED = "submitted"
+SENT = "sent"
+FAILED = "failed"
+UNFINISHED = (QUEUED, SENDING, SUBMITTED)
+
+# the backend's limit, MAX_EMAILS per WINDOW_SECONDS
+SENDS_PER_MINUTE = 10
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    due REAL NOT NULL,
+    job_id TEXT,
+    message_id TEXT,
+    thread_id TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_status ON outbox (account, status, due);
+CREATE TABLE IF NOT EXISTS outbox_attachments (
+    outbox_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (outbox_id, position)
+);
+"""
+
+
+def account_of(session_token: str) -> str:
+    """Whom a session token belongs to: the user id (`sub`) in it, read without verifying
+    it, so it stays the same when the token is renewed. A hash for tokens that aren't JWTs."""
+    try:
+        payload = session_token.split(".")[1]
+        return str(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["sub"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return hashlib.sha256(session_token.encode()).hexdigest()
+
+
+class Outbox:
+    """The queue itself. Several processes can share one database file: the
+    conditional UPDATE in claim() makes sure each email is taken by one of them."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def enqueue(self, account: str, message: dict, attachments: Optional[List[Tuple[str, bytes]]] = None) -> int:
+        """Store `account`'s email (send_email keyword arguments) and its (filename, content)
+        attachments; returns its outbox id."""
+        now = time.time()
+        with self._lock, self._db:
+            outbox_id = self._db.execute(
+                "INSERT INTO outbox (account, message, status, due, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (account, json.dumps(message), QUEUED, now, now, now),
+            ).lastrowid
+            self._db.executemany(
+                "INSERT INTO outbox_attachments (outbox_id, position, filename, data) VALUES (?, ?, ?, ?)",
+                [(outbox_id, i, filename, data) for i, (filename, data) in enumerate(attachments or [])],
+            )
+        return outbox_id
+
+    def claim(self, account: str, limit: int, lease_seconds: float) -> List[Tuple[int, dict, List[Tuple[str, bytes]], int]]:
+        """Take up to `limit` of `account`'s due emails, oldest first, for `lease_seconds`: (outbox id,
+        message, attachments, attempts so far). Emails whose lease ran out (their flusher died) are taken again."""
+        now = time.time()
+        claimed = []
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT id, status FROM outbox WHERE account = ? AND status IN (?, ?) AND due <= ? ORDER BY id LIMIT ?",
+                (account, QUEUED, SENDING, now, limit),
+            ).fetchall()
+            for outbox_id, status in rows:
+                taken = self._db.execute(
+                    "UPDATE outbox SET status = ?, due = ?, updated = ? WHERE id = ? AND status = ? AND due <= ?",
+                    (SENDING, now + lease_seconds, now, outbox_id, status, now),
+                ).rowcount
+                if taken == 1:
+                    claimed.append(outbox_id)
+            emails = []
+            for outbox_id in claimed:
+                message, attempts = self._db.execute("SELECT message, attempts FROM outbox WHERE id = ?", (outbox_id,)).fetchone()
+                attachments = self._db.execute(
+                    "SELECT filename, data FROM outbox_attachments WHERE outbox_id = ? ORDER BY position", (outbox_id,)
+                ).fetchall()
+                emails.append((outbox_id, json.loads(message), [(filename, bytes(data)) for filename, data in attachments], attempts))
+        return emails
+
+    def _update(self, outbox_id: int, **columns):
+        columns["updated"] = time.time()
+        names = ", ".join(f"{name} = ?" for name in columns)
+        with self._lock, self._db:
+            self._db.execute(f"UPDATE outbox SET {names} WHERE id = ?", (*columns.values(), outbox_id))
+            if columns.get("status") == SENT:
+                self._db.execute("DELETE FROM outbox_attachments WHERE outbox_id = ?", (outbox_id,))
+
+    def submitted(self, outbox_id: int, job_id: str):
+        self._update(outbox_id, status=SUBMITTED, job_id=job_id, error=None)
+
+    def sent(self, outbox_id: int, message_id: Optional[str], thread_id: Optional[str]):
+        self._update(outbox_id, status=SENT, message_id=message_id, thread_id=thread_id, error=None)
+
+    def failed(self, outbox_id: int, error: str):
+        self._update(outbox_id, status=FAILED, error=error)
+
+    def retry(self, outbox_id: int, delay: float, error: str):
+        """Put a claimed email back after a failed attempt, due again in `delay` seconds."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, due = ?, error = ?, updated = ? WHERE id = ?",
+                (QUEUED, time.time() + delay, error, time.time(), outbox_id),
+            )
+
+    def release(self, outbox_ids: List[int], delay: float = 0.0):
+        """Put claimed emails back untried."""
+        due = time.time() + delay
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE outbox SET status = ?, due = ?, updated = ? WHERE id = ? AND status = ?",
+                [(QUEUED, due, time.time(), outbox_id, SENDING) for outbox_id in outbox_ids],
+            )
+
+    def requeue(self, outbox_id: int):
+        """Send an email again, e.g. a failed one or one the backend lost track of."""
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET status = ?, due = ?, job_id = NULL, updated = ? WHERE id = ? AND status IN (?, ?)",
+                (QUEUED, now, now, outbox_id, FAILED, SUBMITTED),
+            )
+
+    def awaiting_result(self, account: str, limit: int, checked_before: float) -> List[Tuple[int, str]]:
+        """(outbox id, backend job id) of `account`'s submitted emails not looked at since `checked_before`."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, job_id FROM outbox WHERE account = ? AND status = ? AND updated < ? ORDER BY updated LIMIT ?",
+                (account, SUBMITTED, checked_before, limit),
+            ).fetchall()
+
+    def touch(self, outbox_id: int):
+        self._update(outbox_id)
+
+    def next_due(self, account: str) -> Optional[float]:
+        """When `account`'s next queued email is due, or None if there is none."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT MIN(due) FROM outbox WHERE account = ? AND status IN (?, ?)", (account, QUEUED, SENDING)
+            ).fetchone()[0]
+
+    @staticmethod
+    def _where(account: Optional[str], status: Optional[str] = None) -> Tuple[str, tuple]:
+        conditions = {"account": account, "status": status}
+        conditions = {name: value for name, value in conditions.items() if value is not None}
+        if not conditions:
+            return "", ()
+        return "WHERE " + " AND ".join(f"{name} = ?" for name in conditions), tuple(conditions.values())
+
+    def counts(self, account: Optional[str] = None) -> Dict[str, int]:
+        """The number of emails in each status, `account`'s or everyone's."""
+        where, args = self._where(account)
+        with self._lock:
+            return dict(self._db.execute(f"SELECT status, COUNT(*) FROM outbox {where} GROUP BY status", args).fetchall())
+
+    def list(self, status: Optional[str] = None, limit: int = 50, account: Optional[str] = None) -> List[dict]:
+        """The newest emails, `account`'s or everyone's, without their bodies and attachments."""
+        where, args = self._where(account, status)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, account, message, status, attempts, due, job_id, message_id, thread_id, error, created, updated "
+                f"FROM outbox {where} ORDER BY id DESC LIMIT ?",
+                (*args, limit),
+            ).fetchall()
+        emails = []
+        for outbox_id, account, message, status, attempts, due, job_id, message_id, thread_id, error, created, updated in rows:
+            message = json.loads(message)
+            emails.append({
+                "outbox_id": outbox_id,
+                "account": account,
+                "status": status,
+                "to": message.get("to", []),
+                "subject": message.get("subject"),
+                "attempts": attempts,
+                "due": due if status == QUEUED else None,
+                "job_id": job_id,
+                "message_id": message_id,
+                "thread_id": thread_id,
+                "error": error,
+                "created": created,
+                "updated": updated,
+            })
+        return emails
+
+    def prune(self, older_than: float):
+        """Forget sent emails last updated more than `older_than` seconds ago."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM outbox WHERE status = ? AND updated < ?", (SENT, time.time() - older_than))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def _transient_delay(error: Exception, attempts: int, max_backoff: float) -> Optional[float]:
+    """Seconds to wait before trying again, or None if trying again won't help."""
+    import requests
+    from .retry import CircuitOpenError, parse_retry_after
+
+    backoff = min(max_backoff, 5.0 * 2 ** attempts)
+    if isinstance(error, CircuitOpenError):
+        return max(error.retry_after, 1.0)
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        if status == 429:
+            retry_after = parse_retry_after(error.response.headers.get("Retry-After"))
+            return retry_after if retry_after is not None else backoff
+        # 401: the session ran out; the email can go once the user signs in again
+        if status >= 500 or status in (401, 408):
+            return backoff
+        return None
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return backoff
+    return None
+
+
+class OutboxFlusher:
+    """Sends an Outbox's emails through a client from a background thread.
+
+    Each pass claims a batch of due emails and submits them to the backend's send
+    queue, spaced to stay under `per_minute`, then checks on submitted emails for
+    their results. When the backend is unavailable or rate limiting, the rest of
+    the batch goes back to the outbox until it is expected to recover."""
+
+    def __init__(self, client, outbox: Outbox, per_minute: float = SENDS_PER_MINUTE, batch_size: int = 10,
+                 poll_interval: float = 5.0, lease_seconds: float = 300.0, max_backoff: float = 600.0,
+                 keep_sent: float = 7 * 24 * 3600):
+        self.client = client
+        self.outbox = outbox
+        self.interval = 60.0 / per_minute
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        # long enough to submit a whole batch at the allowed rate
+        self.lease_seconds = lease_seconds + batch_size * self.interval
+        self.max_backoff = max_backoff
+        self.keep_sent = keep_sent
+        self._next_submit = 0.0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="pygmail-outbox", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        """Look at the outbox now instead of at the next poll."""
+        self._wake.set()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                busy = self.flush()
+            except Exception:
+                logger.exception("Outbox flush failed")
+                busy = 0
+            if not busy:
+                self._wake.wait(self._idle_wait())
+                self._wake.clear()
+
+    @property
+    def account(self) -> str:
+        # read each time: the client may sign in again as someone else
+        return account_of(self.client.session_token)
+
+    def _idle_wait(self) -> float:
+        next_due = self.outbox.next_due(self.account)
+        if next_due is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, next_due - time.time()))
+
+    def drain(self, timeout: Optional[float] = None) -> Dict[str, int]:
+        """Flush from the calling thread until none of the account's emails is left waiting,
+        or for at most `timeout` seconds; returns the number of its emails in each status."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            busy = self.flush()
+            counts = self.outbox.counts(self.account)
+            if not any(counts.get(status) for status in UNFINISHED):
+                return counts
+            if deadline is not None and time.monotonic() >= deadline:
+                return counts
+            if not busy:
+                wait = self._idle_wait()
+                if deadline is not None:
+                    wait = min(wait, deadline - time.monotonic())
+                if self._stop.wait(max(0.0, wait)):
+                    return counts
+
+    def flush(self) -> int:
+        """One pass over the outbox; returns how many emails were submitted or finished."""
+        done = self._submit()
+        done += self._check_results()
+        self.outbox.prune(self.keep_sent)
+        return done
+
+    def _submit(self) -> int:
+        batch = self.outbox.claim(self.account, self.batch_size, self.lease_seconds)
+        submitted = 0
+        for position, (outbox_id, message, attachments, attempts) in enumerate(batch):
+            if self._stop.wait(max(0.0, self._next_submit - time.monotonic())):
+                self.outbox.release([e[0] for e in batch[position:]])
+                break
+            self._next_submit = time.monotonic() + self.interval
+            try:
+                resp = self.client.send_email(**message, attachments=attachments, background=True)
+            except Exception as e:
+                delay = _transient_delay(e, attempts, self.max_backoff)
+                if delay is None:
+                    logger.warning("Outbox email %s failed: %s", outbox_id, e)
+                    self.outbox.failed(outbox_id, str(e))
+                    continue
+                logger.info("Outbox email %s not sent (%s), trying again in %.0fs", outbox_id, e, delay)
+                self.outbox.retry(outbox_id, delay, str(e))
+                # the backend would turn the rest of the batch away too
+                self.outbox.release([e[0] for e in batch[position + 1:]], delay)
+                break
+            submitted += 1
+            if "job_id" in resp:
+                self.outbox.submitted(outbox_id, resp["job_id"])
+            else:
+                self.outbox.sent(outbox_id, resp.get("message_id"), resp.get("thread_id"))
+        return submitted
+
+    def _check_results(self) -> int:
+        import requests
+
+        finished = 0
+        for outbox_id, job_id in self.outbox.awaiting_result(self.account, self.batch_size, time.time() - self.poll_interval):
+            try:
+                job = self.client.get_send_status(job_id)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code == 404:
+                    # the backend lost the job, e.g. its database was reset
+                    logger.warning("Backend has no record of outbox email %s, sending it again", outbox_id)
+                    self.outbox.requeue(outbox_id)
+                    continue
+                logger.info("Could not check outbox email %s: %s", outbox_id, e)
+                break
+            except Exception as e:
+                logger.info("Could not check outbox email %s: %s", outbox_id, e)
+                break
+            if job["status"] == SENT:
+                self.outbox.sent(outbox_id, job.get("message_id"), job.get("thread_id"))
+                finished += 1
+            elif job["status"] == FAILED:
+                self.outbox.failed(outbox_id, job.get("error") or "Failed on the backend")
+                finished += 1
+            else:
+                self.outbox.touch(outbox_id)
+        return finished
@@ -0,0 +1,210 @@
+import queue
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
+
+from .client import GmailClient
+from .hooks import Hook, logger
+
+# marks the end of one account's stream in messages()
+_DONE = object()
+
+
+class GmailClientPool:
+    """One GmailClient per account, run side by side.
+
+    `sessions` maps account names to session tokens or session files; a list of
+    session files is named after the files. The clients share one HTTP connection
+    pool but each keeps its own rate limiter, retries and circuit breaker, so a
+    slow or failing account only holds up itself. Other keyword arguments go to
+    every GmailClient; hooks get an extra `account` in their data.
+
+    Session files are read, never rewritten; tokens stay in memory. Each account
+    gets its own outbox, next to its session file or at ~/.pygmail/<account>.outbox.db."""
+
+    def __init__(
+        self,
+        sessions: Union[Mapping[str, Union[str, Path]], Iterable[Union[str, Path]]],
+        backend_url: str = "http://37.27.51.34:31873",
+        concurrency: Optional[int] = None,
+        hooks: Optional[List[Hook]] = None,
+        **client_kwargs,
+    ):
+        import requests
+        from concurrent.futures import ThreadPoolExecutor
+        from requests.adapters import HTTPAdapter
+
+        if not isinstance(sessions, Mapping):
+            sessions = {Path(path).stem: path for path in sessions}
+        if not sessions:
+            raise ValueError("No accounts given")
+        shared = {"session_file", "outbox_path"} & set(client_kwargs)
+        if shared:
+            raise TypeError(f"{', '.join(sorted(shared))} can't be shared by accounts; the pool sets one per account")
+        self.concurrency = concurrency or min(32, len(sessions))
+        self.http = requests.Session()
+        # enough kept-alive connections for every worker thread
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency * 2)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+        self.clients: Dict[str, GmailClient] = {}
+        for account, session in sessions.items():
+            # never the default session file or outbox, which belong to the single-account client
+            session_file = Path(session)
+            is_file = session_file.exists()
+            if not is_file:
+                session_file = Path.home() / ".pygmail" / f"{account}.token"
+            client = GmailClient(
+                backend_url,
+                session_file=session_file,
+                hooks=[self._tagged(hook, account) for hook in hooks or []],
+                http=self.http,
+                **client_kwargs,
+            )
+            if is_file:
+                client.init()
+            else:
+                client.session_token = str(session).strip()
+            self.clients[account] = client
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="pygmail-pool")
+
+    @classmethod
+    def from_directory(cls, directory: Union[str, Path], pattern: str = "*.token", **kwargs) -> "GmailClientPool":
+        """A pool of every session file in `directory`, named after the files."""
+        return cls(sorted(Path(directory).expanduser().glob(pattern)), **kwargs)
+
+    @staticmethod
+    def _tagged(hook: Hook, account: str) -> Hook:
+        return lambda event, data: hook(event, {**data, "account": account})
+
+    @property
+    def accounts(self) -> List[str]:
+        return list(self.clients)
+
+    def __getitem__(self, account: str) -> GmailClient:
+        return self.clients[account]
+
+    def __len__(self) -> int:
+        return len(self.clients)
+
+    def close(self):
+        self._executor.shutdown()
+        for client in self.clients.values():
+            client.close()
+        self.http.close()
+
+    def __enter__(self) -> "GmailClientPool":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _accounts(self, accounts: Optional[Iterable[str]]) -> List[str]:
+        accounts = list(self.clients if accounts is None else accounts)
+        unknown = [a for a in accounts if a not in self.clients]
+        if unknown:
+            raise KeyError(f"Unknown accounts: {', '.join(unknown)}")
+        return accounts
+
+    def map(self, fn: Callable[[GmailClient], Any], accounts: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, Any]]:
+        """Run `fn(client)` for every account at once; yield (account, result) as each finishes.
+
+        A failed account yields its exception as the result, so the others still finish."""
+        return self._run(lambda account, client: fn(client), accounts)
+
+    def _run(self, fn: Callable[[str, GmailClient], Any], accounts: Optional[Iterable[str]]) -> Iterator[Tuple[str, Any]]:
+        # submitted right away, so the work runs even if the results are never read
+        futures = {self._executor.submit(fn, a, self.clients[a]): a for a in self._accounts(accounts)}
+        return self._completed(futures)
+
+    @staticmethod
+    def _completed(futures: dict) -> Iterator[Tuple[str, Any]]:
+        from concurrent.futures import as_completed
+
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                yield account, future.result()
+            except Exception as e:
+                logger.warning("Account %s failed: %s", account, e)
+                yield account, e
+
+    def list_emails(self, max_results: int = 10, query: Optional[str] = None, fields: Optional[str] = None, accounts: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, Any]]:
+        return self.map(lambda client: client.list_emails(max_results=max_results, query=query, fields=fields), accounts)
+
+    def messages(self, query: Optional[str] = None, limit: Optional[int] = None, accounts: Optional[Iterable[str]] = None) -> Iterator[dict]:
+        """Every message matching `query` in every account, page by page as they arrive,
+        each with an `account` key. `limit` caps the messages per account."""
+        results: "queue.Queue" = queue.Queue()
+        stop = threading.Event()
+
+        def pages(client, account):
+            count, page_token = 0, None
+            try:
+                while not stop.is_set() and (limit is None or count < limit):
+                    page_size = 100 if limit is None else min(100, limit - count)
+                    res = client.list_emails(max_results=page_size, query=query, page_token=page_token)
+                    for msg in res.get("messages", [])[:page_size]:
+                        results.put({**msg, "account": account})
+                        count += 1
+                    page_token = res.get("next_page_token")
+                    if not page_token:
+                        break
+            except Exception as e:
+                logger.warning("Account %s failed: %s", account, e)
+            finally:
+                results.put(_DONE)
+
+        accounts = self._accounts(accounts)
+        for account in accounts:
+            self._executor.submit(pages, self.clients[account], account)
+        try:
+            yield from self._drain(results, len(accounts))
+        finally:
+            # the caller stopped early
+            stop.set()
+
+    def export_emails(self, target: str, output_dir: Union[str, Path] = ".", format: str = "csv", accounts: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, Any]]:
+        """Export `target` from every account to `output_dir/<account>.csv`; yield (account, path or exception)."""
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        def export(account, client):
+            path = output_dir / f"{account}.{format}"
+            client.export_emails(target, output_file=str(path), format=format)
+            return path
+
+        return self._run(export, accounts)
+
+    def send_emails(self, emails: Iterable[Tuple[str, dict]]) -> Iterator[Tuple[str, Any]]:
+        """Send (account, send_email keyword arguments) pairs, in parallel across accounts
+        and in order within one; yield (account, response or exception) as each is sent."""
+        by_account: Dict[str, List[dict]] = {}
+        for account, kwargs in emails:
+            by_account.setdefault(account, []).append(kwargs)
+        self._accounts(by_account)
+        results: "queue.Queue" = queue.Queue()
+
+        def send(client, account):
+            try:
+                for kwargs in by_account[account]:
+                    try:
+                        results.put((account, client.send_email(**kwargs)))
+                    except Exception as e:
+                        logger.warning("Account %s failed to send: %s", account, e)
+                        results.put((account, e))
+            finally:
+                results.put(_DONE)
+
+        for account in by_account:
+            self._executor.submit(send, self.clients[account], account)
+        return self._drain(results, len(by_account))
+
+    @staticmethod
+    def _drain(results: "queue.Queue", running: int) -> Iterator:
+        while running:
+            item = results.get()
+            if item is _DONE:
+                running -= 1
+            else:
+                yield item
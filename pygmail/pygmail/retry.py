@@ -0,0 +1,106 @@
+import random
+import threading
+import time
+from typing import Optional
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"Backend unavailable, not sending requests for another {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        max_retry_after: float = 120.0,
+        retry_statuses=(429, 500, 502, 503, 504),
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = tuple(retry_statuses)
+
+    def should_retry(self, method: str, status: Optional[int] = None, connect_failed: bool = False) -> bool:
+        # A request that never connected, or that the backend turned away with 429,
+        # was not acted on, so even a send can go again. Anything else is only
+        # repeated for idempotent methods, otherwise a send could go out twice.
+        if connect_failed or status == 429:
+            return True
+        if status is not None and status not in self.retry_statuses:
+            return False
+        return method.upper() in IDEMPOTENT_METHODS
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        if retry_after is not None:
+            return retry_after
+        # full jitter: clients that failed together spread out instead of retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """After `failure_threshold` consecutive failures (connection errors or 5xx) requests
+    fail fast with CircuitOpenError for `reset_timeout` seconds; then one request is let
+    through, and its outcome closes or re-opens the circuit."""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    def remaining(self) -> float:
+        with self._lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(self.opened_at + self.reset_timeout - time.time(), 0.0)
+
+    def check(self) -> bool:
+        """Raise CircuitOpenError if requests may not go out; True if this one is the probe."""
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            remaining = self.opened_at + self.reset_timeout - time.time()
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError(max(remaining, 0.0))
+            self._probing = True
+            return True
+
+    def release(self):
+        """End a probe that got no answer either way, e.g. because it was cancelled,
+        so the next request can probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def record(self, ok: bool):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.time()
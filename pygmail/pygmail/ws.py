@@ -0,0 +1,183 @@
+"""
+The backend's /ws channel as a transport: reads go out as tagged frames over one
+authenticated WebSocket, and answers come back in whatever order they finish.
+
+The connection lives on its own event loop thread, so threads (sync calls) and
+event loops (async calls) all share it. Needs aiohttp, like the async functions.
+"""
+import asyncio
+import itertools
+import json
+import threading
+from typing import Dict, Optional, Tuple
+
+# route -> (op, names of the path segments after it)
+OPS = {
+    "list_emails": ("list", ()),
+    "get_email": ("get", ("message_id",)),
+    "get_parsed_email": ("parsed", ("message_id",)),
+    "get_thread": ("thread", ("thread_id",)),
+    "get_attachment": ("attachment", ("message_id", "attachment_id")),
+}
+
+
+def to_call(method: str, path: str, params: Optional[dict] = None, headers: Optional[dict] = None) -> Optional[Tuple[str, dict]]:
+    """The (op, params) for an HTTP request, or None if it has to go over HTTP."""
+    route, *segments = path.strip("/").split("/")
+    if method != "GET" or route not in OPS:
+        return None
+    op, names = OPS[route]
+    if len(segments) != len(names):
+        return None
+    call_params = {name: value for name, value in (params or {}).items() if value is not None}
+    call_params.update(zip(names, segments))
+    if_none_match = (headers or {}).get("If-None-Match")
+    if if_none_match:
+        call_params["if_none_match"] = if_none_match
+    return op, call_params
+
+
+class WebSocketTransport:
+    def __init__(self, backend_url: str, session_token: str):
+        scheme, rest = backend_url.split("://", 1)
+        self.url = ("wss" if scheme == "https" else "ws") + "://" + rest.rstrip("/") + "/ws"
+        self.session_token = session_token
+        self._ids = itertools.count(1)
+        self._start_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        # only touched on the transport's loop
+        self._session = None
+        self._ws = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._connect_lock: Optional[asyncio.Lock] = None
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="pygmail-ws", daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def call(self, op: str, params: dict) -> Tuple[int, dict, bytes, int]:
+        """Send one request and wait for its answer: (status, headers, body, bytes sent).
+
+        Raises ConnectionError if the connection fails or drops before the answer."""
+        return asyncio.run_coroutine_threadsafe(self._call(op, params), self._start()).result()
+
+    async def call_async(self, op: str, params: dict) -> Tuple[int, dict, bytes, int]:
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._call(op, params), self._start()))
+
+    async def _connection(self):
+        import aiohttp
+
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._ws is None or self._ws.closed:
+                if self._session is None:
+                    self._session = aiohttp.ClientSession()
+                try:
+                    # no size limit: attachments come back whole
+                    self._ws = await self._session.ws_connect(
+                        self.url, headers={"Authorization": f"Bearer {self.session_token}"}, max_msg_size=0, heartbeat=30,
+                    )
+                except aiohttp.WSServerHandshakeError as e:
+                    raise ConnectionError(f"WebSocket refused by the backend ({e.status})") from e
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    raise ConnectionError(f"WebSocket connection failed: {e!r}") from e
+                # each connection has its own pending requests, failed together when it drops
+                self._pending = {}
+                asyncio.ensure_future(self._read(self._ws, self._pending))
+            return self._ws, self._pending
+
+    async def _read(self, ws, pending: Dict[int, asyncio.Future]):
+        import aiohttp
+
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.BINARY:
+                    continue
+                head, _, body = msg.data.partition(b"\n")
+                head = json.loads(head)
+                future = pending.pop(head.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result((head["status"], head.get("headers", {}), body))
+        finally:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("WebSocket connection closed"))
+            pending.clear()
+
+    async def _call(self, op: str, params: dict) -> Tuple[int, dict, bytes, int]:
+        import aiohttp
+
+        ws, pending = await self._connection()
+        tag = next(self._ids)
+        frame = json.dumps({"id": tag, "op": op, "params": params})
+        future = asyncio.get_running_loop().create_future()
+        pending[tag] = future
+        try:
+            await ws.send_str(frame)
+            status, headers, body = await future
+        except (aiohttp.ClientError, ConnectionResetError) as e:
+            raise ConnectionError(f"WebSocket send failed: {e!r}") from e
+        finally:
+            pending.pop(tag, None)
+        return status, headers, body, len(frame)
+
+    async def _close(self):
+        if self._ws is not None:
+            await self._ws.close()
+        if self._session is not None:
+            await self._session.close()
+        self._ws = self._session = None
+
+    def close(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = self._thread = None
+
+
+def sync_response(url: str, status: int, headers: dict, body: bytes) -> "requests.Response":
+    """A requests.Response for a WebSocket answer, so sync callers can't tell the difference."""
+    import requests
+    from http import HTTPStatus
+    from requests.structures import CaseInsensitiveDict
+
+    resp = requests.Response()
+    resp.status_code = status
+    try:
+        resp.reason = HTTPStatus(status).phrase
+    except ValueError:
+        pass
+    resp.headers = CaseInsensitiveDict(headers)
+    resp._content = body
+    resp.url = url
+    resp.encoding = "utf-8"
+    return resp
+
+
+class AsyncResponse:
+    """The parts of an aiohttp response the async client code reads."""
+
+    def __init__(self, url: str, status: int, headers: dict):
+        from multidict import CIMultiDict
+
+        self.url = url
+        self.status = status
+        self.headers = CIMultiDict(headers)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            import aiohttp
+            from multidict import CIMultiDict, CIMultiDictProxy
+            from yarl import URL
+
+            info = aiohttp.RequestInfo(URL(self.url), "GET", CIMultiDictProxy(CIMultiDict()), URL(self.url))
+            raise aiohttp.ClientResponseError(info, (), status=self.status, message=f"WebSocket answer {self.status}", headers=self.headers)
@@ -0,0 +1,32 @@
+import threading
+
+from pygmail.attachments import ContentStore
+
+
+def put_concurrently(root, data):
+    store = ContentStore(root)
+    barrier = threading.Barrier(8)
+    blobs, errors = [], []
+
+    def put():
+        barrier.wait()
+        try:
+            blobs.append(store.put(data))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return blobs, errors
+
+
+def test_concurrent_puts_of_the_same_content(tmp_path):
+    data = b"x" * 1_000_000
+    for round in range(10):
+        blobs, errors = put_concurrently(tmp_path / str(round), data)
+        assert errors == []
+        assert len(set(blobs)) == 1 and blobs[0].read_bytes() == data
+    assert not list(tmp_path.rglob("*.tmp"))
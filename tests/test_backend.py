@@ -0,0 +1,16 @@
+from harness import fake_backend
+
+import metrics
+
+
+def jwt_observations():
+    state = metrics.STAGE_LATENCY._values.get(("jwt",))
+    return state[2] if state else 0
+
+
+def test_session_token_is_verified_once_per_request():
+    with fake_backend(messages=3) as client:
+        before = jwt_observations()
+        for _ in range(4):
+            client.list_emails(max_results=1)
+        assert jwt_observations() - before == 4
@@ -0,0 +1,60 @@
+import asyncio
+
+import events
+
+
+def added(history_id, message_id):
+    return {"type": "message_added", "history_id": str(history_id), "id": message_id}
+
+
+def drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_messages_added_in_one_history_record_all_arrive():
+    subscriber = events._Subscriber(16)
+    subscriber.push(added(105, "a"))
+    subscriber.push(added(105, "b"))
+    assert [e["id"] for e in drain(subscriber.queue)] == ["a", "b"]
+
+
+def test_repeated_and_older_changes_are_dropped():
+    subscriber = events._Subscriber(16)
+    for event in (added(105, "a"), added(105, "b"), added(105, "a"), added(104, "c"), added(106, "d"), added(105, "b")):
+        subscriber.push(event)
+    assert [e["id"] for e in drain(subscriber.queue)] == ["a", "b", "d"]
+
+
+def test_full_queue_becomes_resync():
+    subscriber = events._Subscriber(2)
+    for i in range(3):
+        subscriber.push(added(100 + i, str(i)))
+    assert drain(subscriber.queue) == [{"type": "resync"}]
+
+
+def test_one_poller_per_user_and_catch_up_without_duplicates():
+    polls = []
+
+    async def poll(user_id, cursor):
+        polls.append((user_id, cursor))
+        if cursor == "100":
+            # the catch-up poll for a reconnecting client
+            return "105", [added(105, "a"), added(105, "b")]
+        await asyncio.sleep(0)
+        return "105", [added(105, "a"), added(105, "b")]
+
+    async def run():
+        hub = events.EventHub(poll, interval=0.01)
+        async with hub.subscribe("alice", since="100") as first, hub.subscribe("alice") as second:
+            await asyncio.sleep(0.05)
+            assert len(hub._pollers) == 1
+            got_first, got_second = drain(first), drain(second)
+        assert hub._pollers == {} and hub._subscribers == {}
+        return got_first, got_second
+
+    first, second = asyncio.run(run())
+    assert [e["id"] for e in first] == ["a", "b"]
+    assert [e["id"] for e in second] == ["a", "b"]
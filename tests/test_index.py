@@ -0,0 +1,53 @@
+import pytest
+
+from pygmail.index import LocalIndex, to_match
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = LocalIndex(tmp_path / "index.db")
+    index.add([
+        {"id": "1", "headers": {"From": "alice@example.com", "Subject": "invoice"}, "body_plain": "q3 invoice, paid"},
+        {"id": "2", "headers": {"From": "bob@example.com", "Subject": "invoice"}, "body_plain": "q3 invoice, overdue"},
+        {"id": "3", "headers": {"From": "carol@example.com", "Subject": "lunch"}, "body_plain": "tacos"},
+    ])
+    yield index
+    index.close()
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("a OR", '"a"'),
+    ("a OR OR b", '"a" OR "b"'),
+    ("OR a", '"a"'),
+    ("a AND NOT b", '"a" NOT "b"'),
+    ("a NOT AND b", '"a" NOT "b"'),
+    ("NOT", ""),
+    ("from:alice q3", 'sender:"alice" "q3"'),
+])
+def test_to_match_operators(query, expected):
+    assert to_match(query) == expected
+
+
+def test_leading_not_is_rejected():
+    with pytest.raises(ValueError, match="NOT"):
+        to_match("NOT paid")
+
+
+@pytest.mark.parametrize("query, ids", [
+    ("invoice OR OR tacos", {"1", "2", "3"}),
+    ("invoice OR", {"1", "2"}),
+    ("invoice AND NOT paid", {"2"}),
+    ("from:carol", {"3"}),
+])
+def test_search_with_sloppy_operators(index, query, ids):
+    assert {row["id"] for row in index.search(query)} == ids
+
+
+def test_search_reports_bad_queries_as_value_error(index, monkeypatch):
+    with pytest.raises(ValueError, match="NOT"):
+        index.search("NOT paid")
+    # anything FTS5 still rejects comes out as ValueError, not sqlite3.OperationalError
+    monkeypatch.setattr("pygmail.index.to_match", lambda query: query)
+    with pytest.raises(ValueError, match="Can't search"):
+        index.search("invoice AND")
+    assert {row["id"] for row in index.search("lunch")} == {"3"}
@@ -0,0 +1,24 @@
+import pytest
+from harness import fake_backend
+
+
+@pytest.fixture(scope="module")
+def client():
+    with fake_backend(messages=3, attachments=2, attachment_bytes=1000) as client:
+        client.parse_locally = True
+        client.parse_processes = 1
+        yield client
+        client.close()
+
+
+def test_locally_parsed_attachments_have_ids(client):
+    message_id = client.list_emails(max_results=1)["messages"][0]["id"]
+    email = client.get_parsed_email(message_id)
+    assert [a["attachment_id"] for a in email["attachments"]] == [f"att-{message_id}-0", f"att-{message_id}-1"]
+
+
+def test_download_attachments_when_parsing_locally(client, tmp_path):
+    message_id = client.list_emails(max_results=1)["messages"][0]["id"]
+    paths = client.download_attachments([message_id], tmp_path)[message_id]
+    assert sorted(path.name for path in paths) == ["document_0.pdf", "document_1.pdf"]
+    assert [path.stat().st_size for path in paths] == [1000, 1000]
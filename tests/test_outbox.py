@@ -0,0 +1,51 @@
+import pytest
+from harness import fake_backend
+
+import backend
+import fake_gmail
+from pygmail import GmailClient
+from pygmail.outbox import account_of
+from pygmail.retry import RetryPolicy
+
+
+@pytest.fixture
+def client(tmp_path):
+    with fake_backend(messages=1) as client:
+        client.outbox_path = tmp_path / "outbox.db"
+        yield client
+        client.close()
+
+
+def test_account_of_reads_the_token_subject():
+    assert account_of(backend.make_jwt("alice")) == account_of(backend.make_jwt("alice"))
+    assert account_of(backend.make_jwt("alice")) == "alice"
+    assert account_of("not-a-jwt") != account_of("other-opaque-token")
+
+
+def test_flusher_sends_only_its_own_accounts_emails(client, tmp_path):
+    backend.save_token("other-user", fake_gmail.fake_token())
+    other = GmailClient(client.backend_url, session_file=tmp_path / "other.token", outbox_path=client.outbox_path, rpm=10 ** 9)
+    other.init(backend.make_jwt("other-user"))
+    try:
+        client._queue_email("a@example.com", "from bench-user", "hi", None, None, None, None, None, flush=False)
+        other._queue_email("b@example.com", "from other-user", "hi", None, None, None, None, None, flush=False)
+        other.outbox_flusher.interval = other.outbox_flusher.poll_interval = 0
+        counts = other.outbox_flusher.drain(timeout=30)
+    finally:
+        other.close()
+    assert sum(counts.values()) == 1 and not counts.get("queued")
+    mine = client.outbox.list(account=account_of(client.session_token))
+    assert [(e["subject"], e["status"]) for e in mine] == [("from bench-user", "queued")]
+
+
+def test_drain_gives_up_at_its_deadline(tmp_path):
+    client = GmailClient("http://127.0.0.1:9", session_file=tmp_path / "session.token", outbox_path=tmp_path / "outbox.db",
+                         retry=RetryPolicy(max_attempts=1))
+    client.session_token = "token"
+    client._queue_email("a@example.com", "hi", "hi", None, None, None, None, None, flush=False)
+    try:
+        counts = client.outbox_flusher.drain(timeout=1)
+    finally:
+        client.close()
+    assert counts == {"queued": 1}
+
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import pytest
+
+from pygmail.pool import GmailClientPool
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path / "home"))
+    return tmp_path / "home"
+
+
+def test_accounts_leave_the_default_session_alone(home, tmp_path):
+    default = home / ".pygmail" / "session.token"
+    default.parent.mkdir(parents=True)
+    default.write_text("mine")
+    token_file = tmp_path / "work.token"
+    token_file.write_text("work-token\n")
+
+    with GmailClientPool({"personal": "personal-token", "work": token_file}) as pool:
+        assert pool["personal"].session_token == "personal-token"
+        assert pool["work"].session_token == "work-token"
+        outboxes = {account: pool[account].outbox_path for account in pool.accounts}
+        for account in pool.accounts:
+            pool[account].outbox
+    assert default.read_text() == "mine"
+    assert outboxes == {
+        "personal": home / ".pygmail" / "personal.outbox.db",
+        "work": tmp_path / "work.outbox.db",
+    }
+    assert all(path.exists() for path in outboxes.values())
+    assert not (home / ".pygmail" / "session.outbox.db").exists()
+
+
+def test_shared_outbox_is_refused():
+    with pytest.raises(TypeError, match="outbox_path"):
+        GmailClientPool(["a.token"], outbox_path=Path("shared.db"))
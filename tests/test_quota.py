@@ -0,0 +1,60 @@
+import pytest
+
+from fake_gmail import http_error
+from quota import QuotaExceeded, QuotaTracker
+from state import MemoryStore
+
+
+class Refused:
+    methodId = "gmail.users.messages.get"
+
+    def __init__(self, reason="rateLimitExceeded"):
+        self.reason = reason
+
+    def execute(self):
+        raise http_error(429, self.reason)
+
+
+class Ok:
+    methodId = "gmail.users.messages.get"
+
+    def execute(self):
+        return {"ok": True}
+
+
+def tracker(**kwargs):
+    return QuotaTracker(MemoryStore(), user_limit=10_000, project_limit=10_000, retries=0, backoff=30, **kwargs)
+
+
+def refuse(quota, user_id):
+    with pytest.raises(QuotaExceeded):
+        quota.execute(Refused(), user_id)
+
+
+def test_one_refused_user_cools_down_alone():
+    quota = tracker()
+    refuse(quota, "heavy")
+    assert quota.execute(Ok(), "other") == {"ok": True}
+    with pytest.raises(QuotaExceeded) as e:
+        quota.execute(Ok(), "heavy")
+    assert e.value.scope == "user"
+
+
+def test_refusals_for_several_users_cool_down_the_project():
+    # a long refusal window, so the refusals can't straddle two of them
+    quota = tracker(project_refused_users=3, refusal_window=3600)
+    for user_id in ("a", "a", "b", "c"):
+        quota.store.set(f"quota:cooldown:{user_id}", "0")
+        refuse(quota, user_id)
+    with pytest.raises(QuotaExceeded) as e:
+        quota.execute(Ok(), "d")
+    assert e.value.scope == "project"
+
+
+def test_nearly_spent_project_cools_down_the_project():
+    quota = tracker()
+    quota.store.spend("quota:project", quota.window, quota.project_limit, 9_500)
+    refuse(quota, "a")
+    with pytest.raises(QuotaExceeded) as e:
+        quota.execute(Ok(), "b")
+    assert e.value.scope == "project"
@@ -0,0 +1,34 @@
+import os
+import time
+
+from response_cache import DiskTier, ResponseCache
+
+
+def identity(data):
+    return data
+
+
+def test_disk_hit_keeps_its_age_in_memory(tmp_path, monkeypatch):
+    disk = DiskTier(str(tmp_path), 10 ** 6, identity, identity)
+    ResponseCache(10 ** 6, 10 ** 6, ttl=60, disk=disk).put("alice", "key", b"body")
+    path = disk._path("alice", "key")
+    stored_at = time.time() - 59
+    os.utime(path, (stored_at, stored_at))
+
+    # a restarted process, with an empty memory tier
+    cache = ResponseCache(10 ** 6, 10 ** 6, ttl=60, disk=disk)
+    assert cache.get("alice", "key") == b"body"
+    assert cache._entries[("alice", "key")][1] == stored_at
+    # two seconds later it has been cached for longer than the TTL, in memory as on disk
+    now = time.time() + 2
+    monkeypatch.setattr(time, "time", lambda: now)
+    assert cache.get("alice", "key") is None
+
+
+def test_overwriting_a_disk_entry_keeps_the_byte_count(tmp_path):
+    disk = DiskTier(str(tmp_path), 10 ** 6, identity, identity)
+    for _ in range(5):
+        disk.put("alice", "key", b"x" * 1000)
+    assert disk.bytes == 1000
+    disk.put("alice", "key", b"x" * 10)
+    assert disk.bytes == 10
@@ -0,0 +1,49 @@
+import asyncio
+import socket
+
+import pytest
+
+from pygmail import GmailClient
+from pygmail.retry import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+
+def open_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record(False)
+    return breaker
+
+
+def test_cancelled_probe_releases_the_breaker(tmp_path):
+    # accepts connections but never answers
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    breaker = open_breaker()
+    client = GmailClient(backend_url=f"http://127.0.0.1:{server.getsockname()[1]}", session_file=tmp_path / "token",
+                         retry=RetryPolicy(max_attempts=1), breaker=breaker)
+    client.session_token = "token"
+
+    async def probe():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(client._response_async("GET", "/me"), 0.2)
+
+    try:
+        asyncio.run(probe())
+    finally:
+        server.close()
+    assert breaker.check() is True
+
+
+def test_probe_failing_outside_the_transport_releases_the_breaker(tmp_path):
+    class Broken:
+        def request(self, *args, **kwargs):
+            raise KeyboardInterrupt
+
+    breaker = open_breaker()
+    client = GmailClient(session_file=tmp_path / "token", retry=RetryPolicy(max_attempts=1), breaker=breaker, http=Broken())
+    client.session_token = "token"
+    with pytest.raises(KeyboardInterrupt):
+        client._request("GET", "/me")
+    assert breaker.check() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
@@ -0,0 +1,19 @@
+import time
+
+from send_queue import SendQueue
+
+
+def rows(queue):
+    return dict(queue._conn.execute("SELECT job_id, status FROM send_jobs").fetchall())
+
+
+def test_old_finished_jobs_are_deleted(tmp_path):
+    queue = SendQueue(str(tmp_path / "send_queue.db"), lambda user_id, body: {"id": "m"}, keep_finished=60)
+    sent, failed, waiting, recent = (queue.enqueue("alice", {"raw": str(i)}) for i in range(4))
+    for job_id, status in ((sent, "sent"), (failed, "failed"), (recent, "sent")):
+        queue._claim(job_id)
+        queue._finish(job_id, status)
+    with queue._conn:
+        queue._conn.execute("UPDATE send_jobs SET updated = ? WHERE job_id IN (?, ?, ?)", (time.time() - 120, sent, failed, waiting))
+    queue._prune()
+    assert rows(queue) == {waiting: "queued", recent: "sent"}
@@ -0,0 +1,87 @@
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+import resp_server
+import state
+
+
+@pytest.fixture
+def redis_store():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = resp_server.Server()
+    running = {}
+    started = threading.Event()
+
+    async def serve():
+        running["loop"], running["task"] = asyncio.get_running_loop(), asyncio.current_task()
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", port)
+        started.set()
+        async with listener:
+            await listener.serve_forever()
+
+    def run():
+        try:
+            asyncio.run(serve())
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    started.wait(5)
+    store = state.RedisStore(f"redis://127.0.0.1:{port}/0")
+    yield store
+    store._conn().close()
+    running["loop"].call_soon_threadsafe(running["task"].cancel)
+    thread.join(5)
+
+
+def test_redis_stats_count_keys(redis_store):
+    redis_store.set("a", "1")
+    redis_store.hit("window", 60, 5)
+    assert redis_store.stats() == {"values": 2}
+
+
+def test_redis_stats_survive_a_server_without_dbsize(redis_store, monkeypatch):
+    monkeypatch.delattr(resp_server.Database, "dbsize")
+    assert redis_store.stats() == {}
+    # the connection is still usable
+    redis_store.set("a", "1")
+    assert redis_store.get("a") == "1"
+
+
+def test_state_store_is_abstract():
+    with pytest.raises(TypeError):
+        state.StateStore()
+
+
+def test_redis_hit_never_counts_rejected_events(redis_store):
+    accepted, window = [], []
+
+    def hit():
+        store = state.RedisStore(f"redis://127.0.0.1:{redis_store._port}/0")
+        for _ in range(10):
+            if store.hit("window", 60, 15) is None:
+                accepted.append(1)
+            window.append(store._conn().command("ZCARD", "window"))
+
+    threads = [threading.Thread(target=hit) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(accepted) == 15
+    assert max(window) == 15
+    assert redis_store.hit("window", 60, 15) > 59
+
+
+def test_redis_hit_forgets_events_outside_the_window(redis_store):
+    assert redis_store.hit("window", 0.2, 1) is None
+    assert redis_store.hit("window", 0.2, 1) is not None
+    time.sleep(0.25)
+    assert redis_store.hit("window", 0.2, 1) is None